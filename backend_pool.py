@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Optional, Iterator
+from llm_backends import LLMBackend, LLMResponse, DEFAULT_MODEL
+
+
+class PoolOverloaded(Exception):
+    """Raised when a backend pool already has its maximum number of calls waiting"""
+
+
+class BackendPool:
+    def __init__(self, backend: LLMBackend, max_in_flight: int = 16, rate_limit: Optional[float] = None,
+                 burst: Optional[int] = None, max_queued: int = 1000):
+        """
+        Share one backend between many sessions.
+
+        Calls beyond max_in_flight wait in per-session queues. Free slots are
+        handed out round-robin across the sessions that are waiting, so a
+        session with many calls (e.g. a turn with many appraisals) cannot hold
+        up the others.
+
+        Args:
+            backend: Backend that answers every call
+            max_in_flight: Calls sent to the backend at the same time
+            rate_limit: Calls started per second across all sessions (None for no limit)
+            burst: Calls that may start back to back before rate_limit applies
+                (defaults to max_in_flight)
+            max_queued: Waiting calls allowed before new calls fail with PoolOverloaded
+        """
+        self.backend = backend
+        self.max_in_flight = max(1, max_in_flight)
+        self.rate_limit = rate_limit
+        self.burst = burst if burst is not None else self.max_in_flight
+        self.max_queued = max_queued
+
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # session id -> deque of waiting tickets, in round-robin order
+        self._queued = 0
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self.stats = {"calls": 0, "rejected": 0, "errors": 0, "peak_queued": 0, "wait_time": 0.0}
+
+    def handle(self, session_id: str) -> "PooledBackend":
+        """Backend for one session; all of its calls are scheduled as that session"""
+        return PooledBackend(self, session_id)
+
+    def queued(self) -> int:
+        with self._cond:
+            return self._queued
+
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._in_flight
+
+    def complete(self, session_id: str, messages: List[Dict[str, str]], **kwargs) -> LLMResponse:
+        self._acquire(session_id)
+        try:
+            return self.backend.complete(messages, **kwargs)
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self._release()
+
+    def stream(self, session_id: str, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        self._acquire(session_id)
+        try:
+            yield from self.backend.stream(messages, **kwargs)
+        finally:
+            self._release()
+
+    def close(self):
+        self.backend.close()
+
+    def _acquire(self, session_id: str):
+        """Wait until this call is the next one to run and a slot and rate token are free"""
+        start = time.monotonic()
+        with self._cond:
+            if self._queued >= self.max_queued:
+                self.stats["rejected"] += 1
+                raise PoolOverloaded(f"{self._queued} model calls already waiting")
+            ticket = object()
+            queue = self._queues.get(session_id)
+            if queue is None:
+                queue = self._queues[session_id] = deque()
+            queue.append(ticket)
+            self._queued += 1
+            self.stats["peak_queued"] = max(self.stats["peak_queued"], self._queued)
+
+            while True:
+                wait = self._wait_time()
+                next_session, next_queue = next(iter(self._queues.items()))
+                if wait == 0.0 and next_queue[0] is ticket:
+                    break
+                self._cond.wait(timeout=wait if wait > 0.0 else None)
+
+            # Take the slot and send this session to the back of the rotation
+            next_queue.popleft()
+            if next_queue:
+                self._queues.move_to_end(next_session)
+            else:
+                del self._queues[next_session]
+            self._queued -= 1
+            self._in_flight += 1
+            if self.rate_limit:
+                self._tokens -= 1.0
+            self.stats["calls"] += 1
+            self.stats["wait_time"] += time.monotonic() - start
+            self._cond.notify_all()
+
+    def _wait_time(self) -> float:
+        """0 when a call may start now, -1 to wait for a slot, otherwise seconds until the next rate token"""
+        if self._in_flight >= self.max_in_flight:
+            return -1.0
+        if not self.rate_limit:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens >= 1.0:
+            return 0.0
+        return (1.0 - self._tokens) / self.rate_limit
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _count(self, key: str):
+        with self._cond:
+            self.stats[key] += 1
+
+
+class PooledBackend(LLMBackend):
+    def __init__(self, pool: BackendPool, session_id: str):
+        """Per-session view of a BackendPool, usable wherever an LLMBackend is expected"""
+        self.pool = pool
+        self.session_id = session_id
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        return self.pool.complete(self.session_id, messages, model=model, temperature=temperature,
+                                  max_tokens=max_tokens, timeout=timeout)
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        return self.pool.stream(self.session_id, messages, model=model, temperature=temperature,
+                                max_tokens=max_tokens, timeout=timeout)
+
+    def discard(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                temperature: float = 0.7, max_tokens: int = 1000):
+        self.pool.backend.discard(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+    def close(self):
+        # The shared backend outlives any one session
+        pass
@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import queue
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from typing import Dict, List, Tuple, Any, Optional
+
+from character_world_classes import Character, World
+from story_engine import StoryEngine
+from llm_backends import LLMBackend, HTTPBackend, StubBackend
+
+
+def build_world(scenario: Any, seed: Optional[int] = None) -> Tuple[World, Optional[str]]:
+    """
+    Build a World from a scenario description.
+
+    Args:
+        scenario: Either "module:function" naming a builder that returns a World
+            (and takes a seed keyword when seed is given), or a dictionary with
+            setting, background, characters (name, emotions, beliefs, goals),
+            optional state and optional player_character
+        seed: Seed for the world's theory-of-mind variations (random if None)
+
+    Returns:
+        Tuple of (world, player character named by the scenario or None)
+    """
+    if isinstance(scenario, str):
+        module_name, _, function_name = scenario.partition(":")
+        builder = getattr(importlib.import_module(module_name), function_name)
+        return (builder() if seed is None else builder(seed=seed)), None
+
+    characters = [
+        Character(
+            name=spec["name"],
+            initial_emotions=dict(spec.get("emotions", {})),
+            initial_beliefs=dict(spec.get("beliefs", {})),
+            initial_goals={goal_type: dict(goals) for goal_type, goals in spec.get("goals", {}).items()}
+        )
+        for spec in scenario["characters"]
+    ]
+    world = World(setting=scenario["setting"], background=scenario.get("background", ""),
+                  characters=characters, seed=seed)
+    world.update_world_state(scenario.get("state", {}))
+    return world, scenario.get("player_character")
+
+
+def summarize_latencies(values: List[float]) -> Dict[str, float]:
+    """Mean and nearest-rank percentiles of a list of latencies in seconds"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": ordered[-1]
+    }
+
+
+def make_backend(options: Dict[str, Any]) -> LLMBackend:
+    if options.get("offline"):
+        return StubBackend(latency=options.get("stub_latency", 0.0), jitter=options.get("stub_jitter", 0.0))
+    return HTTPBackend(pool_size=max(10, options.get("sessions_per_worker", 1) * options.get("max_concurrency", 1)))
+
+
+def run_session(session: Dict[str, Any], backend: LLMBackend, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Play one scripted session to the end.
+
+    Args:
+        session: Dictionary with id, scenario, inputs and optional seed and player_character
+        backend: Backend shared by the sessions of this worker
+        options: Engine options (state_encoding, appraisal_mode, batch_appraisals, max_concurrency)
+
+    Returns:
+        Session record with per-turn transcript, final character states and timings.
+        A failed turn ends the session and is reported in the record's error.
+    """
+    record = {"session_id": session["id"], "turns": [], "error": None}
+    start = time.perf_counter()
+    engine = None
+    try:
+        # A per-session generator, so concurrent sessions never share global random state
+        seed = random.Random(session.get("seed", session["id"])).getrandbits(32)
+        world, scenario_player = build_world(session["scenario"], seed=seed)
+        player = session.get("player_character") or scenario_player or next(iter(world.characters))
+        engine = StoryEngine(
+            world, player,
+            backend=backend,
+            max_concurrency=options.get("max_concurrency", 1),
+            state_encoding=options.get("state_encoding", "full"),
+            appraisal_mode=options.get("appraisal_mode", "llm"),
+            batch_appraisals=options.get("batch_appraisals", False),
+            raise_errors=True
+        )
+
+        for turn, user_input in enumerate(session["inputs"]):
+            turn_start = time.perf_counter()
+            narrative, _ = engine.process_player_input(user_input)
+            player_done = time.perf_counter()
+            npc_narrative, _ = engine.generate_npc_actions()
+            turn_end = time.perf_counter()
+            record["turns"].append({
+                "turn": turn,
+                "input": user_input,
+                "narrative": narrative,
+                "npc_narrative": npc_narrative,
+                "player_latency": player_done - turn_start,
+                "npc_latency": turn_end - player_done,
+                "latency": turn_end - turn_start
+            })
+
+        record["final_state"] = {
+            "world_state": world.state,
+            "characters": {name: character.get_state_for_prompt() for name, character in world.characters.items()}
+        }
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if engine is not None:
+            engine.close()
+    record["duration"] = time.perf_counter() - start
+    return record
+
+
+async def _run_sessions_async(sessions: List[Dict[str, Any]], options: Dict[str, Any],
+                              records: Optional[Any] = None) -> List[Dict[str, Any]]:
+    """
+    Run sessions concurrently on threads, at most sessions_per_worker at a time,
+    putting each record on the records queue (if given) as soon as its session ends
+    """
+    backend = make_backend(options)
+    limit = asyncio.Semaphore(max(1, options.get("sessions_per_worker", 1)))
+
+    async def run_one(session: Dict[str, Any]) -> Dict[str, Any]:
+        async with limit:
+            record = await asyncio.to_thread(run_session, session, backend, options)
+        if records is not None:
+            records.put(record)
+        return record
+
+    try:
+        return await asyncio.gather(*(run_one(session) for session in sessions))
+    finally:
+        backend.close()
+
+
+def run_batch(sessions: List[Dict[str, Any]], options: Dict[str, Any],
+              records: Optional[Any] = None) -> List[Dict[str, Any]]:
+    """Process pool entry point: run a batch of sessions inside one worker"""
+    return asyncio.run(_run_sessions_async(sessions, options, records))
+
+
+def load_sessions(scripts_path: str, scenario: Any, repeat: int = 1) -> List[Dict[str, Any]]:
+    """
+    Read player input scripts. Each JSONL line is either a list of inputs or an
+    object with inputs and optional id, seed, scenario and player_character.
+    """
+    sessions = []
+    with open(scripts_path, "r", encoding="utf-8") as f:
+        scripts = [json.loads(line) for line in f if line.strip()]
+
+    for copy in range(repeat):
+        for index, script in enumerate(scripts):
+            if isinstance(script, list):
+                script = {"inputs": script}
+            base_id = script.get("id", f"script{index}")
+            session_id = f"{base_id}#{copy}" if repeat > 1 else str(base_id)
+            sessions.append({
+                "id": session_id,
+                "scenario": script.get("scenario", scenario),
+                "inputs": script["inputs"],
+                "seed": script.get("seed", f"{session_id}"),
+                "player_character": script.get("player_character")
+            })
+    return sessions
+
+
+def run_sessions(sessions: List[Dict[str, Any]], options: Dict[str, Any], output_path: str,
+                 workers: int = 1) -> Dict[str, Any]:
+    """
+    Run sessions across a process pool, appending each record to a JSONL file as
+    soon as its session finishes. Sessions lost with a crashed worker are
+    recorded as errors.
+
+    Returns:
+        Throughput and latency summary
+    """
+    batch_size = max(1, options.get("sessions_per_worker", 1))
+    batches = [sessions[i:i + batch_size] for i in range(0, len(sessions), batch_size)]
+    turn_latencies, session_durations = [], []
+    errors = 0
+    written = set()
+
+    def write(record: Dict[str, Any]):
+        nonlocal errors
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+        written.add(record["session_id"])
+        turn_latencies.extend(turn["latency"] for turn in record["turns"])
+        session_durations.append(record["duration"])
+        errors += record["error"] is not None
+
+    start = time.perf_counter()
+    with open(output_path, "w", encoding="utf-8") as out, Manager() as manager, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        records = manager.Queue()
+        futures = {pool.submit(run_batch, batch, options, records): batch for batch in batches}
+        while len(written) < len(sessions):
+            try:
+                write(records.get(timeout=0.1))
+            except queue.Empty:
+                if all(future.done() for future in futures):
+                    break
+        # Records put just before the last worker finished
+        while True:
+            try:
+                write(records.get_nowait())
+            except queue.Empty:
+                break
+        for future, batch in futures.items():
+            error = future.exception()
+            for session in batch:
+                if session["id"] not in written:
+                    write({"session_id": session["id"], "turns": [], "duration": 0.0,
+                           "error": f"{type(error).__name__}: {error}" if error else "Worker returned no record"})
+    wall_time = time.perf_counter() - start
+
+    return {
+        "sessions": len(sessions),
+        "errors": errors,
+        "turns": len(turn_latencies),
+        "wall_time": wall_time,
+        "sessions_per_sec": len(sessions) / wall_time if wall_time else 0.0,
+        "turns_per_sec": len(turn_latencies) / wall_time if wall_time else 0.0,
+        "turn_latency": summarize_latencies(turn_latencies),
+        "session_duration": summarize_latencies(session_durations)
+    }
+
+
+def main():
+    """Run scripted StoryEngine sessions headlessly"""
+    parser = argparse.ArgumentParser(description="Run scripted story sessions in parallel")
+    parser.add_argument("--scenario", default="main:setup_space_station_scenario",
+                        help="Scenario JSON file or module:function that builds a World")
+    parser.add_argument("--inputs", required=True,
+                        help="JSONL file of player input scripts (one session per line)")
+    parser.add_argument("--output", required=True, help="JSONL file for session transcripts")
+    parser.add_argument("--summary", default=None, help="Also write the summary JSON to this file")
+    parser.add_argument("--repeat", type=int, default=1, help="Run every script this many times")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--sessions-per-worker", type=int, default=8,
+                        help="Sessions each worker runs concurrently")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="Concurrent appraisals per turn")
+    parser.add_argument("--state-encoding", choices=["full", "compact"], default="full")
+    parser.add_argument("--appraisal-mode", choices=["llm", "rules", "auto"], default="llm")
+    parser.add_argument("--batch-appraisals", action="store_true")
+    parser.add_argument("--offline", action="store_true", help="Use the local stub backend")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Stub backend latency in seconds")
+    parser.add_argument("--stub-jitter", type=float, default=0.0, help="Stub backend latency jitter in seconds")
+    args = parser.parse_args()
+
+    scenario = args.scenario
+    if scenario.endswith(".json"):
+        with open(scenario, "r", encoding="utf-8") as f:
+            scenario = json.load(f)
+
+    options = {
+        "offline": args.offline,
+        "stub_latency": args.stub_latency,
+        "stub_jitter": args.stub_jitter,
+        "sessions_per_worker": args.sessions_per_worker,
+        "max_concurrency": args.max_concurrency,
+        "state_encoding": args.state_encoding,
+        "appraisal_mode": args.appraisal_mode,
+        "batch_appraisals": args.batch_appraisals
+    }
+    sessions = load_sessions(args.inputs, scenario, repeat=args.repeat)
+    summary = run_sessions(sessions, options, args.output, workers=args.workers)
+
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple, Any
+
+from benchmarks.story_loop import git_revision
+
+RESULTS_VERSION = 1
+
+DEFAULT_MODULES = ["character_world_classes", "story_engine"]
+# Client libraries that should only be imported once a model is called
+DEFERRED_MODULES = ["openai", "requests", "dotenv"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Args:
+        module: Module to import
+
+    Returns:
+        Tuple of (cumulative import time of the module in seconds,
+        (imported module, self microseconds, cumulative microseconds) for every import)
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=REPO_ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    total = next((cumulative for name, _, cumulative in imports if name == module), 0)
+    return total / 1e6, imports
+
+
+def benchmark_module(module: str, runs: int, top: int) -> Dict[str, Any]:
+    """
+    Cold-start import time of a module over several fresh interpreters.
+
+    Returns:
+        Median and spread of the import time, the imports with the largest
+        median self time, and which DEFERRED_MODULES were loaded
+    """
+    totals = []
+    self_times = {}
+    loaded = set()
+    for _ in range(runs):
+        total, imports = measure_import(module)
+        totals.append(total)
+        for name, self_us, _ in imports:
+            self_times.setdefault(name, []).append(self_us)
+            loaded.add(name)
+
+    slowest = sorted(((statistics.median(times), name) for name, times in self_times.items()), reverse=True)[:top]
+    return {
+        "module": module,
+        "runs": runs,
+        "import_time": {
+            "median": statistics.median(totals),
+            "min": min(totals),
+            "max": max(totals)
+        },
+        "slowest_imports": [{"module": name, "self_time": self_us / 1e6} for self_us, name in slowest],
+        "deferred_loaded": [name for name in DEFERRED_MODULES if name in loaded]
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare median import times module by module.
+
+    Returns:
+        One entry per module whose median import time grew by more than threshold
+    """
+    baseline_modules = {case["module"]: case for case in baseline["results"]}
+    regressions = []
+    for case in current["results"]:
+        old_case = baseline_modules.get(case["module"])
+        if old_case is None or not old_case["import_time"]["median"]:
+            continue
+        old_value = old_case["import_time"]["median"]
+        new_value = case["import_time"]["median"]
+        change = (new_value - old_value) / old_value
+        if change > threshold:
+            regressions.append({
+                "module": case["module"],
+                "metric": "import_time.median",
+                "baseline": old_value,
+                "current": new_value,
+                "change": change
+            })
+    return regressions
+
+
+def main():
+    """Benchmark the cold-start import time of the engine modules"""
+    parser = argparse.ArgumentParser(description="Cold-start import time of the engine modules")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="Comma-separated modules to import")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports listed per module")
+    parser.add_argument("--output", default=None, help="Write results JSON here instead of stdout")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    results = []
+    for module in [module for module in args.modules.split(",") if module]:
+        case = benchmark_module(module, max(1, args.runs), args.top)
+        results.append(case)
+        deferred = ", ".join(case["deferred_loaded"]) or "none"
+        print(f"{module}: {case['import_time']['median'] * 1000:.1f} ms median cold start, "
+              f"client libraries loaded: {deferred}", file=sys.stderr)
+
+    output = {
+        "version": RESULTS_VERSION,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            output["regressions"] = compare_results(json.load(f), output, args.threshold)
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if output.get("regressions"):
+        print(f"{len(output['regressions'])} module(s) regressed beyond {args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Tuple, Any, Optional, Callable, Iterator
+
+from character_world_classes import Character, World
+from story_engine import StoryEngine
+from llm_backends import LLMBackend, LLMResponse, StubBackend, DEFAULT_MODEL
+from response_cache import make_cache_key
+from batch_runner import summarize_latencies
+from response_parsing import extract_json
+
+RESULTS_VERSION = 1
+
+FIRST_NAMES = ["Ada", "Bao", "Cole", "Dara", "Eli", "Fay", "Gus", "Hana", "Ivo", "June",
+               "Kai", "Lena", "Milo", "Nia", "Otto", "Pia", "Quin", "Rosa", "Sol", "Tess"]
+LAST_NAMES = ["Voss", "Reyes", "Okafor", "Lind", "Tanaka", "Moreau", "Hale", "Novak"]
+EMOTIONS = ["calm", "anxiety", "suspicion", "hope", "fear", "trust"]
+PLAYER_INPUTS = [
+    "I check the reactor diagnostics.",
+    "I ask {other} about the missing logs.",
+    "I repair the oxygen line in the east corridor.",
+    "I accuse {other} of hiding something.",
+    "I share the sensor readings with everyone."
+]
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution.
+
+    Args:
+        spec: "fixed:SECONDS", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA"
+
+    Returns:
+        Function that draws a delay in seconds from a random generator
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, values[1]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class ReplayBackend(LLMBackend):
+    def __init__(self, latency: Callable[[random.Random], float], recordings: Optional[Dict[str, str]] = None,
+                 seed: int = 0):
+        """
+        Fake backend that answers from recorded responses and sleeps for a delay
+        drawn from a latency distribution. Prompts without a recording get the
+        stub backend's canned response, which is then recorded.
+
+        Args:
+            latency: Delay sampler, see parse_latency
+            recordings: Request key (response_cache.make_cache_key) -> response text
+            seed: Seed for the latency sampler and canned responses
+        """
+        self.latency = latency
+        self.recordings = recordings if recordings is not None else {}
+        self.responses = []  # every response text returned, for parse timing
+        self.replayed = 0
+        self.recorded = 0
+        self._stub = StubBackend(seed=seed)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        key = make_cache_key(model, {"temperature": temperature, "max_tokens": max_tokens}, messages)
+        with self._lock:
+            delay = self.latency(self._rng)
+            text = self.recordings.get(key)
+            if text is None:
+                text = self._stub.complete(messages, model=model).text
+                self.recordings[key] = text
+                self.recorded += 1
+            else:
+                self.replayed += 1
+            self.responses.append(text)
+        if delay > 0:
+            time.sleep(delay)
+        return LLMResponse(text=text, model=model, latency=delay)
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        yield self.complete(messages, model=model, temperature=temperature,
+                            max_tokens=max_tokens, timeout=timeout).text
+
+
+def load_recordings(path: str) -> Dict[str, str]:
+    """Read recorded responses from a JSONL file of {"key", "text"} records"""
+    recordings = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["key"]] = record["text"]
+    return recordings
+
+
+def save_recordings(path: str, recordings: Dict[str, str]):
+    with open(path, "w", encoding="utf-8") as f:
+        for key, text in recordings.items():
+            f.write(json.dumps({"key": key, "text": text}) + "\n")
+
+
+def make_world(cast_size: int, belief_count: int, history_length: int, seed: int = 0) -> World:
+    """
+    Build a synthetic scenario.
+
+    Args:
+        cast_size: Number of characters
+        belief_count: Beliefs per character
+        history_length: Events already in the world history
+        seed: Seed for the initial values
+
+    Returns:
+        World whose first character is the player
+    """
+    rng = random.Random(seed)
+    names = [f"{first} {last}" for last, first in itertools.product(LAST_NAMES, FIRST_NAMES)]
+    if cast_size > len(names):
+        names += [f"Crew {index}" for index in range(cast_size - len(names))]
+
+    characters = [
+        Character(
+            name=name,
+            initial_emotions={emotion: round(rng.random(), 2) for emotion in EMOTIONS},
+            initial_beliefs={f"belief_{index}": round(rng.random(), 2) for index in range(belief_count)},
+            initial_goals={
+                "task": {"fix_station": round(rng.random(), 2), "investigate_anomalies": round(rng.random(), 2)},
+                "emotional": {"maintain_crew_trust": round(rng.random(), 2)}
+            }
+        )
+        for name in names[:cast_size]
+    ]
+    world = World(setting="A research station", background="Systems are failing one by one.",
+                  characters=characters, seed=seed)
+    world.update_world_state({"life_support_hours_remaining": 24.0, "system_malfunctions": True})
+    for index in range(history_length):
+        world.add_to_history(f"Event {index}: {characters[index % cast_size].name} checks the logs.")
+    return world
+
+
+def parse_response(text: str) -> Any:
+    """Extract and decode a response the way the engine does"""
+    return extract_json(text)
+
+
+def run_story_loop(backend: LLMBackend, cast_size: int, belief_count: int, history_length: int,
+                   turns: int, options: Dict[str, Any]) -> Tuple[StoryEngine, List[float], List[float]]:
+    """Play scripted turns and return the engine (for the caller to close) with turn and appraisal latencies"""
+    world = make_world(cast_size, belief_count, history_length, seed=options["seed"])
+    names = list(world.characters)
+    engine = StoryEngine(
+        world, names[0],
+        backend=backend,
+        max_concurrency=options["max_concurrency"],
+        state_encoding=options["state_encoding"],
+        appraisal_mode=options["appraisal_mode"],
+        batch_appraisals=options["batch_appraisals"]
+    )
+
+    turn_latencies = []
+    for turn in range(turns):
+        other = names[1 + turn % (len(names) - 1)] if len(names) > 1 else names[0]
+        user_input = PLAYER_INPUTS[turn % len(PLAYER_INPUTS)].format(other=other)
+        start = time.perf_counter()
+        engine.process_player_input(user_input)
+        engine.generate_npc_actions()
+        turn_latencies.append(time.perf_counter() - start)
+
+    # Single appraisals, measured on their own
+    appraisal_latencies = []
+    for turn in range(turns):
+        character = world.characters[names[turn % len(names)]]
+        start = time.perf_counter()
+        engine.appraisal_model.appraise_action(character, world, PLAYER_INPUTS[turn % len(PLAYER_INPUTS)]
+                                               .format(other=names[0]))
+        appraisal_latencies.append(time.perf_counter() - start)
+
+    return engine, turn_latencies, appraisal_latencies
+
+
+def benchmark_case(cast_size: int, belief_count: int, history_length: int, turns: int,
+                   options: Dict[str, Any], recordings: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Benchmark one configuration: a timed run, then a second run under
+    tracemalloc for peak memory.
+    """
+    backend = ReplayBackend(options["latency"], recordings, seed=options["seed"])
+    start = time.perf_counter()
+    engine, turn_latencies, appraisal_latencies = run_story_loop(
+        backend, cast_size, belief_count, history_length, turns, options)
+    elapsed = time.perf_counter() - start
+
+    try:
+        parse_times = []
+        for text in backend.responses:
+            parse_start = time.perf_counter()
+            try:
+                parse_response(text)
+            except ValueError:
+                pass
+            parse_times.append(time.perf_counter() - parse_start)
+
+        tracemalloc.start()
+        memory_engine, _, _ = run_story_loop(ReplayBackend(lambda rng: 0.0, recordings, seed=options["seed"]),
+                                             cast_size, belief_count, history_length, turns, options)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory_engine.close()
+
+        totals = engine.encoder.totals
+        return {
+            "cast_size": cast_size,
+            "belief_count": belief_count,
+            "history_length": history_length,
+            "turns": turns,
+            "elapsed": elapsed,
+            "turns_per_sec": turns / sum(turn_latencies) if turn_latencies and sum(turn_latencies) else 0.0,
+            "turn_latency": summarize_latencies(turn_latencies),
+            "appraisal_latency": summarize_latencies(appraisal_latencies),
+            "llm_calls": len(backend.responses),
+            "replayed_responses": backend.replayed,
+            "prompt_bytes": {
+                "total": totals["bytes"],
+                "per_prompt": totals["bytes"] / totals["prompts"] if totals["prompts"] else 0.0,
+                "tokens": totals["tokens"],
+                "by_channel": {channel: stats["bytes"] for channel, stats in engine.encoder.prompt_stats.items()
+                               if not channel.startswith("appraisal:") or channel == "appraisal:batch"}
+            },
+            "parse_time": {
+                "total": sum(parse_times),
+                "mean": sum(parse_times) / len(parse_times) if parse_times else 0.0,
+                "responses": len(parse_times)
+            },
+            "appraisal_stats": dict(engine.appraisal_model.stats),
+            "peak_memory_bytes": peak_memory
+        }
+    finally:
+        engine.close()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Metrics compared against a baseline, and whether larger values are better
+COMPARED_METRICS = {
+    ("turns_per_sec",): True,
+    ("turn_latency", "p50"): False,
+    ("turn_latency", "p99"): False,
+    ("appraisal_latency", "p50"): False,
+    ("prompt_bytes", "total"): False,
+    ("parse_time", "total"): False,
+    ("peak_memory_bytes",): False
+}
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare two result files case by case.
+
+    Args:
+        baseline: Results from an earlier version
+        current: Results from this version
+        threshold: Relative change beyond which a metric counts as a regression
+
+    Returns:
+        One entry per regressed metric with the baseline value, current value and relative change
+    """
+    def case_key(case: Dict[str, Any]) -> Tuple[int, int, int, int]:
+        return (case["cast_size"], case["belief_count"], case["history_length"], case["turns"])
+
+    baseline_cases = {case_key(case): case for case in baseline["results"]}
+    regressions = []
+    for case in current["results"]:
+        old_case = baseline_cases.get(case_key(case))
+        if old_case is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            old_value, new_value = old_case, case
+            for key in path:
+                old_value = old_value.get(key) if isinstance(old_value, dict) else None
+                new_value = new_value.get(key) if isinstance(new_value, dict) else None
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append({
+                    "case": dict(zip(("cast_size", "belief_count", "history_length", "turns"), case_key(case))),
+                    "metric": ".".join(path),
+                    "baseline": old_value,
+                    "current": new_value,
+                    "change": change
+                })
+    return regressions
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    """Benchmark the story loop against a local fake model"""
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the story loop")
+    parser.add_argument("--cast-sizes", type=int_list, default=[3, 10])
+    parser.add_argument("--belief-counts", type=int_list, default=[4, 16])
+    parser.add_argument("--history-lengths", type=int_list, default=[0, 500])
+    parser.add_argument("--turns", type=int, default=5, help="Turns per configuration")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="Fake model latency: fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--recordings", default=None,
+                        help="JSONL of recorded responses to replay; responses not yet recorded are added to it")
+    parser.add_argument("--state-encoding", choices=["full", "compact"], default="full")
+    parser.add_argument("--appraisal-mode", choices=["llm", "rules", "auto"], default="llm")
+    parser.add_argument("--batch-appraisals", action="store_true")
+    parser.add_argument("--max-concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results JSON here instead of stdout")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    options = {
+        "latency": parse_latency(args.latency),
+        "state_encoding": args.state_encoding,
+        "appraisal_mode": args.appraisal_mode,
+        "batch_appraisals": args.batch_appraisals,
+        "max_concurrency": args.max_concurrency,
+        "seed": args.seed
+    }
+    recordings = load_recordings(args.recordings) if args.recordings and os.path.exists(args.recordings) else {}
+    recorded_before = len(recordings)
+
+    results = []
+    for cast_size, belief_count, history_length in itertools.product(
+            args.cast_sizes, args.belief_counts, args.history_lengths):
+        random.seed(args.seed)
+        case = benchmark_case(cast_size, belief_count, history_length, args.turns, options, recordings)
+        results.append(case)
+        print(f"cast={cast_size} beliefs={belief_count} history={history_length}: "
+              f"{case['turns_per_sec']:.1f} turns/s, p99 {case['turn_latency']['p99'] * 1000:.1f} ms",
+              file=sys.stderr)
+
+    if args.recordings and len(recordings) > recorded_before:
+        save_recordings(args.recordings, recordings)
+
+    output = {
+        "version": RESULTS_VERSION,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            output["regressions"] = compare_results(json.load(f), output, args.threshold)
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if output.get("regressions"):
+        print(f"{len(output['regressions'])} metric(s) regressed beyond {args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
+import copy
+import itertools
 import random
-from typing import Dict, List, Tuple, Any, Optional
+import re
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Tuple, Any, Optional, Iterable, Iterator
 import json
+import numpy as np
+from state_store import StateStore, StateView, GoalsView, TheoryOfMindView
 
 class Character:
     def __init__(self, name: str, initial_emotions: Dict[str, float], 
@@ -9,6 +15,11 @@ class Character:
         """
         Initialize a character with name, emotions, beliefs, and goals.
         
+        The character's state lives in a StateStore. A new character gets a
+        private one-row store; joining a World moves it into the World's shared
+        store. emotions, beliefs, goals and theory_of_mind are dictionary views
+        over that store.
+        
         Args:
             name: Character's name
             initial_emotions: Dictionary of emotions and their intensity (0.0 to 1.0)
@@ -16,75 +27,249 @@ class Character:
             initial_goals: Dictionary of goals categorized as task or emotional with priority
         """
         self.name = name
+        self.store = StateStore(row_capacity=1)
+        self.row = self.store.add_row(name)
         self.emotions = initial_emotions  # e.g., {"fear": 0.2, "suspicion": 0.5}
         self.beliefs = initial_beliefs    # e.g., {"station_safe": 0.8, "sid_hiding": 0.5}
         self.goals = initial_goals        # e.g., {"task": {"fix_station": 0.9}, "emotional": {"maintain_authority": 0.8}}
-        self.theory_of_mind = {}          # Will store beliefs about other characters' beliefs
+        # theory_of_mind stores beliefs about other characters' beliefs
+    
+    @property
+    def emotions(self) -> StateView:
+        return StateView(self.store, "emotions", self.row)
+    
+    @emotions.setter
+    def emotions(self, emotions: Dict[str, float]):
+        self.store.clear_row("emotions", self.row)
+        self.store.update_row("emotions", self.row, dict(emotions), clamp=False)
+    
+    @property
+    def beliefs(self) -> StateView:
+        return StateView(self.store, "beliefs", self.row)
+    
+    @beliefs.setter
+    def beliefs(self, beliefs: Dict[str, float]):
+        self.store.clear_row("beliefs", self.row)
+        self.store.update_row("beliefs", self.row, dict(beliefs), clamp=False)
+    
+    @property
+    def goals(self) -> GoalsView:
+        return GoalsView(self.store, self.row)
+    
+    @goals.setter
+    def goals(self, goals: Dict[str, Dict[str, float]]):
+        self.store.clear_row("goals", self.row)
+        for goal_type in goals:
+            self.store.add_goal_type(goal_type)
+        self.store.update_row("goals", self.row, self._flatten_goals(goals), clamp=False)
+    
+    @property
+    def theory_of_mind(self) -> TheoryOfMindView:
+        return TheoryOfMindView(self.store, self.row)
+    
+    @theory_of_mind.setter
+    def theory_of_mind(self, theory_of_mind: Dict[str, Dict[str, float]]):
+        self.store.clear_tom(self.row)
+        self.store.update_tom(self.row, dict(theory_of_mind), clamp=False)
+    
+    @classmethod
+    def bind(cls, name: str, store: StateStore) -> "Character":
+        """Character backed by an existing row of a store (used by forked Worlds)"""
+        character = cls.__new__(cls)
+        character.name = name
+        character.store = store
+        character.row = store.rows.get(name)
+        return character
+    
+    def attach(self, store: StateStore):
+        """Move this character's state into a shared store (used when joining a World)"""
+        if store is self.store:
+            return
+        emotions = self.store.row_dict("emotions", self.row)
+        beliefs = self.store.row_dict("beliefs", self.row)
+        goals = self.store.goals_dict(self.row)
+        # Default entries depend on the old store's seed, so carry over the values themselves
+        theory_of_mind = self.store.tom_dict(self.row)
+        
+        self.store = store
+        self.row = store.add_row(self.name)
+        self.emotions = emotions
+        self.beliefs = beliefs
+        self.goals = goals
+        self.theory_of_mind = theory_of_mind
+    
+    @staticmethod
+    def _flatten_goals(goals: Dict[str, Dict[str, float]]) -> Dict[Tuple[str, str], float]:
+        return {(goal_type, goal): value for goal_type, type_goals in goals.items()
+                for goal, value in type_goals.items()}
         
     def initialize_theory_of_mind(self, other_characters: List["Character"]):
-        """Initialize beliefs about what other characters believe"""
-        for character in other_characters:
-            if character.name != self.name:
-                self.theory_of_mind[character.name] = {}
-                # For each belief this character has
-                for belief_key, belief_value in self.beliefs.items():
-                    # Initialize a belief about what the other character thinks
-                    # This could be the same or different from their own belief
-                    variation = random.uniform(-0.2, 0.2)  # Add some variation
-                    tom_value = max(0.0, min(1.0, belief_value + variation))  # Keep within [0,1]
-                    
-                    # Store what this character thinks the other character believes
-                    self.theory_of_mind[character.name][belief_key] = tom_value
+        """
+        Initialize beliefs about what other characters believe.
+        
+        Nothing is copied up front: each belief about another character defaults
+        to this character's own belief plus a seeded variation, kept within [0,1],
+        and is only stored once it is read or updated.
+        """
+        self.store.set_tom_defaults(self.row, {character.name: None for character in other_characters})
     
     def update_state(self, new_emotions: Dict[str, float], new_beliefs: Dict[str, float], 
                      new_tom: Dict[str, Dict[str, float]], new_goals: Dict[str, Dict[str, float]]):
         """Update character's emotional state, beliefs, theory of mind, and goals"""
-        # Update emotions
-        for emotion, value in new_emotions.items():
-            if emotion in self.emotions:
-                self.emotions[emotion] = max(0.0, min(1.0, value))  # Keep within [0,1]
-            else:
-                self.emotions[emotion] = value
+        # Update emotions (existing emotions are kept within [0,1], new ones are stored as given)
+        self.store.update_row("emotions", self.row, new_emotions, clamp_existing_only=True)
         
         # Update beliefs
-        for belief, value in new_beliefs.items():
-            self.beliefs[belief] = max(0.0, min(1.0, value))  # Keep within [0,1]
+        self.store.update_row("beliefs", self.row, new_beliefs)
         
         # Update theory of mind
-        for character_name, beliefs in new_tom.items():
-            if character_name not in self.theory_of_mind:
-                self.theory_of_mind[character_name] = {}
-            for belief, value in beliefs.items():
-                self.theory_of_mind[character_name][belief] = max(0.0, min(1.0, value))
+        self.store.update_tom(self.row, new_tom)
         
         # Update goals
-        for goal_type, goals in new_goals.items():
-            if goal_type not in self.goals:
-                self.goals[goal_type] = {}
-            for goal, value in goals.items():
-                self.goals[goal_type][goal] = max(0.0, min(1.0, value))
-    
-    def get_state_for_prompt(self) -> Dict[str, Any]:
-        """Return a formatted version of the character state for GPT prompting"""
+        for goal_type in new_goals:
+            self.store.add_goal_type(goal_type)
+        self.store.update_row("goals", self.row, self._flatten_goals(new_goals))
+    
+    def get_state_for_prompt(self, tom_targets: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Return a formatted version of the character state for GPT prompting.
+        
+        Args:
+            tom_targets: Characters whose theory-of-mind entries matter for the
+                current action. None includes only entries that have already
+                been read or updated.
+        """
+        if tom_targets is None:
+            theory_of_mind = self.store.tom_explicit_dict(self.row)
+        else:
+            theory_of_mind = self.store.tom_dict(self.row, targets=tom_targets)
+        
         return {
             "name": self.name,
-            "emotions": self.emotions,
-            "beliefs": self.beliefs,
-            "theory_of_mind": self.theory_of_mind,
-            "goals": self.goals
+            "emotions": self.store.row_dict("emotions", self.row),
+            "beliefs": self.store.row_dict("beliefs", self.row),
+            "theory_of_mind": theory_of_mind,
+            "goals": self.store.goals_dict(self.row)
         }
     
     def __str__(self) -> str:
         """String representation of character for debugging"""
+        state = self.get_state_for_prompt(tom_targets=self.store.tom_targets_of(self.row))
         return (f"Character: {self.name}\n"
-                f"Emotions: {json.dumps(self.emotions, indent=2)}\n"
-                f"Beliefs: {json.dumps(self.beliefs, indent=2)}\n"
-                f"Theory of Mind: {json.dumps(self.theory_of_mind, indent=2)}\n"
-                f"Goals: {json.dumps(self.goals, indent=2)}")
+                f"Emotions: {json.dumps(state['emotions'], indent=2)}\n"
+                f"Beliefs: {json.dumps(state['beliefs'], indent=2)}\n"
+                f"Theory of Mind: {json.dumps(state['theory_of_mind'], indent=2)}\n"
+                f"Goals: {json.dumps(state['goals'], indent=2)}")
+
+
+class History(Sequence):
+    def __init__(self, base: Sequence = (), length: Optional[int] = None):
+        """
+        Append-only event list that shares its start with another history.
+        
+        A forked World's history sees the first length events of base (the
+        events up to the fork) and keeps the events added after the fork in
+        its own list. Events base gains later are not seen.
+        
+        Args:
+            base: History (or list) of the world this one was forked from
+            length: Number of events of base to include (defaults to all of them)
+        """
+        self._base = base
+        self._length = len(base) if length is None else length
+        self._tail = []
+    
+    def append(self, event: Any):
+        self._tail.append(event)
+    
+    def __len__(self) -> int:
+        return self._length + len(self._tail)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            head = list(self._base[start:min(stop, self._length)]) if start < self._length else []
+            return head + self._tail[max(0, start - self._length):max(0, stop - self._length)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        if index < self._length:
+            return self._base[index]
+        return self._tail[index - self._length]
+    
+    def __iter__(self) -> Iterator[Any]:
+        yield from itertools.islice(self._base, self._length)
+        yield from self._tail
+    
+    def search(self, text: str, k: int = 5, characters: Iterable[str] = (),
+               limit: Optional[int] = None, exclude_recent: int = 0) -> List[Tuple[int, float]]:
+        """Search the shared events when base has an index (see history_index.HistoryStore.search)"""
+        search = getattr(self._base, "search", None)
+        if search is None:
+            return []
+        length = self._length if limit is None else min(limit, self._length)
+        # Events added since the fork are the most recent ones
+        return search(text, k, characters, limit=length, exclude_recent=max(0, exclude_recent - len(self._tail)))
+    
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Sequence) and list(self) == list(other)
+    
+    def __repr__(self) -> str:
+        return repr(list(self))
+    
+    def __reduce__(self):
+        # Saved on its own, without the history it was forked from
+        return list, (list(self),)
+
+
+class ForkedCharacters(Mapping):
+    def __init__(self, characters: Mapping, store: StateStore):
+        """
+        Characters of a forked World. The names are shared with the world it
+        was forked from; each Character is bound to the fork's store the first
+        time it is looked up, so forking does not touch every character.
+        
+        Args:
+            characters: Characters of the world being forked
+            store: The fork's state store
+        """
+        self._names = characters._names if isinstance(characters, ForkedCharacters) else characters
+        self._store = store
+        self._bound = {}
+    
+    def __getitem__(self, name: str) -> Character:
+        character = self._bound.get(name)
+        if character is None:
+            if name not in self._names:
+                raise KeyError(name)
+            character = self._bound[name] = Character.bind(name, self._store)
+        return character
+    
+    def __contains__(self, name: object) -> bool:
+        return name in self._names
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+    
+    def __len__(self) -> int:
+        return len(self._names)
+    
+    def __reduce__(self):
+        # Saved as a plain dictionary, without the world it was forked from
+        return dict, (list(self.items()),)
 
 
 class World:
-    def __init__(self, setting: str, background: str, characters: List[Character]):
+    # Attributes shared with a fork until one side writes to them
+    _shared = frozenset()
+    # Event log receiving every change (see event_log.EventLog.attach)
+    log = None
+    
+    def __init__(self, setting: str, background: str, characters: List[Character],
+                 seed: Optional[int] = None):
         """
         Initialize the world with setting, background story, and characters.
         
@@ -92,6 +277,7 @@ class World:
             setting: Brief description of the world setting
             background: Background story information
             characters: List of Character objects in this world
+            seed: Seed for the theory-of-mind variations (drawn from random if None)
         """
         self.setting = setting
         self.background = background
@@ -99,28 +285,144 @@ class World:
         self.state = {}  # Will store world state variables
         self.history = []  # Store a history of events and interactions
         
-        # Initialize Theory of Mind for all characters
+        # Move every character's state into one shared array store
+        tom_seed = seed if seed is not None else random.getrandbits(32)
+        self.store = StateStore(row_capacity=max(1, len(characters)), tom_seed=tom_seed)
         for character in characters:
-            character.initialize_theory_of_mind(characters)
+            character.attach(self.store)
+        
+        # Initialize Theory of Mind for all characters (one target set shared by everyone)
+        cast = {character.name: None for character in characters}
+        for character in characters:
+            self.store.set_tom_defaults(character.row, cast)
+    
+    def fork(self) -> "World":
+        """
+        Branch the world for "what if" exploration, e.g. lookahead over
+        possible player actions.
+        
+        The fork shares everything with this world and takes its own copy of
+        a part only when one of them writes to it (see StateStore.fork). Its
+        history shares the events up to the fork. Forking takes the same time
+        for any cast size or history length. Changes made on either side
+        after the fork are not seen by the other. The fork does not write to
+        this world's event log.
+        
+        Returns:
+            A World that starts out equal to this one
+        """
+        fork = copy.copy(self)
+        fork.store = self.store.fork()
+        fork.characters = ForkedCharacters(self.characters, fork.store)
+        fork.history = History(self.history)
+        fork.log = None
+        self._shared = fork._shared = frozenset(("state",))
+        return fork
     
     def update_world_state(self, new_state: Dict[str, Any]):
         """Update the world state with new information"""
+        if "state" in self._shared:
+            self.state = dict(self.state)
+            self._shared = self._shared - {"state"}
         for key, value in new_state.items():
             self.state[key] = value
+        if self.log is not None and new_state:
+            self.log.record({"e": "state", "u": new_state})
+    
+    def bulk_update_characters(self, dimension: str, updates: Dict[str, Dict[Any, float]], clamp: bool = True):
+        """
+        Apply one dimension's updates for many characters in a single vectorized write.
+        
+        Args:
+            dimension: "emotions", "beliefs" or "goals" (goal keys are (goal_type, goal) tuples)
+            updates: Character name -> {key: new value}
+            clamp: Clamp the new values to [0, 1]
+        """
+        rows, columns, values = [], [], []
+        for name, character_updates in updates.items():
+            row = self.characters[name].row
+            if dimension == "goals":
+                for goal_type, _ in character_updates:
+                    self.store.add_goal_type(goal_type)
+            for key, value in character_updates.items():
+                rows.append(row)
+                columns.append(self.store.column(dimension, key))
+                values.append(value)
+        if values:
+            self.store.bulk_update(dimension, np.array(rows, dtype=np.intp),
+                                   np.array(columns, dtype=np.intp), np.array(values, dtype=float), clamp=clamp)
     
     def add_to_history(self, event: str):
         """Add an event to the world history"""
         self.history.append(event)
+        if self.log is not None:
+            self.log.record({"e": "history", "x": event})
     
-    def get_state_for_prompt(self) -> Dict[str, Any]:
-        """Return a formatted version of the world state for GPT prompting"""
-        return {
+    def index_history(self, path: str, hot_events: int = 200):
+        """
+        Keep the history in a history_index.HistoryStore: older events move to
+        a file at path and an index finds those relevant to an action. Prompts
+        then carry the relevant earlier events next to the recent ones.
+        
+        Args:
+            path: File for events no longer kept in memory
+            hot_events: Most recent events kept in memory
+        """
+        from history_index import HistoryStore  # imports prompt_builder, which imports this module
+        store = HistoryStore(path, hot_events=hot_events, mentioned=self.mentioned_characters)
+        for event in self.history:
+            store.append(event)
+        self.history = store
+    
+    def relevant_history(self, action: str, k: int = 3, exclude_recent: int = 5,
+                         characters: Iterable[str] = ()) -> List[Any]:
+        """
+        Earlier events most relevant to an action, oldest first. Empty unless
+        the history is indexed (see index_history).
+        
+        Args:
+            action: Text to match against the events
+            k: Most events to return
+            exclude_recent: Newest events to skip, as prompts already carry them
+            characters: Names to match besides those mentioned in the action
+        """
+        search = getattr(self.history, "search", None)
+        if search is None or not action:
+            return []
+        hits = search(action, k=k, characters=characters, exclude_recent=exclude_recent)
+        return [self.history[index] for index in sorted(index for index, _ in hits)]
+    
+    def mentioned_characters(self, text: str) -> List[str]:
+        """Return the characters named in a piece of text, by full name or last name"""
+        mentioned = []
+        for name in self.characters:
+            last_name = name.split()[-1]
+            pattern = rf"\b({re.escape(name)}|{re.escape(last_name)})\b"
+            if re.search(pattern, text, re.IGNORECASE):
+                mentioned.append(name)
+        return mentioned
+    
+    def get_state_for_prompt(self, action: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Return a formatted version of the world state for GPT prompting.
+        
+        Args:
+            action: The action the prompt is about. Theory-of-mind entries about
+                the characters it mentions are included; without an action only
+                entries that have already been read or updated are.
+        """
+        tom_targets = self.mentioned_characters(action) if action else None
+        state = {
             "setting": self.setting,
             "background": self.background,
             "state": self.state,
-            "characters": {name: char.get_state_for_prompt() for name, char in self.characters.items()},
+            "characters": {name: char.get_state_for_prompt(tom_targets) for name, char in self.characters.items()},
             "recent_history": self.history[-5:] if self.history else []  # Last 5 events or empty list
         }
+        relevant = self.relevant_history(action) if action else []
+        if relevant:
+            state["relevant_history"] = relevant
+        return state
     
     def __str__(self) -> str:
         """String representation of world for debugging"""
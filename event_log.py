@@ -0,0 +1,344 @@
+import argparse
+import bisect
+import json
+import mmap
+import os
+import re
+import threading
+from typing import Dict, List, Tuple, Any, Optional, Iterator
+
+import numpy as np
+
+from character_world_classes import Character, World
+
+DEFAULT_SNAPSHOT_INTERVAL = 20
+# Every line starts with its event type, so lines of one type can be found with byte searches
+TURN_MARKER = b'{"e":"turn"'
+SNAPSHOT_MARKER = b'{"e":"snapshot"'
+HISTORY_MARKER = b'{"e":"history"'
+SNAPSHOT_TURN = re.compile(rb'\{"e":"snapshot","t":(\d+)')
+
+
+def world_to_dict(world: World) -> Dict[str, Any]:
+    """
+    Serialize everything about a world except its history to JSON types.
+
+    Theory of mind is saved as stored (default targets plus explicit entries),
+    so restored defaults keep following the observers' own beliefs.
+    """
+    store = world.store
+    belief_keys = store.columns["beliefs"].keys
+    characters = []
+    for name, character in world.characters.items():
+        row = character.row
+        characters.append({
+            "name": name,
+            "emotions": store.row_dict("emotions", row),
+            "beliefs": store.row_dict("beliefs", row),
+            "goals": store.goals_dict(row),
+            "tom_targets": list(store.tom_defaults[row]) if row in store.tom_defaults else None,
+            "tom_entries": {
+                target: {belief_keys[column]: None if np.isnan(value) else value for column, value in beliefs.items()}
+                for target, beliefs in store.tom_entries.get(row, {}).items()
+            }
+        })
+    return {
+        "setting": world.setting,
+        "background": world.background,
+        "state": world.state,
+        "tom_seed": store.tom_seed,
+        "goal_types": list(store.goal_types),
+        "characters": characters
+    }
+
+
+def world_from_dict(data: Dict[str, Any], history: Optional[List[Any]] = None) -> World:
+    """Rebuild a world saved with world_to_dict"""
+    characters = [Character(entry["name"], entry["emotions"], entry["beliefs"], entry["goals"])
+                  for entry in data["characters"]]
+    world = World(data["setting"], data["background"], characters, seed=data["tom_seed"])
+    world.state = dict(data["state"])
+    world.history = list(history or [])
+
+    store = world.store
+    for goal_type in data["goal_types"]:
+        store.add_goal_type(goal_type)
+    target_sets = {}  # identical default target sets are shared, as in World.__init__
+    for entry, character in zip(data["characters"], characters):
+        targets = entry["tom_targets"]
+        if targets is None:
+            store.clear_tom(character.row)
+        else:
+            store.set_tom_defaults(character.row, target_sets.setdefault(tuple(targets), dict.fromkeys(targets)))
+        store.tom_entries[character.row] = {
+            target: {store.column("beliefs", belief): np.nan if value is None else value
+                     for belief, value in beliefs.items()}
+            for target, beliefs in entry["tom_entries"].items()
+        }
+    return world
+
+
+def apply_event(world: World, event: Dict[str, Any]):
+    """Replay one recorded event onto a world"""
+    store = world.store
+    kind = event["e"]
+    if kind == "history":
+        world.add_to_history(event["x"])
+    elif kind == "state":
+        world.update_world_state(event["u"])
+    elif kind == "set":
+        keys = _keys(event["d"], event["k"])
+        store.update_row(event["d"], store.rows.get(event["c"]), dict(zip(keys, event["v"])), clamp=False)
+    elif kind == "bulk":
+        rows = np.array([store.rows.get(name) for name in event["c"]], dtype=np.intp)
+        columns = np.array([store.column(event["d"], key) for key in _keys(event["d"], event["k"])], dtype=np.intp)
+        store.bulk_update(event["d"], rows, columns, np.array(event["v"], dtype=float), clamp=False)
+    elif kind == "clear":
+        store.clear_row(event["d"], store.rows.get(event["c"]))
+    elif kind == "delete":
+        store.delete(event["d"], store.rows.get(event["c"]), _keys(event["d"], [event["k"]])[0])
+    elif kind == "clamp":
+        store.clamp(event["d"])
+    elif kind == "goal_type":
+        store.add_goal_type(event["g"])
+    elif kind == "tom":
+        store.update_tom(store.rows.get(event["c"]), event["u"], clamp=False)
+    elif kind == "tom_set":
+        store.tom_entries.setdefault(store.rows.get(event["c"]), {})[event["t"]] = {
+            store.column("beliefs", belief): np.nan if value is None else value
+            for belief, value in event["v"].items()
+        }
+    elif kind == "tom_delete":
+        store.delete_tom(store.rows.get(event["c"]), event["t"], store.column("beliefs", event["b"]))
+    elif kind == "tom_remove":
+        store.remove_tom_target(store.rows.get(event["c"]), event["t"])
+    elif kind == "tom_clear":
+        store.clear_tom(store.rows.get(event["c"]))
+    elif kind == "tom_targets":
+        store.set_tom_defaults(store.rows.get(event["c"]), dict.fromkeys(event["t"]))
+    elif kind not in ("turn", "snapshot"):
+        raise ValueError(f"Unknown event type: {kind}")
+
+
+def _keys(dimension: str, keys: List[Any]) -> List[Any]:
+    # Goal keys are (goal_type, goal) tuples, which JSON stores as lists
+    return [tuple(key) for key in keys] if dimension == "goals" else keys
+
+
+class EventLog:
+    def __init__(self, path: str, snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL):
+        """
+        Append-only log of every change to a World.
+
+        Each change is one compact JSON delta event per line: a character
+        value written, theory-of-mind beliefs updated, a world state update,
+        a history entry, and so on. Values are recorded after clamping, so
+        replaying the events gives back exactly the same state. Turn markers
+        separate the player turns, and a full snapshot of the world (without
+        its history) follows every snapshot_interval turns. See LogReader for
+        reconstructing a turn.
+
+        Args:
+            path: Log file; appended to when it already exists
+            snapshot_interval: Turns between snapshots
+        """
+        self.path = path
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.world = None
+        self.turn = 0  # turns started so far
+        self.stats = {"events": 0, "snapshots": 0, "bytes": 0}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def attach(self, world: World):
+        """
+        Record every later change to a world. A new log starts with the
+        world's history and a snapshot; an existing one continues after its
+        last turn.
+        """
+        if world.log is self:
+            return
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                reader = LogReader(self.path)
+                self.turn = reader.turns
+                reader.close()
+            else:
+                for event in world.history:
+                    self._write({"e": "history", "x": event})
+                self._write_snapshot(world, 0)
+                self._flush()
+        self.world = world
+        world.log = self
+        world.store.recorder = self.record
+
+    def record(self, event: Dict[str, Any]):
+        """Append one delta event"""
+        with self._lock:
+            self._write(event)
+            self.stats["events"] += 1
+
+    def mark_turn(self):
+        """Mark the start of a player turn, snapshotting the world every snapshot_interval turns"""
+        with self._lock:
+            self._write({"e": "turn", "t": self.turn})
+            if self.turn and self.turn % self.snapshot_interval == 0:
+                self._write_snapshot(self.world, self.turn)
+            self.turn += 1
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write_snapshot(self, world: World, turn: int):
+        self._write({"e": "snapshot", "t": turn, "w": world_to_dict(world)})
+        self.stats["snapshots"] += 1
+
+    def _write(self, event: Dict[str, Any]):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        line = json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n"
+        self._file.write(line)
+        self.stats["bytes"] += len(line)
+
+    def _flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Pickled with its World (e.g. a saved game session); the file is reopened on the next write
+        state = dict(self.__dict__)
+        state["_file"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class LogReader:
+    def __init__(self, path: str):
+        """
+        Read an EventLog through a memory map. Opening only indexes the turn
+        markers, snapshots and history entries with byte searches; events are
+        parsed when a turn is reconstructed, and each history entry at most
+        once however many turns are reconstructed.
+
+        Args:
+            path: Log file written by EventLog
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        # A line cut short by a crash is ignored
+        self.size = self._map.rfind(b"\n") + 1
+        self.turn_offsets = self._line_offsets(TURN_MARKER)
+        self.snapshots = []  # (turn, offset of the line, offset after the line)
+        for offset in self._line_offsets(SNAPSHOT_MARKER):
+            match = SNAPSHOT_TURN.match(self._map, offset)
+            self.snapshots.append((int(match.group(1)), offset, self._map.find(b"\n", offset) + 1))
+        self.history_offsets = self._line_offsets(HISTORY_MARKER)
+        self._history_entries = []  # parsed history entries, in log order
+
+    @property
+    def turns(self) -> int:
+        """Number of turns started in the log"""
+        return len(self.turn_offsets)
+
+    def world_at(self, turn: Optional[int] = None) -> World:
+        """
+        Reconstruct the world as it was when a turn started, from the nearest
+        earlier snapshot and the events after it.
+
+        Args:
+            turn: Turn number, counting from 0 (None for the latest state)
+
+        Returns:
+            A new World, not attached to any log
+        """
+        if turn is None:
+            end = self.size
+        elif 0 <= turn < self.turns:
+            end = self.turn_offsets[turn]
+        else:
+            raise IndexError(f"turn {turn} not in log ({self.turns} turns)")
+        # Snapshot n follows the turn n marker, so the snapshot of the requested turn qualifies too
+        candidates = [snapshot for snapshot in self.snapshots if turn is None or snapshot[0] <= turn]
+        if not candidates:
+            raise ValueError(f"{self.path} has no snapshot")
+        _, offset, start = candidates[-1]
+
+        snapshot = json.loads(self._map[offset:start])
+        world = world_from_dict(snapshot["w"], self._history(offset))
+        for event in self.events(start, max(start, end)):
+            apply_event(world, event)
+        return world
+
+    def events(self, start: int = 0, end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Parse the events between two byte offsets"""
+        end = self.size if end is None else min(end, self.size)
+        for line in self._map[start:end].splitlines():
+            yield json.loads(line)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _history(self, end: int) -> List[Any]:
+        """History entries recorded before an offset"""
+        count = bisect.bisect_left(self.history_offsets, end)
+        for offset in self.history_offsets[len(self._history_entries):count]:
+            self._history_entries.append(json.loads(self._map[offset:self._map.find(b"\n", offset)])["x"])
+        return self._history_entries[:count]
+
+    def _line_offsets(self, marker: bytes, end: Optional[int] = None) -> List[int]:
+        """Offsets of the lines that start with marker"""
+        end = self.size if end is None else end
+        offsets = [0] if self._map[:len(marker)] == marker and end > 0 else []
+        needle = b"\n" + marker
+        position = self._map.find(needle, 0, end)
+        while position != -1:
+            offsets.append(position + 1)
+            position = self._map.find(needle, position + 1, end)
+        return offsets
+
+
+def load_world(path: str, turn: Optional[int] = None) -> World:
+    """Reconstruct a world from an event log (the latest state by default)"""
+    reader = LogReader(path)
+    try:
+        return reader.world_at(turn)
+    finally:
+        reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruct a world from an event log")
+    parser.add_argument("log", help="Event log written with --event-log")
+    parser.add_argument("--turn", type=int, default=None,
+                        help="Show the world as it was when this turn started (default: the latest state)")
+    args = parser.parse_args()
+
+    reader = LogReader(args.log)
+    try:
+        world = reader.world_at(args.turn)
+        print(json.dumps({
+            "turns": reader.turns,
+            "snapshots": len(reader.snapshots),
+            "turn": args.turn,
+            "world": world_to_dict(world),
+            "history_length": len(world.history),
+            "recent_history": world.history[-5:]
+        }, indent=2, ensure_ascii=False))
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
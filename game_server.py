@@ -0,0 +1,467 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Any, Optional
+
+from story_engine import StoryEngine
+from llm_backends import HTTPBackend, StubBackend
+from backend_pool import BackendPool, PoolOverloaded
+from request_coalescing import SingleFlight, CoalescingBackend
+from batch_runner import build_world
+
+# Scenarios a client may name; builders are only ever imported from this server-side table
+DEFAULT_SCENARIOS = {"space_station": "main:setup_space_station_scenario"}
+SESSION_OPTIONS = ("state_encoding", "appraisal_mode", "batch_appraisals", "max_concurrency")
+MAX_BODY_BYTES = 64 * 1024
+SESSION_PATH = re.compile(r"^/sessions/([0-9a-f]{32})(/turn)?$")
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class SessionBusy(Exception):
+    """Raised when a session cannot be changed because one of its turns is running"""
+
+
+class Session:
+    def __init__(self, session_id: str, world: Any, player_character: str, options: Dict[str, Any],
+                 pool: BackendPool, turns: int = 0, flights: Optional[SingleFlight] = None):
+        """
+        One player's story: a World and the StoryEngine that drives it. The
+        engine's model calls go through the shared pool under this session's id,
+        joining identical calls in flight from any session when flights is given.
+        """
+        self.session_id = session_id
+        self.world = world
+        self.player_character = player_character
+        self.options = options
+        self.turns = turns
+        self.busy = False
+        self.last_active = time.monotonic()
+        backend = pool.handle(session_id)
+        if flights is not None:
+            backend = CoalescingBackend(backend, flights)
+        self.engine = StoryEngine(world, player_character, backend=backend, raise_errors=True, **options)
+
+    def play_turn(self, user_input: str) -> Dict[str, Any]:
+        """
+        Run the player's action and the NPC reaction (blocking; runs on a
+        worker thread). Raises if either fails; the turn is then not counted.
+        """
+        narrative, _ = self.engine.process_player_input(user_input)
+        npc_narrative, _ = self.engine.generate_npc_actions()
+        self.engine.wait_for_appraisals()
+        self.turns += 1
+        return {"turn": self.turns, "narrative": narrative, "npc_narrative": npc_narrative}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "player_character": self.player_character,
+            "turns": self.turns,
+            "world_state": self.world.state,
+            "characters": {name: character.get_state_for_prompt()
+                           for name, character in self.world.characters.items()}
+        }
+
+    def dump(self) -> Dict[str, Any]:
+        """Everything needed to rebuild the session after eviction"""
+        return {"world": self.world, "player_character": self.player_character,
+                "options": self.options, "turns": self.turns}
+
+
+class SessionManager:
+    def __init__(self, pool: BackendPool, state_dir: str = "sessions", max_resident: int = 1000,
+                 idle_timeout: float = 300.0, scenarios: Optional[Dict[str, Any]] = None,
+                 default_scenario: str = "space_station", coalesce: bool = False):
+        """
+        Keep sessions in memory while they are in use and pickle idle ones to disk.
+        Sessions are pickled and unpickled on worker threads so the event loop
+        keeps serving other sessions meanwhile.
+
+        Args:
+            pool: Backend pool shared by every session
+            state_dir: Directory for evicted sessions
+            max_resident: Sessions kept in memory; the least recently used idle
+                session is evicted when a new one would exceed it
+            idle_timeout: Seconds without a request before a session is evicted
+            scenarios: Scenario name -> scenario (see batch_runner.build_world)
+                that requests may name (defaults to DEFAULT_SCENARIOS). A request
+                may also send a scenario dictionary, but never a module:function
+                builder.
+            default_scenario: Name of the scenario used when a request gives none
+            coalesce: Send identical model calls in flight from any sessions
+                upstream once (see request_coalescing.CoalescingBackend)
+        """
+        self.pool = pool
+        self.flights = SingleFlight() if coalesce else None
+        self.state_dir = state_dir
+        self.max_resident = max_resident
+        self.idle_timeout = idle_timeout
+        self.scenarios = dict(DEFAULT_SCENARIOS if scenarios is None else scenarios)
+        self.default_scenario = default_scenario
+        self.sessions = {}  # session id -> Session, resident only
+        self._saving = {}     # session id -> task writing it to disk
+        self._restoring = {}  # session id -> task loading it from disk
+        self.stats = {"created": 0, "evictions": 0, "restores": 0, "deleted": 0}
+        os.makedirs(state_dir, exist_ok=True)
+
+    async def create(self, scenario: Any = None, player_character: Optional[str] = None,
+                     options: Optional[Dict[str, Any]] = None) -> Session:
+        world, scenario_player = await asyncio.to_thread(build_world, self._scenario(scenario))
+        player = player_character or scenario_player or next(iter(world.characters))
+        if player not in world.characters:
+            raise ValueError(f"Unknown player character: {player}")
+        options = {key: value for key, value in (options or {}).items() if key in SESSION_OPTIONS}
+        session = Session(uuid.uuid4().hex, world, player, options, self.pool, flights=self.flights)
+        await self._admit(session)
+        self.stats["created"] += 1
+        return session
+
+    def _scenario(self, scenario: Any) -> Any:
+        """Resolve a requested scenario: a name from scenarios or an inline dictionary"""
+        if scenario is None:
+            scenario = self.default_scenario
+        if isinstance(scenario, dict):
+            return scenario
+        if isinstance(scenario, str) and scenario in self.scenarios:
+            return self.scenarios[scenario]
+        raise ValueError(f"Unknown scenario: {scenario!r} (expected one of {sorted(self.scenarios)} "
+                         f"or a scenario object)")
+
+    async def get(self, session_id: str) -> Session:
+        """Return a session, loading it from disk if it was evicted. Raises KeyError if unknown."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            # Concurrent requests for an evicted session share one restore
+            restore = self._restoring.get(session_id)
+            if restore is None:
+                restore = self._restoring[session_id] = asyncio.ensure_future(self._restore(session_id))
+                restore.add_done_callback(lambda _: self._restoring.pop(session_id, None))
+            session = await asyncio.shield(restore)
+        session.last_active = time.monotonic()
+        return session
+
+    async def delete(self, session_id: str):
+        """Remove a session. Raises KeyError if unknown and SessionBusy while a turn is running."""
+        await self._settle(session_id)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            if session.busy:
+                raise SessionBusy(session_id)
+            del self.sessions[session_id]
+            session.engine.close()
+        elif os.path.exists(self._path(session_id)):
+            os.remove(self._path(session_id))
+        else:
+            raise KeyError(session_id)
+        self.stats["deleted"] += 1
+
+    async def evict(self, session_id: str) -> bool:
+        """
+        Pickle a session to disk (on a worker thread) and drop it from memory.
+
+        Returns:
+            False if the session is not resident or a turn is running
+        """
+        session = self.sessions.get(session_id)
+        if session is None or session.busy:
+            return False
+        del self.sessions[session_id]
+        session.engine.close()
+        save = self._saving[session_id] = asyncio.ensure_future(
+            asyncio.to_thread(self._write, self._path(session_id), session.dump()))
+        try:
+            await asyncio.shield(save)
+        finally:
+            if self._saving.get(session_id) is save:
+                del self._saving[session_id]
+        self.stats["evictions"] += 1
+        return True
+
+    async def evict_idle(self) -> int:
+        """Evict every session that has been idle longer than idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [session_id for session_id, session in self.sessions.items()
+                if not session.busy and session.last_active < cutoff]
+        evicted = 0
+        for session_id in idle:
+            evicted += await self.evict(session_id)
+        return evicted
+
+    def evicted_count(self) -> int:
+        return sum(1 for name in os.listdir(self.state_dir) if name.endswith(".pkl"))
+
+    async def _admit(self, session: Session):
+        """Add a session to memory, evicting least recently used idle sessions to make room"""
+        self.sessions[session.session_id] = session
+        if len(self.sessions) > self.max_resident:
+            idle = sorted((s for s in self.sessions.values() if not s.busy and s is not session),
+                          key=lambda s: s.last_active)
+            for victim in idle[:len(self.sessions) - self.max_resident]:
+                await self.evict(victim.session_id)
+
+    async def _restore(self, session_id: str) -> Session:
+        await self._settle(session_id)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        saved = await asyncio.to_thread(self._read, self._path(session_id))
+        session = Session(session_id, saved["world"], saved["player_character"], saved["options"],
+                          self.pool, turns=saved["turns"], flights=self.flights)
+        await self._admit(session)
+        self.stats["restores"] += 1
+        return session
+
+    async def _settle(self, session_id: str):
+        """Wait until a session being evicted is on disk"""
+        save = self._saving.get(session_id)
+        if save is not None:
+            await asyncio.shield(save)
+
+    @staticmethod
+    def _read(path: str) -> Dict[str, Any]:
+        """Load and remove an evicted session's file (blocking)"""
+        if not os.path.exists(path):
+            raise KeyError(os.path.basename(path))
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        os.remove(path)
+        return saved
+
+    @staticmethod
+    def _write(path: str, state: Dict[str, Any]):
+        """Pickle a session's state to its file (blocking)"""
+        with open(path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.state_dir, f"{session_id}.pkl")
+
+
+class GameServer:
+    def __init__(self, manager: SessionManager, max_active_turns: int = 64, max_pending_turns: int = 256,
+                 max_queued_calls: Optional[int] = None, idle_check_interval: Optional[float] = None):
+        """
+        Asyncio HTTP server hosting many StoryEngine sessions in one process.
+
+        Turns run on a thread pool because the engine is blocking. New turns are
+        refused with 503 once max_pending_turns are waiting or running, or the
+        backend pool already has max_queued_calls model calls waiting.
+
+        Routes:
+            POST   /sessions              {"scenario", "player_character", "options"} -> session id and intro
+                                          (scenario is a scenario name or a scenario object)
+            POST   /sessions/<id>/turn    {"input"} -> narrative and NPC narrative
+            GET    /sessions/<id>         current world and character state
+            DELETE /sessions/<id>
+            GET    /stats                 session, turn, backend pool and coalescing counters
+
+        Args:
+            manager: Session manager
+            max_active_turns: Turns running at the same time (worker threads)
+            max_pending_turns: Turns running or waiting before new ones are refused
+            max_queued_calls: Waiting model calls before new turns are refused
+                (defaults to half the pool's max_queued)
+            idle_check_interval: Seconds between idle-session eviction passes
+                (defaults to half the idle timeout, at most 30)
+        """
+        self.manager = manager
+        self.max_active_turns = max_active_turns
+        self.max_pending_turns = max_pending_turns
+        self.max_queued_calls = max_queued_calls if max_queued_calls is not None else manager.pool.max_queued // 2
+        if idle_check_interval is None:
+            idle_check_interval = max(0.5, min(30.0, manager.idle_timeout / 2))
+        self.idle_check_interval = idle_check_interval
+        self.turn_stats = {"active": 0, "pending": 0, "completed": 0, "rejected": 0, "errors": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_active_turns)
+        self._turn_slots = None
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        self._turn_slots = asyncio.Semaphore(self.max_active_turns)
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        evictor = asyncio.create_task(self._evict_idle_sessions())
+        print(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+            self._executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve HTTP/1.1 requests on one connection until it closes"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, {"error": "Request body too large"}
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.dispatch(method, path, body)
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(self._response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        try:
+            request = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "Body is not valid JSON"}
+
+        if path == "/stats" and method == "GET":
+            return 200, self.stats()
+        if path == "/sessions" and method == "POST":
+            try:
+                session = await self.manager.create(request.get("scenario"), request.get("player_character"),
+                                                    request.get("options"))
+            except Exception as e:
+                return 400, {"error": f"Could not create session: {e}"}
+            return 201, {"session_id": session.session_id, "intro": session.engine.generate_story_intro()}
+
+        match = SESSION_PATH.match(path)
+        if not match:
+            return 404, {"error": f"No route for {path}"}
+        session_id, turn = match.groups()
+        try:
+            if turn and method == "POST":
+                return await self.play_turn(session_id, request.get("input", ""))
+            if not turn and method == "GET":
+                return 200, (await self.manager.get(session_id)).describe()
+            if not turn and method == "DELETE":
+                await self.manager.delete(session_id)
+                return 200, {"deleted": session_id}
+        except KeyError:
+            return 404, {"error": f"Unknown session {session_id}"}
+        except SessionBusy:
+            return 409, {"error": "A turn is running for this session"}
+        return 405, {"error": f"{method} not allowed on {path}"}
+
+    async def play_turn(self, session_id: str, user_input: str) -> Tuple[int, Dict[str, Any]]:
+        if not user_input.strip():
+            return 400, {"error": "Missing input"}
+        # Backpressure: refuse work the backend cannot absorb instead of queueing it without bound
+        if (self.turn_stats["pending"] >= self.max_pending_turns
+                or self.manager.pool.queued() >= self.max_queued_calls):
+            self.turn_stats["rejected"] += 1
+            return 503, {"error": "Server busy, retry later"}
+
+        session = await self.manager.get(session_id)
+        if session.busy:
+            return 409, {"error": "A turn is already running for this session"}
+
+        session.busy = True
+        self.turn_stats["pending"] += 1
+        try:
+            async with self._turn_slots:
+                self.turn_stats["active"] += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(self._executor, session.play_turn, user_input)
+                finally:
+                    self.turn_stats["active"] -= 1
+            self.turn_stats["completed"] += 1
+            return 200, result
+        except PoolOverloaded as e:
+            self.turn_stats["rejected"] += 1
+            return 503, {"error": f"Server busy, retry later: {e}"}
+        except Exception as e:
+            self.turn_stats["errors"] += 1
+            return 502, {"error": f"Turn failed: {e}"}
+        finally:
+            self.turn_stats["pending"] -= 1
+            session.busy = False
+            session.last_active = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self.manager.pool
+        stats = {
+            "sessions": dict(self.manager.stats, resident=len(self.manager.sessions),
+                             evicted=self.manager.evicted_count()),
+            "turns": dict(self.turn_stats),
+            "pool": dict(pool.stats, queued=pool.queued(), in_flight=pool.in_flight())
+        }
+        flights = self.manager.flights
+        if flights is not None:
+            stats["coalescing"] = dict(flights.stats, in_flight=flights.in_flight())
+        return stats
+
+    async def _evict_idle_sessions(self):
+        while True:
+            await asyncio.sleep(self.idle_check_interval)
+            await self.manager.evict_idle()
+
+    @staticmethod
+    def _response(status: int, payload: Dict[str, Any], keep_alive: bool) -> bytes:
+        body = json.dumps(payload).encode("utf-8")
+        headers = [
+            f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+
+def main():
+    """Run the multi-session story server"""
+    parser = argparse.ArgumentParser(description="Host many story sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--offline", action="store_true", help="Use the local stub backend")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Stub backend latency in seconds")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Model calls in flight across all sessions")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Model calls started per second")
+    parser.add_argument("--max-queued", type=int, default=1000, help="Waiting model calls before calls fail")
+    parser.add_argument("--max-active-turns", type=int, default=64, help="Turns running at the same time")
+    parser.add_argument("--max-pending-turns", type=int, default=256, help="Turns waiting or running before 503")
+    parser.add_argument("--max-resident", type=int, default=1000, help="Sessions kept in memory")
+    parser.add_argument("--idle-timeout", type=float, default=300.0, help="Seconds before an idle session is evicted")
+    parser.add_argument("--state-dir", default="sessions", help="Directory for evicted sessions")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Send identical model calls in flight from any sessions upstream once")
+    args = parser.parse_args()
+
+    backend = StubBackend(latency=args.stub_latency) if args.offline else HTTPBackend(pool_size=args.max_in_flight)
+    pool = BackendPool(backend, max_in_flight=args.max_in_flight, rate_limit=args.rate_limit,
+                       max_queued=args.max_queued)
+    manager = SessionManager(pool, state_dir=args.state_dir, max_resident=args.max_resident,
+                             idle_timeout=args.idle_timeout, coalesce=args.coalesce)
+    server = GameServer(manager, max_active_turns=args.max_active_turns,
+                        max_pending_turns=args.max_pending_turns)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import json
+import math
+import re
+import struct
+import threading
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from typing import Dict, List, Tuple, Any, Optional, Callable, Iterable, Iterator
+
+import numpy as np
+
+from prompt_builder import STOP_TERMS
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Character names are indexed as extra terms, e.g. "@kara voss"
+NAME_PREFIX = "@"
+# A posting packs an event index (high 32 bits), the event's term count and the term's frequency
+FIELD_BITS = 16
+FIELD_MASK = (1 << FIELD_BITS) - 1
+# Postings per block written to the index file; up to this many per term stay in memory
+BLOCK_POSTINGS = 64
+# Index file block: offset of the term's previous block (-1 for none), posting count, postings
+BLOCK_HEADER = struct.Struct("<qI")
+
+
+def event_terms(text: str) -> Counter:
+    """Term frequencies of an event's text, lowercased and without stop words"""
+    return Counter(term for term in re.findall(r"[a-z0-9']+", text.lower()) if term not in STOP_TERMS)
+
+
+class HistoryStore(Sequence):
+    def __init__(self, path: str, hot_events: int = 200, max_postings: int = 1000,
+                 mentioned: Optional[Callable[[str], List[str]]] = None):
+        """
+        Story history with a BM25 index, for fetching the earlier events
+        relevant to an action instead of only the most recent ones.
+
+        The newest hot_events events stay in memory. Older ones are appended
+        to the file at path in batches and read back by offset when needed.
+        The index lives mostly on disk too: each term keeps its newest
+        postings in memory and writes them to path + ".index" in blocks of
+        BLOCK_POSTINGS, each block pointing to the term's previous one. Memory
+        thus grows with the vocabulary and by 8 bytes (a file offset) per
+        event, not with the text of the story.
+
+        The index is updated as events are appended. A search scores at most
+        max_postings postings per query term, the most recent ones, so its
+        time does not grow with the length of the story.
+
+        Args:
+            path: File for cold events; emptied when the store is created
+            hot_events: Events kept in memory
+            max_postings: Postings scored per query term
+            mentioned: Maps event text to the characters it names, which are
+                indexed as extra terms (e.g. World.mentioned_characters)
+        """
+        self.path = path
+        self.hot_events = max(1, hot_events)
+        self.max_postings = max_postings
+        self.mentioned = mentioned
+        self.stats = {"compacted": 0, "searches": 0, "cold_reads": 0, "blocks_written": 0, "blocks_read": 0}
+
+        self._hot = []                # events not yet on disk, oldest first
+        self._offsets = array("q")    # file offset of each cold event
+        self._postings = {}           # term -> postings not yet written to a block, oldest first
+        self._blocks = {}             # term -> (offset of its newest block, postings in blocks)
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self._file = open(path, "w+b")
+        self._index_file = open(path + ".index", "w+b")
+
+    # ----- sequence -----
+
+    def append(self, event: Any):
+        """Add an event and index its text"""
+        terms = event_terms(str(event))
+        if self.mentioned is not None:
+            for name in self.mentioned(str(event)):
+                terms[NAME_PREFIX + name.lower()] += 1
+        length = sum(terms.values())
+        with self._lock:
+            index = len(self)
+            packed = index << 2 * FIELD_BITS | min(length, FIELD_MASK) << FIELD_BITS
+            for term, frequency in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array("Q")
+                postings.append(packed | min(frequency, FIELD_MASK))
+                if len(postings) >= BLOCK_POSTINGS:
+                    self._write_block(term, postings)
+            self._total_length += length
+            self._hot.append(event)
+            if len(self._hot) >= self.hot_events + max(1, self.hot_events // 4):
+                self._compact()
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._hot)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                return [self[position] for position in range(*index.indices(len(self)))]
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("history index out of range")
+            cold = len(self._offsets)
+            if index >= cold:
+                return self._hot[index - cold]
+            self.stats["cold_reads"] += 1
+            self._file.seek(self._offsets[index])
+            return json.loads(self._file.readline())
+
+    def __iter__(self) -> Iterator[Any]:
+        with self._lock:
+            cold = len(self._offsets)
+            hot = list(self._hot)
+            self._file.seek(0)
+            events = [json.loads(self._file.readline()) for _ in range(cold)]
+        yield from events
+        yield from hot
+
+    def __repr__(self) -> str:
+        return f"HistoryStore({self.path!r}, {len(self)} events)"
+
+    # ----- search -----
+
+    def search(self, text: str, k: int = 5, characters: Iterable[str] = (),
+               limit: Optional[int] = None, exclude_recent: int = 0) -> List[Tuple[int, float]]:
+        """
+        Events most relevant to a piece of text, by BM25 over event terms and
+        the characters events name.
+
+        Args:
+            text: The action or other text to match
+            k: Number of events to return
+            characters: Character names to match as well (e.g. the actor)
+            limit: Only consider the first limit events (used by forked histories)
+            exclude_recent: Skip the newest events, e.g. those already sent as
+                recent history
+
+        Returns:
+            (event index, score) pairs, best first
+        """
+        query = set(event_terms(text))
+        query.update(NAME_PREFIX + name.lower() for name in characters)
+        if self.mentioned is not None:
+            query.update(NAME_PREFIX + name.lower() for name in self.mentioned(text))
+
+        with self._lock:
+            self.stats["searches"] += 1
+            count = len(self) if limit is None else min(limit, len(self))
+            end = count - exclude_recent
+            if end <= 0 or not self._total_length:
+                return []
+            average_length = self._total_length / len(self)
+            indices, scores = [], []
+            for term in query:
+                postings, document_frequency = self._newest_postings(term, count, end)
+                if not len(postings):
+                    continue
+                idf = math.log(1.0 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+                frequencies = (postings & FIELD_MASK).astype(float)
+                lengths = (postings >> FIELD_BITS & FIELD_MASK).astype(float)
+                norms = K1 * (1.0 - B + B * lengths / average_length)
+                indices.append(postings >> 2 * FIELD_BITS)
+                scores.append(idf * frequencies * (K1 + 1.0) / (frequencies + norms))
+        if not indices:
+            return []
+
+        events, inverse = np.unique(np.concatenate(indices), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        best = np.argsort(-totals, kind="stable")[:k]
+        return [(int(events[position]), float(totals[position])) for position in best]
+
+    def _newest_postings(self, term: str, count: int, end: int) -> Tuple[np.ndarray, int]:
+        """
+        A term's newest max_postings postings of events before end, reading
+        blocks back from the newest, and its number of postings before count.
+        """
+        tail = self._postings.get(term)
+        block, written = self._blocks.get(term, (-1, 0))
+        document_frequency = written + (len(tail) if tail is not None else 0)
+        parts = [np.array(tail, dtype=np.uint64)] if tail is not None else []
+        collected = 0
+        while True:
+            if parts:
+                posted = parts[-1] >> 2 * FIELD_BITS
+                # Events at or after count are not part of this (possibly forked) history
+                document_frequency -= len(posted) - int(np.searchsorted(posted, count))
+                parts[-1] = parts[-1][:int(np.searchsorted(posted, end))]
+                collected += len(parts[-1])
+            if collected >= self.max_postings or block < 0:
+                break
+            self._index_file.seek(block)
+            block, size = BLOCK_HEADER.unpack(self._index_file.read(BLOCK_HEADER.size))
+            parts.append(np.frombuffer(self._index_file.read(size * 8), dtype=np.uint64))
+            self.stats["blocks_read"] += 1
+        if not parts:
+            return np.empty(0, dtype=np.uint64), 0
+        return np.concatenate(parts[::-1])[-self.max_postings:], document_frequency
+
+    # ----- storage -----
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index_file.close()
+
+    def _compact(self):
+        """Move the oldest hot events to the file, keeping hot_events in memory"""
+        moving = len(self._hot) - self.hot_events
+        self._file.seek(0, 2)
+        offset = self._file.tell()
+        lines = []
+        for event in self._hot[:moving]:
+            line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+            self._offsets.append(offset)
+            offset += len(line)
+            lines.append(line)
+        self._file.write(b"".join(lines))
+        self._file.flush()
+        del self._hot[:moving]
+        self.stats["compacted"] += moving
+
+    def _write_block(self, term: str, postings: array):
+        """Append a term's in-memory postings to the index file as one block"""
+        previous, written = self._blocks.get(term, (-1, 0))
+        self._index_file.seek(0, 2)
+        offset = self._index_file.tell()
+        self._index_file.write(BLOCK_HEADER.pack(previous, len(postings)) + postings.tobytes())
+        self._blocks[term] = (offset, written + len(postings))
+        del self._postings[term]
+        self.stats["blocks_written"] += 1
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The files stay where they are; a restored store reopens them
+        with self._lock:
+            self._file.flush()
+            self._index_file.flush()
+        state = dict(self.__dict__)
+        state["_file"] = None
+        state["_index_file"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._file = open(self.path, "r+b")
+        self._index_file = open(self.path + ".index", "r+b")
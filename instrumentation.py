@@ -0,0 +1,237 @@
+import threading
+import time
+from typing import Dict, List, Any, Optional, Callable, Iterator
+from llm_backends import LLMBackend, LLMResponse, DEFAULT_MODEL
+
+# Attributes a span takes from the span that encloses it on the same thread
+INHERITED_ATTRIBUTES = ("channel", "character")
+# Numeric span attributes the aggregator sums
+SUMMED_ATTRIBUTES = ("prompt_bytes", "response_bytes", "prompt_tokens", "completion_tokens", "total_tokens",
+                     "cached_tokens")
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "duration", "parent")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"] = None):
+        """
+        A timed stage of the engine (prompt building, a model call, parsing, ...).
+
+        Args:
+            name: Stage name, e.g. "prompt_build", "llm_call", "parse" or "appraisal"
+            attributes: Sizes, token usage, channel, character and similar details
+            parent: Enclosing span on the same thread, if any
+        """
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, **attributes):
+        """Add attributes while the span is open"""
+        self.attributes.update(attributes)
+
+
+class _NullSpan:
+    """Shared do-nothing span returned when tracing is disabled"""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class NullTracer:
+    """Tracer that records nothing. Every span is the same shared no-op object."""
+    enabled = False
+
+    def span(self, name: str, **attributes) -> Any:
+        return NULL_SPAN
+
+
+class _ActiveSpan:
+    __slots__ = ("tracer", "span")
+
+    def __init__(self, tracer: "Tracer", span: Span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.tracer._push(self.span)
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        span = self.span
+        span.duration = time.perf_counter() - span.start
+        if exc_type is not None:
+            span.attributes["error"] = exc_type.__name__
+        self.tracer._pop()
+        self.tracer._emit(span)
+        return False
+
+
+class Tracer(NullTracer):
+    enabled = True
+
+    def __init__(self, *sinks: Callable[[Span], None]):
+        """
+        Record spans and hand each finished span to the sinks.
+
+        Args:
+            sinks: Callables that receive every finished Span, e.g. a SpanAggregator
+        """
+        self.sinks = list(sinks)
+        self._local = threading.local()
+
+    def span(self, name: str, **attributes) -> _ActiveSpan:
+        """
+        Open a span as a context manager.
+
+        Example:
+            with tracer.span("parse", channel="action") as span:
+                span.set(response_bytes=len(text))
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is not None:
+            for key in INHERITED_ATTRIBUTES:
+                if key in parent.attributes and key not in attributes:
+                    attributes[key] = parent.attributes[key]
+        return _ActiveSpan(self, Span(name, attributes, parent))
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span: Span):
+        self._stack().append(span)
+
+    def _pop(self):
+        self._stack().pop()
+
+    def _emit(self, span: Span):
+        for sink in self.sinks:
+            sink(span)
+
+
+class SpanAggregator:
+    def __init__(self):
+        """
+        In-process sink that totals span durations and sizes by stage and by
+        character. Totals cover everything since the last reset().
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __call__(self, span: Span):
+        with self._lock:
+            stage = self.stages.get(span.name)
+            if stage is None:
+                stage = self.stages[span.name] = {"count": 0, "total": 0.0, "max": 0.0}
+            stage["count"] += 1
+            stage["total"] += span.duration
+            stage["max"] = max(stage["max"], span.duration)
+            for key in SUMMED_ATTRIBUTES:
+                value = span.attributes.get(key)
+                if value:
+                    stage[key] = stage.get(key, 0) + value
+            if "error" in span.attributes:
+                stage["errors"] = stage.get("errors", 0) + 1
+
+            character = span.attributes.get("character")
+            if character is not None:
+                totals = self.characters.setdefault(character, {"total": 0.0, "stages": {}})
+                totals["stages"][span.name] = totals["stages"].get(span.name, 0.0) + span.duration
+                # Only the outermost span for a character counts toward its total
+                if span.parent is None or span.parent.attributes.get("character") != character:
+                    totals["total"] += span.duration
+
+    def reset(self):
+        """Start a new measurement window"""
+        with self._lock:
+            self.stages = {}      # span name -> count, total, max and summed attributes
+            self.characters = {}  # character -> total seconds and seconds per span name
+
+    def summary(self) -> Dict[str, Any]:
+        """Copy of the current totals"""
+        with self._lock:
+            return {
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "characters": {name: {"total": totals["total"], "stages": dict(totals["stages"])}
+                               for name, totals in self.characters.items()}
+            }
+
+    def format_breakdown(self) -> str:
+        """Human-readable table of the current totals, slowest stage first"""
+        summary = self.summary()
+        lines = [f"{'stage':<18}{'count':>6}{'total ms':>11}{'max ms':>10}{'bytes in':>10}{'bytes out':>11}{'tokens':>8}"]
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total"]):
+            lines.append(
+                f"{name:<18}{stage['count']:>6}{stage['total'] * 1000:>11.1f}{stage['max'] * 1000:>10.1f}"
+                f"{stage.get('prompt_bytes', 0):>10}{stage.get('response_bytes', 0):>11}{stage.get('total_tokens', 0):>8}"
+            )
+        if summary["characters"]:
+            lines.append("per character (ms): " + ", ".join(
+                f"{name} {totals['total'] * 1000:.1f}"
+                for name, totals in sorted(summary["characters"].items(), key=lambda item: -item[1]["total"])
+            ))
+        return "\n".join(lines)
+
+
+class TracedBackend(LLMBackend):
+    def __init__(self, backend: LLMBackend, tracer: NullTracer):
+        """
+        Wrap a backend so every call is recorded as an "llm_call" span with
+        prompt and response sizes, token usage and whether it was cached.
+        Streamed calls also record the time to the first chunk.
+
+        Args:
+            backend: The backend that answers the calls
+            tracer: Tracer receiving the spans
+        """
+        self.backend = backend
+        self.tracer = tracer
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        with self.tracer.span("llm_call", model=model) as span:
+            response = self.backend.complete(messages, model=model, temperature=temperature,
+                                             max_tokens=max_tokens, timeout=timeout)
+            span.set(prompt_bytes=sum(len(message["content"].encode("utf-8")) for message in messages),
+                     response_bytes=len(response.text.encode("utf-8")),
+                     cached=response.cached,
+                     **(response.usage or {}))
+            return response
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        with self.tracer.span("llm_call", model=model, streamed=True) as span:
+            response_bytes = 0
+            for chunk in self.backend.stream(messages, model=model, temperature=temperature,
+                                             max_tokens=max_tokens, timeout=timeout):
+                if not response_bytes:
+                    span.set(first_chunk=time.perf_counter() - span.start)
+                response_bytes += len(chunk.encode("utf-8"))
+                yield chunk
+            span.set(prompt_bytes=sum(len(message["content"].encode("utf-8")) for message in messages),
+                     response_bytes=response_bytes)
+
+    def discard(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                temperature: float = 0.7, max_tokens: int = 1000):
+        self.backend.discard(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+    def close(self):
+        self.backend.close()
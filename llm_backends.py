@@ -0,0 +1,420 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Callable, Iterator
+
+DEFAULT_MODEL = "gpt-4"
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+_environment_loaded = False
+
+
+def api_key_from_environment() -> Optional[str]:
+    """
+    OPENAI_API_KEY, after loading a .env file the first time it is needed
+    (rather than when the engine is imported).
+    """
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
+    return os.getenv("OPENAI_API_KEY")
+
+
+class LLMResponse:
+    def __init__(self, text: str, model: str, usage: Optional[Dict[str, int]] = None,
+                 latency: float = 0.0, cached: bool = False):
+        """
+        Result of a single chat completion call.
+
+        Args:
+            text: Content of the first choice's message
+            model: Model that produced the completion
+            usage: Token usage reported by the backend (prompt/completion/total)
+            latency: Wall-clock seconds spent on the call
+            cached: True when the response was served without calling the model
+        """
+        self.text = text
+        self.model = model
+        self.usage = usage or {}
+        self.latency = latency
+        self.cached = cached
+
+
+class LLMBackend:
+    """
+    Interface for chat completion backends used by OCCAppraisalModel and StoryEngine.
+    Implementations must be safe to call from several threads at once.
+    """
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        """
+        Run a chat completion.
+
+        Args:
+            messages: Chat messages in OpenAI format
+            model: Model name
+            temperature: Sampling temperature
+            max_tokens: Maximum number of tokens to generate
+            timeout: Seconds before the call is abandoned (None uses the backend default)
+
+        Returns:
+            LLMResponse for the first choice
+        """
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Run a chat completion and yield the response text as it is generated.
+        Backends without streaming support yield the whole completion at once.
+
+        Args:
+            Same as complete()
+
+        Yields:
+            Chunks of the first choice's message content
+        """
+        yield self.complete(messages, model=model, temperature=temperature,
+                            max_tokens=max_tokens, timeout=timeout).text
+
+    def discard(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                temperature: float = 0.7, max_tokens: int = 1000):
+        """
+        Forget the response to a request because it turned out to be unusable
+        (see CachedBackend). Backends that keep no responses ignore it;
+        wrappers pass it on to the backend they wrap.
+
+        Args:
+            Same as complete(), without timeout
+        """
+        pass
+
+    def close(self):
+        """Release any pooled resources held by the backend"""
+        pass
+
+
+class HTTPBackend(LLMBackend):
+    def __init__(self, api_key: Optional[str] = None, url: str = OPENAI_CHAT_URL,
+                 pool_size: int = 10, timeout: float = 60.0, max_retries: int = 2):
+        """
+        Chat completion backend that talks to the OpenAI HTTP API directly over a
+        pooled keep-alive session, so concurrent appraisals reuse connections.
+        The session (and the requests library) is only set up on the first call.
+
+        Args:
+            api_key: API key (defaults to the OPENAI_API_KEY environment variable,
+                read on the first call)
+            url: Chat completions endpoint
+            pool_size: Maximum number of pooled connections kept alive
+            timeout: Default per-call timeout in seconds
+            max_retries: Connection-level retries performed by the pool
+        """
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> Any:
+        """The pooled requests.Session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    if self.api_key is None:
+                        self.api_key = api_key_from_environment()
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                          max_retries=self.max_retries)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update({
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    })
+                    self._session = session
+        return self._session
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        start = time.perf_counter()
+        response = self.session.post(
+            self.url,
+            json={
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            },
+            timeout=timeout if timeout is not None else self.timeout
+        )
+        response.raise_for_status()
+        body = response.json()
+
+        return LLMResponse(
+            text=body["choices"][0]["message"]["content"],
+            model=body.get("model", model),
+            usage=body.get("usage"),
+            latency=time.perf_counter() - start
+        )
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        response = self.session.post(
+            self.url,
+            json={
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            },
+            timeout=timeout if timeout is not None else self.timeout,
+            stream=True
+        )
+        with response:
+            response.raise_for_status()
+            # Server-sent events: one "data: {...}" line per delta, ending with "data: [DONE]"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"]
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, api_key: Optional[str] = None, timeout: float = 60.0):
+        """
+        Chat completion backend that goes through the openai client library.
+        The library is imported on the first call, and the key is passed with
+        each request instead of being set on the openai module.
+
+        Args:
+            api_key: API key (defaults to the OPENAI_API_KEY environment variable,
+                read on the first call)
+            timeout: Default per-call timeout in seconds
+        """
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _client(self) -> Any:
+        import openai
+        if self.api_key is None:
+            self.api_key = api_key_from_environment()
+        return openai
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        start = time.perf_counter()
+        response = self._client().ChatCompletion.create(
+            api_key=self.api_key,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            request_timeout=timeout if timeout is not None else self.timeout
+        )
+
+        return LLMResponse(
+            text=response.choices[0].message.content,
+            model=response.get("model", model),
+            usage=dict(response.get("usage", {})),
+            latency=time.perf_counter() - start
+        )
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        for chunk in self._client().ChatCompletion.create(
+            api_key=self.api_key,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            request_timeout=timeout if timeout is not None else self.timeout,
+            stream=True
+        ):
+            content = chunk.choices[0].delta.get("content")
+            if content:
+                yield content
+
+
+class StubBackend(LLMBackend):
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = 0,
+                 responder: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+                 chunk_size: int = 16, chunk_delay: float = 0.0, prefill_per_token: float = 0.0,
+                 prefix_cache_blocks: int = 0, cache_block_tokens: int = 128):
+        """
+        Local deterministic backend for load tests and offline runs. The same
+        messages and seed always produce the same response and the same delay.
+
+        With prefix_cache_blocks set, the backend also simulates provider-side
+        prompt caching: prompts are split into blocks of cache_block_tokens,
+        and the leading blocks that match an earlier prompt exactly are not
+        charged prefill time. Their count is reported as "cached_tokens" in
+        the usage and totalled in prefix_stats.
+
+        Args:
+            latency: Base delay in seconds added to every call
+            jitter: Maximum extra delay in seconds, derived from the prompt hash
+            seed: Seed mixed into every generated response
+            responder: Optional callable that maps messages to response text,
+                replacing the built-in canned responses
+            chunk_size: Characters per chunk when streaming
+            chunk_delay: Delay in seconds between streamed chunks
+            prefill_per_token: Delay in seconds per prompt token that is not cached
+            prefix_cache_blocks: Prefix blocks remembered, least recently used
+                dropped first (0 disables the simulated cache)
+            cache_block_tokens: Tokens per cached block; a prompt shorter than
+                one block is never cached
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.responder = responder
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.prefill_per_token = prefill_per_token
+        self.prefix_cache_blocks = prefix_cache_blocks
+        self.cache_block_tokens = max(1, cache_block_tokens)
+        self.calls = 0
+        self.prefix_stats = {"prompt_tokens": 0, "cached_tokens": 0, "prefill_saved": 0.0}
+        self._prefix_blocks = OrderedDict()  # hash of a prompt prefix -> None, in LRU order
+        self._lock = threading.Lock()
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        with self._lock:
+            self.calls += 1
+        rng = self._rng_for(messages)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        cached_tokens = self._cached_prefix_tokens(messages, prompt_tokens) if self.prefix_cache_blocks else 0
+        delay = self.latency + rng.uniform(0.0, self.jitter) + (prompt_tokens - cached_tokens) * self.prefill_per_token
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Stub backend call exceeded timeout of {timeout}s")
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.responder is not None:
+            text = self.responder(messages)
+        else:
+            text = self._canned_response(messages, rng)
+
+        completion_tokens = len(text) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        if self.prefix_cache_blocks:
+            usage["cached_tokens"] = cached_tokens
+        return LLMResponse(text=text, model=model, usage=usage, latency=delay)
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        # The base latency stands in for time to first token
+        text = self.complete(messages, model=model, temperature=temperature,
+                             max_tokens=max_tokens, timeout=timeout).text
+        for start in range(0, len(text), self.chunk_size):
+            if start and self.chunk_delay > 0:
+                time.sleep(self.chunk_delay)
+            yield text[start:start + self.chunk_size]
+
+    def _cached_prefix_tokens(self, messages: List[Dict[str, str]], prompt_tokens: int) -> int:
+        """Tokens at the start of the prompt already in the simulated cache; the prompt's blocks are then cached"""
+        text = "".join(f"{message['role']}\n{message['content']}\n" for message in messages)
+        block_chars = self.cache_block_tokens * 4
+        digest = hashlib.sha256()
+        keys = []
+        for start in range(0, len(text) - block_chars + 1, block_chars):
+            # Each key covers everything up to the end of its block
+            digest.update(text[start:start + block_chars].encode())
+            keys.append(digest.hexdigest())
+
+        with self._lock:
+            hits = 0
+            for key in keys:
+                if key not in self._prefix_blocks:
+                    break
+                hits += 1
+            for key in keys:
+                self._prefix_blocks[key] = None
+                self._prefix_blocks.move_to_end(key)
+            while len(self._prefix_blocks) > self.prefix_cache_blocks:
+                self._prefix_blocks.popitem(last=False)
+            cached_tokens = min(hits * self.cache_block_tokens, prompt_tokens)
+            self.prefix_stats["prompt_tokens"] += prompt_tokens
+            self.prefix_stats["cached_tokens"] += cached_tokens
+            self.prefix_stats["prefill_saved"] += cached_tokens * self.prefill_per_token
+        return cached_tokens
+
+    def _rng_for(self, messages: List[Dict[str, str]]) -> random.Random:
+        """Build a random generator seeded from the seed and the message contents"""
+        digest = hashlib.sha256(str(self.seed).encode())
+        for message in messages:
+            digest.update(message["role"].encode())
+            digest.update(message["content"].encode())
+        return random.Random(digest.hexdigest())
+
+    def _canned_response(self, messages: List[Dict[str, str]], rng: random.Random) -> str:
+        """Produce a well-formed response for the appraisal or story prompts"""
+        system = messages[0]["content"] if messages else ""
+        prompt = messages[-1]["content"] if messages else ""
+
+        if "OCC appraisal" in system:
+            def appraisal() -> Dict[str, Any]:
+                return {
+                    "emotional_updates": {"surprise": round(rng.uniform(0.0, 1.0), 2)},
+                    "belief_updates": {},
+                    "theory_of_mind_updates": {},
+                    "goal_updates": {},
+                    "appraisal_explanation": "Stub appraisal"
+                }
+
+            # Batched prompts list one "- **name**: action" line per character
+            batch_names = re.findall(r'^\s*- \*\*(.+?)\*\*: ', prompt, re.MULTILINE)
+            if "(Batch)" in prompt and batch_names:
+                result = {name: appraisal() for name in batch_names}
+            else:
+                result = appraisal()
+        else:
+            # Every character named in the prompt gets a canned action
+            names = list(dict.fromkeys(re.findall(r'"name":\s*"([^"]+)"', prompt)))
+            result = {
+                "narrative": f"The story continues (stub #{rng.randint(0, 9999)}).",
+                "character_actions": {name: f"{name} waits and observes." for name in names},
+                "world_state_updates": {}
+            }
+
+        return f"```json\n{json.dumps(result, indent=2)}\n```"
@@ -1,15 +1,18 @@
-import sys
 import os
-from typing import Dict, List, Any
-
-# Ensure the script can find our modules
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import argparse
+from typing import Dict, List, Any, Optional
 
 # Import our story engine classes
 from character_world_classes import Character, World
 from story_engine import OCCAppraisalModel, StoryEngine
+from llm_backends import StubBackend
+from response_cache import ResponseCache
+from instrumentation import Tracer, SpanAggregator
+from event_log import EventLog, load_world
+from model_routing import ModelRouter
+from tick_engine import TickEngine, UrgencyPressure
 
-def setup_space_station_scenario():
+def setup_space_station_scenario(seed: Optional[int] = None):
     """Set up the space station scenario with characters and initial states"""
     
     # Create the characters
@@ -112,7 +115,8 @@ def setup_space_station_scenario():
     world = World(
         setting=setting, 
         background=background,
-        characters=[sid, raymond, bao]
+        characters=[sid, raymond, bao],
+        seed=seed
     )
     
     # Initial world state
@@ -126,16 +130,86 @@ def setup_space_station_scenario():
     
     return world
 
+def setup_space_station_ticks(world: World) -> TickEngine:
+    """
+    Create the between-turn dynamics of the space station scenario: one tick
+    is one minute, life support runs down, and task goals and the drive to
+    keep the crew safe grow urgent as it does.
+    """
+    return TickEngine(
+        world,
+        decay=0.002,
+        contagion=0.001,
+        contagion_rates={"anxiety": 0.003, "concern": 0.003},
+        pressures=[
+            UrgencyPressure("life_support_hours_remaining", calm=24.0, critical=0.0,
+                            goals=("task", ("emotional", "preserve_crew_harmony")), rate=0.001)
+        ],
+        clocks={"life_support_hours_remaining": -1 / 60}
+    )
+
 def main():
     """Main function to run the interactive story"""
-    # Set up the scenario
-    world = setup_space_station_scenario()
+    parser = argparse.ArgumentParser(description="Run the interactive space station story")
+    parser.add_argument("--offline", action="store_true",
+                        help="Use the local deterministic stub backend instead of the OpenAI API")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Cache model responses in this directory and reuse them for identical prompts")
+    parser.add_argument("--state-encoding", choices=["full", "compact"], default="full",
+                        help="How world state is serialized into prompts")
+    parser.add_argument("--appraisal-mode", choices=["llm", "rules", "auto"], default="llm",
+                        help="Appraise with the model, the local OCC rules, or the rules unless the event is ambiguous")
+    parser.add_argument("--stream", action="store_true",
+                        help="Print narrative as it is generated and finish appraisals in the background")
+    parser.add_argument("--speculate", action="store_true",
+                        help="Start the NPC call without waiting for the player turn's appraisals")
+    parser.add_argument("--prompt-budget", type=int, default=None,
+                        help="Estimated tokens of world state per prompt; the least relevant character entries are left out")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print a per-turn breakdown of time spent building prompts, calling the model, parsing and appraising")
+    parser.add_argument("--event-log", default=None,
+                        help="Record every change to the world in this file; an existing log is resumed from its latest state")
+    parser.add_argument("--small-model", default=None,
+                        help="Send NPC and appraisal calls to this model first, escalating to the main model when its output is unusable")
+    parser.add_argument("--history-file", default=None,
+                        help="Keep older story events in this file and add the earlier events relevant to each action to prompts")
+    parser.add_argument("--active-npcs", type=int, default=None,
+                        help="NPCs that act and are appraised by the model each turn, the most salient first; the rest are updated by the local rules")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Send identical model calls that are in flight at the same time upstream once")
+    parser.add_argument("--ticks-per-turn", type=int, default=0,
+                        help="Minutes of emotion decay, contagion and goal urgency simulated locally before each player turn")
+    args = parser.parse_args()
+    
+    # Set up the scenario, or resume it from an event log
+    if args.event_log and os.path.exists(args.event_log) and os.path.getsize(args.event_log) > 0:
+        world = load_world(args.event_log)
+    else:
+        world = setup_space_station_scenario()
+    if args.history_file:
+        world.index_history(args.history_file)
+    event_log = EventLog(args.event_log) if args.event_log else None
+    router = ModelRouter.tiered(small=args.small_model) if args.small_model else None
     
     # Create the story engine with Sid as the player character
-    story_engine = StoryEngine(world, "Sid")
+    backend = StubBackend() if args.offline else None
+    cache = ResponseCache(cache_dir=args.cache_dir) if args.cache_dir else None
+    profiler = SpanAggregator() if args.profile else None
+    tracer = Tracer(profiler) if profiler else None
+    story_engine = StoryEngine(world, "Sid", backend=backend, cache=cache,
+                               state_encoding=args.state_encoding, appraisal_mode=args.appraisal_mode,
+                               tracer=tracer, speculative=args.speculate,
+                               prompt_budget=args.prompt_budget, event_log=event_log,
+                               router=router, active_npcs=args.active_npcs,
+                               coalesce=args.coalesce,
+                               tick_engine=setup_space_station_ticks(world) if args.ticks_per_turn > 0 else None,
+                               ticks_per_turn=args.ticks_per_turn)
     
-    # Run the interactive story
-    story_engine.run_interactive_story()
+    # Run the interactive story, flushing the event log and stopping background work on exit
+    try:
+        story_engine.run_interactive_story(stream=args.stream, profiler=profiler)
+    finally:
+        story_engine.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
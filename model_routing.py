@@ -0,0 +1,227 @@
+import threading
+import time
+from typing import Dict, List, Tuple, Any, Optional, Callable, Iterator
+from llm_backends import LLMBackend, LLMResponse, DEFAULT_MODEL
+from prompt_encoding import estimate_tokens
+
+SMALL_MODEL = "gpt-4o-mini"
+CALL_TYPES = ("narrative", "npc", "appraisal", "batch_appraisal")
+
+# USD per 1K prompt and completion tokens (list prices; models not listed are not costed)
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+
+class Route:
+    def __init__(self, model: str, max_tokens: int = 1000, timeout: Optional[float] = None,
+                 temperature: float = 0.7, tokens_per_item: int = 0,
+                 escalate_to: Optional["Route"] = None):
+        """
+        Model settings for one type of call.
+
+        Args:
+            model: Model to call
+            max_tokens: Completion token limit
+            timeout: Per-call timeout in seconds (None uses the backend default)
+            temperature: Sampling temperature
+            tokens_per_item: For calls covering several items (batched appraisals),
+                raise the limit to this many tokens per item
+            escalate_to: Route retried when this one errors or its output fails
+                validation. Streamed calls are not escalated.
+        """
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.temperature = temperature
+        self.tokens_per_item = tokens_per_item
+        self.escalate_to = escalate_to
+
+    def token_limit(self, items: int = 1) -> int:
+        return max(self.max_tokens, self.tokens_per_item * items)
+
+
+class ModelRouter:
+    def __init__(self, routes: Dict[str, Route], prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        """
+        Pick the model, token limit and timeout for each call type, escalate to
+        a larger model when the cheaper one's output is unusable, and account
+        for latency and cost per call type.
+
+        Args:
+            routes: Call type ("narrative", "npc", "appraisal", "batch_appraisal")
+                -> Route; types without a route use the "narrative" route
+            prices: Model -> USD per 1K prompt and completion tokens
+                (defaults to MODEL_PRICES)
+        """
+        self.routes = routes
+        self.prices = prices if prices is not None else MODEL_PRICES
+        self._lock = threading.Lock()
+        self.stats = {}
+        self.reset()
+
+    @classmethod
+    def single(cls, model: str = DEFAULT_MODEL, timeout: Optional[float] = None) -> "ModelRouter":
+        """Every call type on one model, with the engine's original token limits"""
+        return cls({
+            "narrative": Route(model, 1000, timeout),
+            "npc": Route(model, 1000, timeout),
+            "appraisal": Route(model, 1000, timeout),
+            "batch_appraisal": Route(model, 1000, timeout, tokens_per_item=600),
+        })
+
+    @classmethod
+    def tiered(cls, large: str = DEFAULT_MODEL, small: str = SMALL_MODEL,
+               timeout: Optional[float] = None) -> "ModelRouter":
+        """
+        Narration on the large model; NPC actions and appraisals on the small
+        model with tighter limits, escalating to the large model on failure.
+        """
+        return cls({
+            "narrative": Route(large, 1000, timeout),
+            "npc": Route(small, 800, timeout, escalate_to=Route(large, 1000, timeout)),
+            "appraisal": Route(small, 500, timeout, escalate_to=Route(large, 1000, timeout)),
+            "batch_appraisal": Route(small, 800, timeout, tokens_per_item=400,
+                                     escalate_to=Route(large, 1000, timeout, tokens_per_item=600)),
+        })
+
+    def route(self, call_type: str) -> Route:
+        return self.routes.get(call_type) or self.routes["narrative"]
+
+    def complete(self, backend: LLMBackend, call_type: str, messages: List[Dict[str, str]],
+                 validate: Optional[Callable[[str], bool]] = None, items: int = 1) -> LLMResponse:
+        """
+        Send a call along its route.
+
+        Args:
+            backend: Backend that answers the call
+            call_type: Route to use
+            messages: Chat messages
+            validate: Returns True when the response text is usable; a False
+                result or an exception escalates the call and discards the
+                response from the backend (see LLMBackend.discard)
+            items: Number of items the call covers (see Route.tokens_per_item)
+
+        Returns:
+            The first usable response, or the last route's response if none was
+        """
+        route = self.route(call_type)
+        start = time.perf_counter()
+        escalated = False
+        while True:
+            try:
+                response = backend.complete(messages, model=route.model, temperature=route.temperature,
+                                            max_tokens=route.token_limit(items), timeout=route.timeout)
+            except Exception:
+                self._count(call_type, "errors")
+                if route.escalate_to is None:
+                    self._account(call_type, start, escalated)
+                    raise
+                route, escalated = route.escalate_to, True
+                continue
+            self._charge(call_type, route.model, response)
+            if validate is None or self._valid(validate, response.text):
+                self._account(call_type, start, escalated)
+                return response
+            self._count(call_type, "invalid")
+            backend.discard(messages, model=route.model, temperature=route.temperature,
+                            max_tokens=route.token_limit(items))
+            if route.escalate_to is None:
+                self._account(call_type, start, escalated)
+                return response
+            route, escalated = route.escalate_to, True
+
+    def discard(self, backend: LLMBackend, call_type: str, messages: List[Dict[str, str]], items: int = 1):
+        """
+        Discard the responses to a call on every route it may have taken,
+        e.g. when a response passed validation but could not be parsed
+        """
+        route = self.route(call_type)
+        while route is not None:
+            backend.discard(messages, model=route.model, temperature=route.temperature,
+                            max_tokens=route.token_limit(items))
+            route = route.escalate_to
+
+    def stream(self, backend: LLMBackend, call_type: str, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Stream a call on its route's model. Token counts for the cost are estimated from the text."""
+        route = self.route(call_type)
+        start = time.perf_counter()
+        chunks = []
+        for chunk in backend.stream(messages, model=route.model, temperature=route.temperature,
+                                    max_tokens=route.max_tokens, timeout=route.timeout):
+            chunks.append(chunk)
+            yield chunk
+        usage = {
+            "prompt_tokens": sum(estimate_tokens(message["content"]) for message in messages),
+            "completion_tokens": estimate_tokens("".join(chunks))
+        }
+        self._charge(call_type, route.model, LLMResponse("", route.model, usage))
+        self._account(call_type, start, False)
+
+    def reset(self):
+        with self._lock:
+            self.stats = {
+                call_type: {"calls": 0, "escalated": 0, "invalid": 0, "errors": 0, "cached": 0,
+                            "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "models": {}}
+                for call_type in set(CALL_TYPES) | set(self.routes)
+            }
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Copy of the per call type totals, with the mean latency"""
+        with self._lock:
+            summary = {}
+            for call_type, stats in self.stats.items():
+                if stats["calls"]:
+                    summary[call_type] = dict(stats, models=dict(stats["models"]),
+                                              mean_latency=stats["latency"] / stats["calls"])
+            return summary
+
+    def format_report(self) -> str:
+        """Human-readable table of the per call type totals"""
+        lines = [f"{'route':<17}{'calls':>6}{'escalated':>10}{'mean ms':>9}{'tokens':>9}{'cost $':>10}  models"]
+        for call_type, stats in sorted(self.summary().items()):
+            lines.append(
+                f"{call_type:<17}{stats['calls']:>6}{stats['escalated']:>10}{stats['mean_latency'] * 1000:>9.1f}"
+                f"{stats['prompt_tokens'] + stats['completion_tokens']:>9}{stats['cost']:>10.4f}  "
+                + ", ".join(f"{model} {count}" for model, count in stats["models"].items())
+            )
+        return "\n".join(lines)
+
+    @staticmethod
+    def _valid(validate: Callable[[str], bool], text: str) -> bool:
+        try:
+            return bool(validate(text))
+        except Exception:
+            return False
+
+    def _charge(self, call_type: str, model: str, response: LLMResponse):
+        """Add one model call's tokens and cost"""
+        prompt_tokens = response.usage.get("prompt_tokens", 0)
+        completion_tokens = response.usage.get("completion_tokens", 0)
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        with self._lock:
+            stats = self.stats[call_type]
+            stats["models"][model] = stats["models"].get(model, 0) + 1
+            if response.cached:
+                stats["cached"] += 1
+                return
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def _account(self, call_type: str, start: float, escalated: bool):
+        """Count one finished call, including any escalation"""
+        with self._lock:
+            stats = self.stats[call_type]
+            stats["calls"] += 1
+            stats["latency"] += time.perf_counter() - start
+            if escalated:
+                stats["escalated"] += 1
+
+    def _count(self, call_type: str, key: str):
+        with self._lock:
+            self.stats[call_type][key] += 1
@@ -0,0 +1,121 @@
+import heapq
+import threading
+from typing import Dict, List, Tuple, Optional, Iterable
+
+import numpy as np
+
+from character_world_classes import World
+
+# Salience = the weighted sum of these signals, each in [0, 1]
+EMOTION_WEIGHT = 1.0   # strongest emotion
+GOAL_WEIGHT = 1.0      # highest goal priority
+MENTION_WEIGHT = 1.0   # mentions in the recent history, MAX_MENTIONS or more counting fully
+IDLE_WEIGHT = 0.5      # turns since the character last acted, MAX_IDLE_TURNS or more counting fully
+MAX_MENTIONS = 2
+MAX_IDLE_TURNS = 5
+
+
+class SalienceScheduler:
+    def __init__(self, top_k: int = 5, history_window: int = 5):
+        """
+        Pick the characters that act and are appraised by the model each turn,
+        so the cost of a turn stays bounded however large the cast.
+
+        Characters are ranked by salience: their strongest emotion, their
+        most urgent goal, how often the recent history names them, and how
+        many turns have passed since they last acted (so quiet characters
+        eventually get a turn). The top_k most salient are taken from a heap.
+        Everyone else is left to cheap local updates (see StoryEngine).
+
+        Args:
+            top_k: Characters activated per turn
+            history_window: Most recent history entries searched for mentions
+        """
+        self.top_k = max(1, top_k)
+        self.history_window = history_window
+        self.turn = 0
+        self.last_acted = {}  # character name -> turn it last acted in
+        self.stats = {"turns": 0, "activated": 0, "local": 0}
+        self._lock = threading.Lock()
+
+    def salience(self, world: World, candidates: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Salience of each candidate character.
+
+        Args:
+            world: The world the characters live in
+            candidates: Names to score (defaults to every character)
+
+        Returns:
+            Dictionary of character name to salience, in candidate order
+        """
+        names = [name for name in (world.characters if candidates is None else candidates)
+                 if name in world.characters]
+        if not names:
+            return {}
+        store = world.store
+        rows = np.array([world.characters[name].row for name in names], dtype=np.intp)
+
+        def strongest(dimension: str) -> np.ndarray:
+            values = store.arrays[dimension][rows, :len(store.columns[dimension])]
+            if not values.shape[1]:
+                return np.zeros(len(names))
+            return np.nan_to_num(values, nan=0.0).max(axis=1)
+
+        mentions = dict.fromkeys(names, 0)
+        history = world.history[-self.history_window:] if self.history_window else []
+        for event in history:
+            for name in world.mentioned_characters(str(event)):
+                if name in mentions:
+                    mentions[name] += 1
+        with self._lock:
+            idle = np.array([self.turn - self.last_acted.get(name, -MAX_IDLE_TURNS) for name in names], dtype=float)
+
+        salience = (EMOTION_WEIGHT * strongest("emotions")
+                    + GOAL_WEIGHT * strongest("goals")
+                    + MENTION_WEIGHT * np.minimum(np.array([mentions[name] for name in names]), MAX_MENTIONS) / MAX_MENTIONS
+                    + IDLE_WEIGHT * np.minimum(idle, MAX_IDLE_TURNS) / MAX_IDLE_TURNS)
+        return dict(zip(names, salience.tolist()))
+
+    def select(self, world: World, candidates: Optional[Iterable[str]] = None,
+               exclude: Iterable[str] = ()) -> List[str]:
+        """
+        The top_k most salient characters, most salient first (ties keep
+        world order).
+
+        Args:
+            world: The world the characters live in
+            candidates: Names to choose from (defaults to every character)
+            exclude: Names never chosen, e.g. the player character
+        """
+        excluded = set(exclude)
+        salience = self.salience(world, [name for name in (world.characters if candidates is None else candidates)
+                                         if name not in excluded])
+        ranked = heapq.nlargest(self.top_k, ((score, -position, name)
+                                             for position, (name, score) in enumerate(salience.items())))
+        return [name for _, _, name in ranked]
+
+    def split(self, world: World, names: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Split the characters that acted this turn into those appraised by the
+        model (the top_k most salient) and those updated locally.
+
+        Returns:
+            (activated names, local names), each in the given order
+        """
+        chosen = set(self.select(world, names))
+        activated = [name for name in names if name in chosen]
+        local = [name for name in names if name not in chosen]
+        with self._lock:
+            self.stats["activated"] += len(activated)
+            self.stats["local"] += len(local)
+        return activated, local
+
+    def record(self, acted: Iterable[str]):
+        """End a turn in which the given characters acted"""
+        with self._lock:
+            for name in acted:
+                self.last_acted[name] = self.turn
+            self.turn += 1
+            self.stats["turns"] += 1
+
@@ -0,0 +1,263 @@
+import re
+from typing import Dict, List, Tuple, Any, Optional, Iterable
+from character_world_classes import Character, World
+
+# Emotion families used to decide which of a character's emotions a rule touches
+NEGATIVE_EMOTIONS = {
+    "anger", "sadness", "fear", "anxiety", "guilt", "shame", "distress", "frustration",
+    "suspicion", "concern", "worry", "resentment", "disappointment", "regret", "defensiveness",
+    "panic", "dread", "stress"
+}
+POSITIVE_EMOTIONS = {
+    "happiness", "joy", "hope", "relief", "pride", "gratitude", "satisfaction", "calm",
+    "calmness", "trust", "admiration", "determination", "curiosity", "confidence"
+}
+AROUSAL_EMOTIONS = {"fear", "surprise", "anxiety", "alarm", "panic", "anger", "suspicion", "shock"}
+SELF_CONSCIOUS_EMOTIONS = {"guilt", "shame", "regret", "embarrassment"}
+OTHER_DIRECTED_EMOTIONS = {"anger", "suspicion", "defensiveness", "resentment"}
+SELF_PRAISE_EMOTIONS = {"pride", "satisfaction", "confidence"}
+OTHER_PRAISE_EMOTIONS = {"gratitude", "admiration", "trust"}
+
+VALENCE_EMOTIONS = {"negative": NEGATIVE_EMOTIONS, "positive": POSITIVE_EMOTIONS}
+
+# goal congruence level -> (goal priority change, emotion valence, emotion increase)
+GOAL_CONGRUENCE_RULES = {
+    "strongly_hindering": (-0.10, "negative", 0.15),
+    "moderately_hindering": (-0.05, "negative", 0.10),
+    "moderately_facilitating": (0.05, "positive", 0.10),
+    "strongly_facilitating": (0.10, "positive", 0.15)
+}
+UNEXPECTEDNESS_RULES = {"none": 0.0, "moderate": 0.10, "high": 0.20}
+# (responsibility, emotion valence) -> emotions adjusted by the attribution
+RESPONSIBILITY_RULES = {
+    ("self", "negative"): SELF_CONSCIOUS_EMOTIONS,
+    ("other", "negative"): OTHER_DIRECTED_EMOTIONS,
+    ("self", "positive"): SELF_PRAISE_EMOTIONS,
+    ("other", "positive"): OTHER_PRAISE_EMOTIONS
+}
+RESPONSIBILITY_LEVELS = ("self", "other", "external")
+RESPONSIBILITY_CHANGE = 0.10
+BELIEF_CHANGE = 0.10
+TOM_CHANGE = 0.10
+
+# Keyword cues used by describe_event
+STRONG_HINDERING_CUES = {"sabotage", "sabotaged", "attack", "attacks", "destroy", "destroys", "betray",
+                         "betrays", "accuse", "accuses", "threaten", "threatens", "explode", "explodes"}
+HINDERING_CUES = {"fail", "fails", "failure", "malfunction", "malfunctions", "lie", "lies", "hide",
+                  "hides", "conceal", "conceals", "refuse", "refuses", "damage", "damages", "blame",
+                  "blames", "shut", "leak", "leaks", "argue", "argues", "withhold", "withholds"}
+STRONG_FACILITATING_CUES = {"fix", "fixes", "fixed", "repair", "repairs", "repaired", "restore",
+                            "restores", "restored", "rescue", "rescues", "save", "saves"}
+FACILITATING_CUES = {"help", "helps", "share", "shares", "cooperate", "cooperates", "support",
+                     "supports", "reassure", "reassures", "agree", "agrees", "explain", "explains",
+                     "assist", "assists", "trust", "trusts", "confess", "confesses"}
+UNEXPECTED_CUES = {"suddenly", "unexpected", "unexpectedly", "surprise", "surprising", "shock",
+                   "shocking", "alarm", "alarming", "abruptly"}
+EXTERNAL_CUES = {"malfunction", "malfunctions", "system", "systems", "failure", "leak", "leaks", "power"}
+NEGATION_CUES = {"not", "no", "never", "isn't", "wasn't", "doesn't", "didn't"}
+
+
+class AppraisalEvent:
+    def __init__(self, goal_congruence: Optional[Dict[str, str]] = None,
+                 unexpectedness: str = "none", responsibility: str = "external",
+                 confirmed_beliefs: Iterable[str] = (), contradicted_beliefs: Iterable[str] = (),
+                 theory_of_mind: Optional[Dict[str, Dict[str, str]]] = None):
+        """
+        Structured description of an event for rule-based OCC appraisal.
+
+        Args:
+            goal_congruence: Goal name -> "strongly_hindering", "moderately_hindering",
+                "moderately_facilitating" or "strongly_facilitating"
+            unexpectedness: "none", "moderate" or "high"
+            responsibility: "self", "other" or "external"
+            confirmed_beliefs: Beliefs the event confirms
+            contradicted_beliefs: Beliefs the event contradicts
+            theory_of_mind: Character name -> {belief: "supports" or "contradicts"}
+        """
+        self.goal_congruence = goal_congruence or {}
+        self.unexpectedness = unexpectedness
+        self.responsibility = responsibility
+        self.confirmed_beliefs = list(confirmed_beliefs)
+        self.contradicted_beliefs = list(contradicted_beliefs)
+        self.theory_of_mind = theory_of_mind or {}
+
+        for level in self.goal_congruence.values():
+            if level not in GOAL_CONGRUENCE_RULES:
+                raise ValueError(f"Unknown goal congruence level: {level}")
+        if unexpectedness not in UNEXPECTEDNESS_RULES:
+            raise ValueError(f"Unknown unexpectedness level: {unexpectedness}")
+        if responsibility not in RESPONSIBILITY_LEVELS:
+            raise ValueError(f"Unknown responsibility: {responsibility}")
+
+
+def _clamp(value: float) -> float:
+    return round(max(0.0, min(1.0, value)), 6)
+
+
+def _terms(text: str) -> List[str]:
+    return re.findall(r"[a-z']+", text.lower())
+
+
+class RuleBasedAppraiser:
+    """
+    Local implementation of the OCC update procedure described in
+    OCCAppraisalModel.generate_appraisal_prompt. It returns the same structure
+    as the model's JSON output, with every value clamped to [0, 1].
+    """
+
+    def appraise(self, character: Character, event: AppraisalEvent) -> Dict[str, Any]:
+        """
+        Apply the standardized update rules for an event.
+
+        Args:
+            character: The character performing the appraisal
+            event: Structured description of the event
+
+        Returns:
+            Dictionary of state updates for the character
+        """
+        emotions = character.store.row_dict("emotions", character.row)
+        beliefs = character.store.row_dict("beliefs", character.row)
+        goals = character.store.goals_dict(character.row)
+        emotion_deltas = {}
+        explanation = []
+
+        def raise_emotions(family: set, amount: float) -> bool:
+            """Raise the character's emotions in family; False if it has none of them"""
+            raised = False
+            for emotion in emotions:
+                if emotion.lower() in family:
+                    emotion_deltas[emotion] = emotion_deltas.get(emotion, 0.0) + amount
+                    raised = True
+            return raised
+
+        # a. Goal congruence: adjust each goal, then each emotion valence once at its strongest level
+        goal_updates = {}
+        strongest = {}
+        for goal_name, level in event.goal_congruence.items():
+            priority_change, valence, emotion_change = GOAL_CONGRUENCE_RULES[level]
+            for goal_type, type_goals in goals.items():
+                if goal_name in type_goals:
+                    goal_updates.setdefault(goal_type, {})[goal_name] = _clamp(type_goals[goal_name] + priority_change)
+            strongest[valence] = max(strongest.get(valence, 0.0), emotion_change)
+            explanation.append(f"{goal_name} is {level.replace('_', ' ')}")
+        for valence, emotion_change in strongest.items():
+            raise_emotions(VALENCE_EMOTIONS[valence], emotion_change)
+
+        # Unexpectedness raises arousal-based emotions
+        arousal_change = UNEXPECTEDNESS_RULES[event.unexpectedness]
+        if arousal_change:
+            raise_emotions(AROUSAL_EMOTIONS, arousal_change)
+            explanation.append(f"{event.unexpectedness} unexpectedness")
+
+        # Responsibility attribution (e.g. guilt for self-caused harm, defensiveness when others cause it)
+        attributed = False
+        for valence in strongest:
+            responsible_family = RESPONSIBILITY_RULES.get((event.responsibility, valence))
+            if responsible_family:
+                attributed = raise_emotions(responsible_family, RESPONSIBILITY_CHANGE) or attributed
+        if attributed:
+            explanation.append(f"attributed to {event.responsibility} causes")
+
+        # b. Emotions, clamped after all adjustments
+        emotional_updates = {
+            emotion: _clamp(emotions[emotion] + delta) for emotion, delta in emotion_deltas.items()
+        }
+
+        # c. Beliefs
+        belief_updates = {}
+        for belief in event.confirmed_beliefs:
+            if belief in beliefs:
+                belief_updates[belief] = _clamp(beliefs[belief] + BELIEF_CHANGE)
+        for belief in event.contradicted_beliefs:
+            if belief in beliefs:
+                belief_updates[belief] = _clamp(beliefs[belief] - BELIEF_CHANGE)
+
+        # e. Theory of mind
+        theory_of_mind_updates = {}
+        # Read without materializing the sparse defaults (see StateStore.tom_row)
+        theory_of_mind = character.store.tom_dict(character.row, targets=event.theory_of_mind)
+        for name, observations in event.theory_of_mind.items():
+            current = theory_of_mind.get(name)
+            if current is None:
+                continue
+            for belief, observation in observations.items():
+                if belief in current:
+                    change = TOM_CHANGE if observation == "supports" else -TOM_CHANGE
+                    theory_of_mind_updates.setdefault(name, {})[belief] = _clamp(current[belief] + change)
+
+        return {
+            "emotional_updates": emotional_updates,
+            "belief_updates": belief_updates,
+            "theory_of_mind_updates": theory_of_mind_updates,
+            "goal_updates": goal_updates,
+            "appraisal_explanation": "Rule-based appraisal: " + "; ".join(explanation)
+        }
+
+
+def describe_event(character: Character, world: World, action: str) -> Optional[AppraisalEvent]:
+    """
+    Build an AppraisalEvent for an action from keyword cues. The beliefs the
+    action confirms or contradicts are also observed about every other
+    character it names.
+
+    Args:
+        character: The character performing the appraisal
+        world: The current world state
+        action: The action being appraised
+
+    Returns:
+        AppraisalEvent, or None when the action is ambiguous (no cues, or both
+        hindering and facilitating cues) and should go to the model instead
+    """
+    terms = set(_terms(action))
+    strong_hindering = bool(terms & STRONG_HINDERING_CUES)
+    hindering = strong_hindering or bool(terms & HINDERING_CUES)
+    strong_facilitating = bool(terms & STRONG_FACILITATING_CUES)
+    facilitating = strong_facilitating or bool(terms & FACILITATING_CUES)
+    if hindering == facilitating:
+        return None
+
+    if hindering:
+        level = "strongly_hindering" if strong_hindering else "moderately_hindering"
+    else:
+        level = "strongly_facilitating" if strong_facilitating else "moderately_facilitating"
+
+    # Goals that share a term with the action; otherwise the highest-priority goal
+    goals = character.store.goals_dict(character.row)
+    all_goals = [(priority, goal) for type_goals in goals.values() for goal, priority in type_goals.items()]
+    matched = [goal for _, goal in all_goals if terms & set(goal.split("_"))]
+    if not matched and all_goals:
+        matched = [max(all_goals)[1]]
+
+    # Beliefs that share a term with the action are confirmed, or contradicted under negation
+    confirmed, contradicted = [], []
+    negated = bool(terms & NEGATION_CUES)
+    for belief in character.store.row_dict("beliefs", character.row):
+        if terms & (set(belief.split("_")) - {"me", "is", "the"}):
+            (contradicted if negated else confirmed).append(belief)
+
+    # The beliefs the action bears on are attributed to the characters it names too
+    others = [name for name in world.mentioned_characters(action) if name != character.name]
+    theory_of_mind = {}
+    for name in others:
+        observations = {belief: "supports" for belief in confirmed}
+        observations.update({belief: "contradicts" for belief in contradicted})
+        if observations:
+            theory_of_mind[name] = observations
+
+    if others:
+        responsibility = "other"
+    elif terms & EXTERNAL_CUES:
+        responsibility = "external"
+    else:
+        responsibility = "self"
+
+    return AppraisalEvent(
+        goal_congruence={goal: level for goal in matched},
+        unexpectedness="high" if terms & UNEXPECTED_CUES else "none",
+        responsibility=responsibility,
+        confirmed_beliefs=confirmed,
+        contradicted_beliefs=contradicted,
+        theory_of_mind=theory_of_mind
+    )
@@ -0,0 +1,238 @@
+import functools
+import json
+import re
+import threading
+from typing import Dict, List, Tuple, Any, Optional, Iterable
+
+import numpy as np
+
+from character_world_classes import World
+from prompt_encoding import estimate_tokens
+
+STOP_TERMS = {"a", "an", "the", "is", "are", "me", "my", "i", "of", "to", "and", "in", "on", "at", "for", "with"}
+
+# Relevance of a character's entries, by how the character relates to the action
+ACTOR_WEIGHT = 1.0
+MENTIONED_WEIGHT = 0.8
+BYSTANDER_WEIGHT = 0.3
+
+# Base relevance of each kind of entry; the entry's own score is added to it
+GOAL_WEIGHT = 0.5        # + priority
+EMOTION_WEIGHT = 0.3     # + intensity
+BELIEF_WEIGHT = 0.2      # + 0.5 per term shared with the action (at most 2) + distance from 0.5
+TOM_WEIGHT = 0.4         # + 0.5 per term shared with the action (at most 2)
+OVERLAP_WEIGHT = 0.5
+MAX_OVERLAP = 2
+
+ENTRY_OVERHEAD_TOKENS = 2  # quotes, colon, value separator
+VALUE_TOKENS = 2           # a rounded float such as 0.75
+CHARACTER_OVERHEAD_TOKENS = 12  # name and section keys of an included character
+
+
+def key_terms(text: str) -> frozenset:
+    """Lowercase terms of an action, or of a snake_case key, minus stop words"""
+    return frozenset(re.findall(r"[a-z']+", text.lower().replace("_", " "))) - STOP_TERMS
+
+
+# Keys repeat across characters and prompts
+_cached_key_terms = functools.lru_cache(maxsize=65536)(key_terms)
+
+
+class RelevancePromptBuilder:
+    def __init__(self, token_budget: int = 1500, history_length: int = 5):
+        """
+        Build a world state for prompts that fits a token budget, keeping the
+        entries most relevant to the current action and acting character.
+
+        The setting, background, world state and recent history are always
+        kept (oldest history first to go if even they exceed the budget), as
+        are the relevant earlier events of an indexed history (dropped before
+        the recent history).
+        Character entries are then ranked and added greedily until the budget
+        is used up:
+            - Entries of the acting character rank above those of characters
+              the action names, which rank above everyone else
+            - Goals rank by priority and emotions by intensity
+            - Beliefs and theory-of-mind entries rank by the terms they share
+              with the action; beliefs also by how far they are from 0.5
+
+        Token counts are estimates for the compact encoding (see
+        prompt_encoding.estimate_tokens); the indented "full" encoding is larger.
+
+        Args:
+            token_budget: Estimated tokens available for the world state
+            history_length: Most recent history entries to include
+        """
+        self.token_budget = token_budget
+        self.history_length = history_length
+        self.stats = {"builds": 0, "entries_kept": 0, "entries_dropped": 0}
+        self._lock = threading.Lock()
+
+    def build(self, world: World, action: Optional[str] = None, actor: Optional[str] = None,
+              characters: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Return the pruned world state for a prompt.
+
+        Args:
+            world: The world to describe
+            action: Text the prompt is about (player input, an NPC action, ...)
+            actor: Name of the character acting or appraising, if any
+            characters: Only consider these characters' entries (defaults to everyone)
+
+        Returns:
+            Dictionary shaped like World.get_state_for_prompt, with only the
+            selected character entries and an "omitted_entries" count when
+            anything was left out
+        """
+        action = action or ""
+        store = world.store
+        terms = key_terms(action)
+        mentioned = [name for name in world.mentioned_characters(action) if name != actor] if action else []
+
+        # Header that is always sent
+        history = world.history[-self.history_length:] if self.history_length else []
+        state = {
+            "setting": world.setting,
+            "background": world.background,
+            "state": world.state,
+            "characters": {},
+            "recent_history": list(history)
+        }
+        # Earlier events relevant to the action, when the history is indexed (see World.index_history)
+        relevant = world.relevant_history(action, exclude_recent=self.history_length,
+                                          characters=[actor] if actor else ()) if action else []
+        if relevant:
+            state["relevant_history"] = relevant
+        remaining = self.token_budget - self._tokens(state)
+        for key in ("relevant_history", "recent_history"):
+            while remaining < 0 and state.get(key):
+                dropped = state[key].pop(0)
+                remaining += self._tokens(dropped) + 1
+        if "relevant_history" in state and not state["relevant_history"]:
+            del state["relevant_history"]
+
+        # Per-character weights, indexed by store row
+        names = list(world.characters)
+        if characters is not None:
+            allowed = set(characters)
+            names = [name for name in names if name in allowed]
+        rows = np.array([world.characters[name].row for name in names], dtype=np.intp)
+        weights = np.full(len(names), BYSTANDER_WEIGHT)
+        for index, name in enumerate(names):
+            if name == actor:
+                weights[index] = ACTOR_WEIGHT
+            elif name in mentioned:
+                weights[index] = MENTIONED_WEIGHT
+
+        # Candidate entries: (score, tokens, character index, dimension, column)
+        scores, costs, owners, dimensions, columns = [], [], [], [], []
+        for dimension in ("goals", "emotions", "beliefs"):
+            keys = store.columns[dimension].keys
+            if not keys:
+                continue
+            values = store.arrays[dimension][rows, :len(keys)]
+            if dimension == "goals":
+                relevance = GOAL_WEIGHT + values
+                key_costs = np.array([estimate_tokens(goal) for _, goal in keys])
+            elif dimension == "emotions":
+                relevance = EMOTION_WEIGHT + values
+                key_costs = np.array([estimate_tokens(key) for key in keys])
+            else:
+                overlap = np.array([min(MAX_OVERLAP, len(terms & _cached_key_terms(key))) for key in keys])
+                relevance = BELIEF_WEIGHT + OVERLAP_WEIGHT * overlap[None, :] + np.abs(values - 0.5)
+                key_costs = np.array([estimate_tokens(key) for key in keys])
+            score = weights[:, None] * relevance
+            owner, column = np.nonzero(~np.isnan(values))
+            scores.append(score[owner, column])
+            costs.append(key_costs[column] + ENTRY_OVERHEAD_TOKENS + VALUE_TOKENS)
+            owners.append(owner)
+            columns.append(column)
+            dimensions.append(np.full(len(owner), ("goals", "emotions", "beliefs").index(dimension)))
+
+        # Theory of mind: the actor's view of the named characters and theirs of the actor
+        tom_entries = []
+        views = []
+        if actor in names and mentioned:
+            views.append((names.index(actor), mentioned))
+            views.extend((names.index(name), [actor]) for name in mentioned if name in names)
+        for index, targets in views:
+            character = world.characters[names[index]]
+            for target, beliefs in store.tom_dict(character.row, targets=targets).items():
+                for belief, value in beliefs.items():
+                    overlap = min(MAX_OVERLAP, len(terms & _cached_key_terms(belief)))
+                    tom_entries.append((weights[index] * (TOM_WEIGHT + OVERLAP_WEIGHT * overlap),
+                                        estimate_tokens(belief) + ENTRY_OVERHEAD_TOKENS + VALUE_TOKENS,
+                                        index, target, belief, value))
+
+        dense_count = sum(len(score) for score in scores)
+        all_scores = np.concatenate(scores + [np.array([entry[0] for entry in tom_entries], dtype=float)])
+        all_costs = np.concatenate(costs + [np.array([entry[1] for entry in tom_entries], dtype=int)])
+        min_cost = int(all_costs.min()) if len(all_costs) else 0
+
+        # Greedy fill, most relevant first; an entry that does not fit is skipped
+        included = {}  # character index -> selected entries
+        kept = 0
+        for position in np.argsort(-all_scores, kind="stable"):
+            if remaining < min_cost:
+                break
+            if position < dense_count:
+                owner, column, dimension = self._dense_entry(position, owners, columns, dimensions)
+            else:
+                owner = tom_entries[position - dense_count][2]
+            cost = int(all_costs[position])
+            if owner not in included:
+                cost += CHARACTER_OVERHEAD_TOKENS
+            if cost > remaining:
+                continue
+            remaining -= cost
+            entries = included.setdefault(owner, [])
+            entries.append(("dense", dimension, column) if position < dense_count
+                           else ("tom",) + tom_entries[position - dense_count][3:])
+            kept += 1
+
+        # Assemble the selected entries in world order
+        for index, name in enumerate(names):
+            if index not in included and name != actor:
+                continue
+            state["characters"][name] = self._character_state(store, world.characters[name].row, name,
+                                                              included.get(index, []))
+
+        dropped = len(all_scores) - kept
+        if dropped:
+            state["omitted_entries"] = dropped
+        with self._lock:
+            self.stats["builds"] += 1
+            self.stats["entries_kept"] += kept
+            self.stats["entries_dropped"] += dropped
+        return state
+
+    @staticmethod
+    def _dense_entry(position: int, owners: List[np.ndarray], columns: List[np.ndarray],
+                     dimensions: List[np.ndarray]) -> Tuple[int, int, int]:
+        for owner, column, dimension in zip(owners, columns, dimensions):
+            if position < len(owner):
+                return int(owner[position]), int(column[position]), int(dimension[position])
+            position -= len(owner)
+        raise IndexError(position)
+
+    @staticmethod
+    def _character_state(store: Any, row: int, name: str, entries: Iterable[Tuple]) -> Dict[str, Any]:
+        character = {"name": name, "emotions": {}, "beliefs": {}, "theory_of_mind": {}, "goals": {}}
+        for entry in entries:
+            if entry[0] == "tom":
+                _, target, belief, value = entry
+                character["theory_of_mind"].setdefault(target, {})[belief] = value
+                continue
+            _, dimension, column = entry
+            dimension = ("goals", "emotions", "beliefs")[dimension]
+            key = store.columns[dimension].keys[column]
+            value = float(store.arrays[dimension][row, column])
+            if dimension == "goals":
+                character["goals"].setdefault(key[0], {})[key[1]] = value
+            else:
+                character[dimension][key] = value
+        return {key: value for key, value in character.items() if value or key == "name"}
+
+    @staticmethod
+    def _tokens(value: Any) -> int:
+        return estimate_tokens(json.dumps(value, separators=(",", ":"), ensure_ascii=False))
@@ -0,0 +1,81 @@
+import json
+import threading
+from typing import Dict, Any
+
+ENCODING_MODES = ("full", "compact")
+
+
+def compact_value(value: Any, precision: int) -> Any:
+    """Recursively round floats and collapse runs of whitespace in strings"""
+    if isinstance(value, float):
+        return round(value, precision)
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {key: compact_value(item, precision) for key, item in value.items()}
+    if isinstance(value, list):
+        return [compact_value(item, precision) for item in value]
+    return value
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text and JSON (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+
+class StateEncoder:
+    def __init__(self, mode: str = "full", precision: int = 2):
+        """
+        Serialize world and character state for prompts.
+
+        Modes:
+            full: Indented JSON of the whole state (the original prompt format)
+            compact: Minified JSON with floats rounded to a fixed precision and
+                whitespace inside strings collapsed; prompts refer back to the
+                world state instead of repeating a character
+
+        Args:
+            mode: "full" or "compact"
+            precision: Decimal places kept for floats in compact mode
+        """
+        if mode not in ENCODING_MODES:
+            raise ValueError(f"Unknown state encoding mode: {mode}")
+        self.mode = mode
+        self.precision = precision
+
+        self.prompt_stats = {}  # channel -> size of the most recent prompt
+        self.totals = {"prompts": 0, "bytes": 0, "tokens": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def deduplicate(self) -> bool:
+        """Whether prompts should reference state already present instead of repeating it"""
+        return self.mode != "full"
+
+    def dumps(self, value: Any) -> str:
+        """Serialize a JSON-like value in the encoder's format"""
+        if self.mode == "full":
+            return json.dumps(value, indent=2)
+        return json.dumps(compact_value(value, self.precision), separators=(",", ":"), ensure_ascii=False)
+
+    def encode_state(self, state: Dict[str, Any]) -> str:
+        """
+        Encode a state dictionary for a prompt.
+
+        Args:
+            state: JSON-like state, usually World.get_state_for_prompt()
+
+        Returns:
+            Encoded state text to embed in the prompt
+        """
+        return self.dumps(state)
+
+    def measure(self, channel: str, prompt: str) -> Dict[str, int]:
+        """Record and return the byte and estimated token size of a finished prompt"""
+        stats = {"bytes": len(prompt.encode("utf-8")), "tokens": estimate_tokens(prompt)}
+        with self._lock:
+            self.prompt_stats[channel] = stats
+            self.totals["prompts"] += 1
+            self.totals["bytes"] += stats["bytes"]
+            self.totals["tokens"] += stats["tokens"]
+        return stats
@@ -0,0 +1,254 @@
+import textwrap
+from typing import Dict, Any, Optional
+
+from character_world_classes import World
+
+# World state keys sent in the prompt prefix instead of the state section
+PREFIX_STATE_KEYS = ("setting", "background")
+
+# Standardized OCC update procedure shared by the single and batched appraisal prompts
+OCC_UPDATE_PROCEDURE = """The following describes standardized procedures for updating the character's state based on the action. This follows the OCC model for cognitive appraisal of emotion.
+
+**Standardized State Update Procedure:**
+After analyzing the action, update the states of the character by following these guidelines:
+
+**a. Appraisal of the action:**
+- **Goal Congruence:**
+    - If the event is assessed as *strongly hindering* a character’s goal, then:
+    - Decrease the goal's priority by **0.10**.
+    - Increase related negative emotions (e.g., anger, sadness) by **0.15**.
+    - If the event is assessed as *moderately hindering* a character’s goal, then:
+    - Decrease the goal's priority by **0.05**.
+    - Increase related negative emotions by **0.10**.
+    - If the event is assessed as *strongly facilitating* a goal, then:
+    - Increase the goal's priority by **0.10**.
+    - Increase related positive emotions (e.g., happiness) by **0.15**.
+    - If the event is assessed as *moderately facilitating* a goal, then:
+    - Increase the goal's priority by **0.05**.
+    - Increase related positive emotions by **0.10**.
+- **Unexpectedness:**
+    - For highly unexpected events, add a factor of +0.20 to arousal-based emotions (e.g., fear, surprise).
+    - For moderately unexpected events, add +0.10.
+- **Responsibility Attribution:**
+    - Note whether the event is self-caused, caused by another agent, or due to external factors, and adjust the corresponding emotions (e.g., guilt or defensiveness) by **0.10** accordingly.
+
+**b. Updating Emotions:**
+- For each character, update their emotional intensities (values are decimals between 0 and 1) as follows:
+    - If an event strongly hinders an important goal, increase relevant negative emotions (e.g., anger, sadness) by +0.15.
+    - If it moderately hinders a goal, increase them by +0.10.
+    - If an event strongly facilitates a goal, increase relevant positive emotions (e.g., happiness) by +0.15; if moderately, by +0.10.
+    - For a highly unexpected event, increase arousal-based emotions (e.g., fear, surprise) by +0.20.
+- After adjustments, ensure all emotion values are clamped between 0 and 1.
+
+**c. Updating Beliefs:**
+- If an event confirms a belief, increase the belief’s probability by +0.10.
+- If an event contradicts a belief, decrease it by -0.10.
+- Clamp belief probabilities between 0 and 1.
+
+**d. Updating Goals:**
+- If an event facilitates a goal, increase its priority by +0.10.
+- If an event blocks a goal, decrease its priority by -0.10.
+- Clamp goal priorities between 0 and 1.
+
+**e. Updating Theory of Mind:**
+- For each belief about another character, if an observed behavior supports that belief, increase its value by +0.10; if it contradicts, decrease it by -0.10.
+- Clamp these values between 0 and 1."""
+
+
+class PromptTemplate:
+    def __init__(self, prefix: str, suffix: str):
+        """
+        A prompt split into a static prefix and a dynamic suffix.
+
+        The prefix holds the instructions and output schema. It is dedented
+        once here and sent byte for byte the same on every call, so providers
+        and local servers that cache prompt prefixes can reuse it. The world's
+        setting and background come next, since they do not change during a
+        story, and the per-call state is appended last.
+
+        Args:
+            prefix: Static text; not formatted, so JSON braces need no escaping
+            suffix: Dynamic text formatted with the fields passed to render()
+        """
+        self.prefix = textwrap.dedent(prefix).strip() + "\n\n"
+        self.suffix = textwrap.dedent(suffix).strip() + "\n"
+
+    def render(self, world: Optional[World] = None, **fields) -> str:
+        """
+        Build the prompt.
+
+        Args:
+            world: World whose setting and background follow the static prefix
+            fields: Values for the suffix placeholders
+
+        Returns:
+            Prompt string
+        """
+        return self.prefix + (world_header(world) if world is not None else "") + self.suffix.format(**fields)
+
+
+def world_header(world: World) -> str:
+    """Setting and background of a world, the part of a prompt that is fixed for a story"""
+    return f"## Setting\n{world.setting}\n\n## Background\n{world.background}\n\n"
+
+
+def dynamic_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """World state for the prompt suffix, without the keys already in the prefix"""
+    return {key: value for key, value in state.items() if key not in PREFIX_STATE_KEYS}
+
+
+APPRAISAL_TEMPLATE = PromptTemplate(
+    prefix="""
+# OCC Appraisal Model Evaluation
+
+## Task
+""" + OCC_UPDATE_PROCEDURE + """
+
+## Output Format
+Return a JSON object with the following structure:
+```json
+{
+    "emotional_updates": {
+        "emotion_name": new_value,
+        ...
+    },
+    "belief_updates": {
+        "belief_name": new_value,
+        ...
+    },
+    "theory_of_mind_updates": {
+        "character_name": {
+            "belief_name": new_value,
+            ...
+        },
+        ...
+    },
+    "goal_updates": {
+        "goal_type": {
+            "goal_name": new_value,
+            ...
+        },
+        ...
+    },
+    "appraisal_explanation": "Explanation of why these changes occurred based on OCC model"
+}
+```
+
+The world, the character performing the appraisal and the action to appraise follow.
+""",
+    suffix="""
+## World State
+{world_state}
+
+## Character Performing Appraisal
+{character_state}
+
+## Action to Appraise
+{action}
+""")
+
+BATCH_APPRAISAL_TEMPLATE = PromptTemplate(
+    prefix="""
+# OCC Appraisal Model Evaluation (Batch)
+
+## Task
+""" + OCC_UPDATE_PROCEDURE + """
+
+Apply this procedure separately for every character listed under Actions to Appraise. Each character appraises their own action. Their current state is listed under World State characters.
+
+## Output Format
+Return a JSON object with one entry per character, keyed by the character's exact name:
+```json
+{
+    "character_name": {
+        "emotional_updates": {"emotion_name": new_value, ...},
+        "belief_updates": {"belief_name": new_value, ...},
+        "theory_of_mind_updates": {"other_character": {"belief_name": new_value, ...}, ...},
+        "goal_updates": {"goal_type": {"goal_name": new_value, ...}, ...},
+        "appraisal_explanation": "Explanation of why these changes occurred based on OCC model"
+    },
+    ...
+}
+```
+
+The world and the actions to appraise follow.
+""",
+    suffix="""
+## World State
+{world_state}
+
+## Actions to Appraise
+{sections}
+""")
+
+ACTION_TEMPLATE = PromptTemplate(
+    prefix="""
+# Interactive Story Generation
+
+## Task
+Generate the next part of the interactive story based on the player's action.
+
+1. Determine how other characters would realistically react.
+2. Update the world state if necessary.
+3. Provide a narrative description of what happens.
+
+## Output Format
+Return a JSON object with the following structure:
+```json
+{
+    "narrative": "Description of what happens in the story",
+    "character_actions": {
+        "character_name": "Description of this character's reaction",
+        ...
+    },
+    "world_state_updates": {
+        "state_key": new_value,
+        ...
+    }
+}
+```
+
+The world, the player character and the player's action follow.
+""",
+    suffix="""
+## World State
+{world_state}
+
+## Player Character
+{player_character}
+
+## Player's Action
+{user_input}
+""")
+
+NPC_TEMPLATE = PromptTemplate(
+    prefix="""
+# NPC Character Actions
+
+## Task
+Generate the next actions for the non-player characters in the story.
+Consider each character's goals, beliefs, and emotional state.
+Characters should act in ways that are consistent with their beliefs and goals.
+
+## Output Format
+Return a JSON object with the following structure:
+```json
+{
+    "narrative": "Description of what the NPCs do",
+    "character_actions": {
+        "character_name": "Description of this character's action",
+        ...
+    },
+    "world_state_updates": {
+        "state_key": new_value,
+        ...
+    }
+}
+```
+
+The world follows.
+""",
+    suffix="""
+## World State
+{world_state}{acting}
+""")
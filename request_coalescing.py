@@ -0,0 +1,107 @@
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Tuple, Any, Optional, Callable, Iterator
+
+from llm_backends import LLMBackend, LLMResponse, DEFAULT_MODEL
+from response_cache import make_cache_key
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Run at most one call per key at a time. A call made while another with
+        the same key is in flight waits for it and gets its result (or its
+        exception) instead of running again.
+        """
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0, "errors": 0}
+        self._flights = {}  # key -> Future of the call in flight
+        self._lock = threading.Lock()
+
+    def do(self, key: str, call: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Run call, or join the call already in flight for key.
+
+        Args:
+            key: Identity of the call
+            call: Produces the result when no call for key is in flight
+            timeout: Seconds to wait for another caller's call (None waits
+                as long as it runs); TimeoutError is raised past it
+
+        Returns:
+            Tuple of (result, True if it came from another caller's call)
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self.stats["upstream"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            try:
+                return flight.result(timeout), True
+            except FutureTimeout:
+                raise TimeoutError(f"Coalesced call exceeded timeout of {timeout}s") from None
+
+        try:
+            result = call()
+        except BaseException as e:
+            with self._lock:
+                del self._flights[key]
+                self.stats["errors"] += 1
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            del self._flights[key]
+        flight.set_result(result)
+        return result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+class CoalescingBackend(LLMBackend):
+    def __init__(self, backend: LLMBackend, flights: Optional[SingleFlight] = None):
+        """
+        Backend wrapper that sends identical concurrent completions upstream
+        once. A request with the same model, sampling parameters and messages
+        as one in flight waits for that call and receives its response, marked
+        cached since it cost no model call. Errors reach every waiting caller,
+        and a caller's timeout also bounds its wait for another caller's call.
+        Streams pass through uncoalesced.
+
+        Args:
+            backend: Backend that runs the calls
+            flights: Group to coalesce in; share one between wrappers (e.g. one
+                per game session) to coalesce across them
+        """
+        self.backend = backend
+        self.flights = flights or SingleFlight()
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        key = make_cache_key(model, {"temperature": temperature, "max_tokens": max_tokens}, messages)
+        response, shared = self.flights.do(key, lambda: self.backend.complete(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens, timeout=timeout),
+            timeout=timeout)
+        if shared:
+            return LLMResponse(text=response.text, model=response.model, usage=response.usage,
+                               latency=response.latency, cached=True)
+        return response
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        return self.backend.stream(messages, model=model, temperature=temperature,
+                                   max_tokens=max_tokens, timeout=timeout)
+
+    def discard(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                temperature: float = 0.7, max_tokens: int = 1000):
+        self.backend.discard(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Iterator
+
+from llm_backends import LLMBackend, LLMResponse, DEFAULT_MODEL
+
+
+def make_cache_key(model: str, params: Dict[str, Any], messages: List[Dict[str, str]]) -> str:
+    """
+    Build a content-addressed key for a completion request.
+
+    Args:
+        model: Model name
+        params: Sampling parameters that affect the output (temperature, max_tokens, ...)
+        messages: Chat messages sent to the model
+
+    Returns:
+        Hex SHA-256 digest of the canonical request
+    """
+    canonical = json.dumps(
+        {"model": model, "params": params, "messages": messages},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 100 * 1024 * 1024):
+        """
+        Two-tier cache of completion results: an in-memory LRU and an optional
+        on-disk tier that evicts least recently used files once it exceeds its size.
+
+        Args:
+            max_entries: Maximum number of responses kept in memory
+            cache_dir: Directory for the on-disk tier (None disables it)
+            max_disk_bytes: Size budget for the on-disk tier in bytes
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self.memory = OrderedDict()  # key -> cached entry, least recently used first
+        self.disk_index = OrderedDict()  # key -> file size, least recently used first
+        self.disk_bytes = 0
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+                      "memory_evictions": 0, "disk_evictions": 0}
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for a key, or None on a miss"""
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return self.memory[key]
+
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                return entry
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Store an entry in memory and, if enabled, on disk"""
+        with self._lock:
+            self._remember(key, entry)
+            if self.cache_dir:
+                self._write_disk(key, entry)
+
+    def discard(self, key: str):
+        """Drop one entry from both tiers"""
+        with self._lock:
+            self.memory.pop(key, None)
+            if key in self.disk_index:
+                self._remove_disk(key)
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self.memory.clear()
+            for key in list(self.disk_index):
+                self._remove_disk(key)
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        """Insert into the memory tier, evicting the least recently used entry if full"""
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_disk_index(self):
+        """Rebuild the disk index from the cache directory, oldest access first"""
+        files = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".json"):
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                files.append((stat.st_mtime, filename[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk_index[key] = size
+            self.disk_bytes += size
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.cache_dir or key not in self.disk_index:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._remove_disk(key)
+            return None
+
+        # Touch the file so the access order survives restarts
+        os.utime(self._path(key))
+        self.disk_index.move_to_end(key)
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_disk_bytes:
+            return
+        if key in self.disk_index:
+            self._remove_disk(key)
+
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self.disk_index[key] = len(data)
+        self.disk_bytes += len(data)
+
+        while self.disk_bytes > self.max_disk_bytes:
+            oldest = next(iter(self.disk_index))
+            self._remove_disk(oldest)
+            self.stats["disk_evictions"] += 1
+
+    def _remove_disk(self, key: str):
+        size = self.disk_index.pop(key, 0)
+        self.disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class CachedBackend(LLMBackend):
+    def __init__(self, backend: LLMBackend, cache: ResponseCache):
+        """
+        Backend wrapper that answers repeated requests from a ResponseCache.
+        Only successful completions are stored; errors always reach the caller.
+        Responses that fail validation or parsing are removed again through
+        discard() (see ModelRouter), so they are not replayed.
+
+        Args:
+            backend: Backend used on a cache miss
+            cache: Cache shared by every call through this wrapper
+        """
+        self.backend = backend
+        self.cache = cache
+
+    def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        key = make_cache_key(model, {"temperature": temperature, "max_tokens": max_tokens}, messages)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return LLMResponse(text=entry["text"], model=entry["model"], usage=entry["usage"], cached=True)
+
+        response = self.backend.complete(messages, model=model, temperature=temperature,
+                                         max_tokens=max_tokens, timeout=timeout)
+        self.cache.put(key, {"text": response.text, "model": response.model, "usage": response.usage})
+        return response
+
+    def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+               temperature: float = 0.7, max_tokens: int = 1000,
+               timeout: Optional[float] = None) -> Iterator[str]:
+        key = make_cache_key(model, {"temperature": temperature, "max_tokens": max_tokens}, messages)
+        entry = self.cache.get(key)
+        if entry is not None:
+            yield entry["text"]
+            return
+
+        # Pass chunks through and store the full text once the stream completes
+        chunks = []
+        for chunk in self.backend.stream(messages, model=model, temperature=temperature,
+                                         max_tokens=max_tokens, timeout=timeout):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.put(key, {"text": "".join(chunks), "model": model, "usage": {}})
+
+    def discard(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                temperature: float = 0.7, max_tokens: int = 1000):
+        self.cache.discard(make_cache_key(model, {"temperature": temperature, "max_tokens": max_tokens}, messages))
+        self.backend.discard(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,270 @@
+import json
+import re
+import threading
+from typing import Dict, List, Tuple, Any, Optional, Callable
+
+# A fenced block, or what is left of one when the response was cut off
+JSON_FENCE = re.compile(r"```(?:json)?[ \t]*\n?([\s\S]*?)\s*(?:```|$)")
+# Shorter prefixes of a truncated response tried before giving up
+MAX_REPAIR_ATTEMPTS = 50
+CLOSERS = {"{": "}", "[": "]"}
+
+
+def repair_json(text: str) -> Any:
+    """
+    Decode JSON that is truncated or slightly malformed.
+
+    Text before the first bracket and after the value is ignored, commas
+    before a closing bracket are dropped and control characters in strings
+    are accepted. A truncated value is closed after its last complete
+    element: an unterminated string is ended and open brackets are closed,
+    backing off one element at a time until the text decodes.
+
+    Raises:
+        ValueError: If no JSON value can be recovered
+    """
+    starts = [position for position in (text.find("{"), text.find("[")) if position != -1]
+    if not starts:
+        raise ValueError("No JSON object in response")
+
+    out = []
+    stack = []
+    cuts = []  # (length of out before a comma, open brackets there)
+    in_string = escape = False
+    for char in text[min(starts):]:
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char in "}]":
+            if not stack:
+                break
+            _drop_trailing_comma(out)
+            stack.pop()
+            out.append(char)
+            if not stack:
+                break
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char == ",":
+            cuts.append((len(out), list(stack)))
+        out.append(char)
+
+    if not stack:
+        return json.loads("".join(out), strict=False)
+
+    head = "".join(out) + ('"' if in_string else "")
+    candidates = [(head, stack)] + [("".join(out[:cut]), open_brackets) for cut, open_brackets in reversed(cuts)]
+    for candidate, open_brackets in candidates[:MAX_REPAIR_ATTEMPTS]:
+        candidate = candidate.rstrip()
+        if candidate.endswith(","):
+            candidate = candidate[:-1]
+        try:
+            return json.loads(candidate + "".join(CLOSERS[bracket] for bracket in reversed(open_brackets)),
+                              strict=False)
+        except ValueError:
+            continue
+    raise ValueError("Could not repair the JSON in the response")
+
+
+def _drop_trailing_comma(out: List[str]):
+    position = len(out) - 1
+    while position >= 0 and out[position].isspace():
+        position -= 1
+    if position >= 0 and out[position] == ",":
+        del out[position]
+
+
+def decode_json(text: str) -> Tuple[Any, bool]:
+    """
+    Decode the JSON in a model response, from its ```json block if it has one.
+
+    Returns:
+        Tuple of (value, True if it needed repair_json)
+
+    Raises:
+        ValueError: If no JSON value can be recovered
+    """
+    match = JSON_FENCE.search(text)
+    body = match.group(1) if match else text
+    try:
+        return json.loads(body), False
+    except ValueError:
+        return repair_json(body), True
+
+
+def extract_json(text: str) -> Any:
+    """Decode the JSON in a model response, repairing it if needed"""
+    return decode_json(text)[0]
+
+
+class ResponseSchema:
+    def __init__(self, name: str, fields: Dict[str, Tuple[type, Any]]):
+        """
+        Expected top-level fields of a JSON response.
+
+        Args:
+            name: Name used in error messages
+            fields: Field -> (type, default). A default of None makes the
+                field required; other defaults fill in missing fields.
+        """
+        self.name = name
+        self.fields = fields
+        self.required = tuple(field for field, (_, default) in fields.items() if default is None)
+
+    def problems(self, value: Any) -> List[str]:
+        """Fields that are missing or of the wrong type (every field if value is not an object)"""
+        if not isinstance(value, dict):
+            return list(self.fields)
+        return [field for field, (kind, _) in self.fields.items() if not isinstance(value.get(field), kind)]
+
+    def accepts(self, text: str) -> bool:
+        """True when the text decodes (with repair) to an object with every required field"""
+        try:
+            value, _ = decode_json(text)
+        except ValueError:
+            return False
+        # Optional fields may be missing but not of the wrong type
+        return isinstance(value, dict) and not any(field in self.required or field in value
+                                                   for field in self.problems(value))
+
+    def fill_defaults(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        """Add copies of the defaults for missing or invalid optional fields"""
+        for field in self.problems(value):
+            kind, default = self.fields[field]
+            if default is not None:
+                value[field] = type(default)(default)
+        return value
+
+    def followup_prompt(self, fields: List[str]) -> str:
+        """Ask for only the given fields of this response"""
+        listed = ", ".join(f'"{field}" ({"string" if self.fields[field][0] is str else "object"})'
+                           for field in fields)
+        return ("Your previous response was cut off or incomplete. Reply with only a JSON object "
+                f"containing these fields: {listed}. Do not repeat the other fields.")
+
+
+STORY_SCHEMA = ResponseSchema("story", {
+    "narrative": (str, None),
+    "character_actions": (dict, {}),
+    "world_state_updates": (dict, {}),
+})
+NPC_SCHEMA = ResponseSchema("npc", STORY_SCHEMA.fields)
+APPRAISAL_SCHEMA = ResponseSchema("appraisal", {
+    "emotional_updates": (dict, {}),
+    "belief_updates": (dict, {}),
+    "theory_of_mind_updates": (dict, {}),
+    "goal_updates": (dict, {}),
+})
+
+
+# Checks that decide whether a cheaper model's response is used or the call escalates
+def is_story_response(text: str) -> bool:
+    return STORY_SCHEMA.accepts(text)
+
+
+def is_appraisal_response(text: str) -> bool:
+    return APPRAISAL_SCHEMA.accepts(text)
+
+
+def is_batch_appraisal_response(text: str) -> bool:
+    try:
+        result, _ = decode_json(text)
+    except ValueError:
+        return False
+    return isinstance(result, dict) and bool(result) and all(isinstance(section, dict) for section in result.values())
+
+
+class ResponseParser:
+    def __init__(self):
+        """
+        Decode and validate model responses against a ResponseSchema, repairing
+        malformed JSON locally and asking the model again for just the fields
+        that are still missing. Counts how often each of those happens.
+        """
+        self.stats = {"responses": 0, "repaired": 0, "failed": 0, "incomplete": 0,
+                      "rerequested": 0, "completed": 0}
+        self._lock = threading.Lock()
+
+    def parse(self, text: str, schema: Optional[ResponseSchema] = None,
+              rerequest: Optional[Callable[[str], str]] = None) -> Any:
+        """
+        Decode a response and check it against a schema.
+
+        Fields still missing are asked for with rerequest when a required one
+        is missing or the response had to be repaired (it was probably cut
+        off). Missing optional fields then get their defaults.
+
+        Args:
+            text: Response text
+            schema: Expected fields (None only decodes)
+            rerequest: Sends a follow-up prompt in the same conversation and
+                returns the response text
+
+        Returns:
+            The decoded value
+
+        Raises:
+            ValueError: If no JSON can be recovered or a required field is
+                still missing
+        """
+        try:
+            value, repaired = decode_json(text)
+        except ValueError:
+            self._count("responses", "failed")
+            raise
+        self._count("responses", *(["repaired"] if repaired else []))
+        if schema is None:
+            return value
+        if not isinstance(value, dict):
+            self._count("failed")
+            raise ValueError(f"Expected a JSON object in the {schema.name} response")
+
+        missing = schema.problems(value)
+        if missing:
+            self._count("incomplete")
+        if missing and rerequest is not None and (repaired or set(missing) & set(schema.required)):
+            self._count("rerequested")
+            try:
+                extra, _ = decode_json(rerequest(schema.followup_prompt(missing)))
+                if isinstance(extra, dict):
+                    value.update({field: extra[field] for field in missing if field in extra})
+            except Exception as e:
+                print(f"Error requesting missing {schema.name} fields: {e}")
+            missing = schema.problems(value)
+            if not missing:
+                self._count("completed")
+
+        absent = [field for field in missing if field in schema.required]
+        if absent:
+            self._count("failed")
+            raise ValueError(f"{schema.name} response is missing {', '.join(absent)}")
+        return schema.fill_defaults(value)
+
+    def summary(self) -> Dict[str, Any]:
+        """Copy of the counters with the parse failure and repair rates"""
+        with self._lock:
+            stats = dict(self.stats)
+        responses = stats["responses"] or 1
+        stats["failure_rate"] = stats["failed"] / responses
+        stats["repair_rate"] = stats["repaired"] / responses
+        return stats
+
+    def format_report(self) -> str:
+        stats = self.summary()
+        return (f"parsed {stats['responses']}, repaired {stats['repaired']} ({stats['repair_rate']:.1%}), "
+                f"failed {stats['failed']} ({stats['failure_rate']:.1%}), "
+                f"missing fields re-requested {stats['rerequested']} (completed {stats['completed']})")
+
+    def _count(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self.stats[key] += 1
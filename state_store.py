@@ -0,0 +1,627 @@
+import copy
+import sys
+import zlib
+from collections.abc import MutableMapping
+from typing import Dict, List, Tuple, Any, Optional, Iterable
+
+import numpy as np
+
+DIMENSIONS = ("emotions", "beliefs", "goals")
+# Parts of a store that a fork shares until one side writes to them
+SHARED_PARTS = DIMENSIONS + ("rows", "columns", "goal_types", "tom_defaults", "tom_entries")
+
+
+class KeySchema:
+    def __init__(self):
+        """Interned mapping from keys to dense column (or row) indices"""
+        self.index = {}  # key -> position
+        self.keys = []   # position -> key
+
+    def intern(self, key: Any) -> int:
+        """Return the index for a key, assigning the next free index to new keys"""
+        position = self.index.get(key)
+        if position is None:
+            if isinstance(key, str):
+                key = sys.intern(key)
+            position = len(self.keys)
+            self.index[key] = position
+            self.keys.append(key)
+        return position
+
+    def get(self, key: Any) -> Optional[int]:
+        """Return the index for a key, or None if it has never been interned"""
+        return self.index.get(key)
+
+    def copy(self) -> "KeySchema":
+        schema = KeySchema()
+        schema.index = dict(self.index)
+        schema.keys = list(self.keys)
+        return schema
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class StateStore:
+    # Parts shared with a fork (see fork()); never-forked stores share nothing
+    _shared = frozenset()
+    # Observer rows whose explicit theory-of-mind entries are no longer shared
+    # with a fork; None when the store has never been forked
+    _private_tom_rows = None
+    # Called with a delta event for every write (see event_log.EventLog)
+    recorder = None
+
+    def __init__(self, row_capacity: int = 4, column_capacity: int = 8, tom_seed: int = 0):
+        """
+        Dense float storage for the emotions, beliefs and goals of every character
+        in a World. Each dimension is a (character x key) array; NaN marks a key
+        the character does not have.
+
+        Theory of mind is sparse. An observer has a default belief about each of
+        its default targets, equal to its own belief plus a seeded offset in
+        [-0.2, 0.2]. Only entries that have been read through a view or written
+        are stored, so memory grows with what the story touches rather than with
+        characters squared times beliefs.
+
+        Args:
+            row_capacity: Initial number of character rows to allocate
+            column_capacity: Initial number of key columns to allocate per dimension
+            tom_seed: Seed for the default theory-of-mind offsets
+        """
+        self.rows = KeySchema()  # character names
+        self.columns = {dimension: KeySchema() for dimension in DIMENSIONS}
+        self.goal_types = {}     # goal type -> goal columns of that type, in interning order
+
+        self.arrays = {
+            dimension: np.full((row_capacity, column_capacity), np.nan)
+            for dimension in DIMENSIONS
+        }
+
+        self.tom_seed = tom_seed
+        self.tom_defaults = {}  # observer row -> {target name: None}, often shared between rows
+        self.tom_entries = {}   # observer row -> {target name: {belief column: value}}; NaN marks a removed belief
+
+    # ----- forking -----
+
+    def fork(self) -> "StateStore":
+        """
+        Return a copy of this store that shares all of its data.
+
+        Forking copies no arrays or dictionaries. Both stores then copy a part
+        (one dimension's array, the key schemas, the theory-of-mind defaults,
+        or one observer's explicit theory-of-mind entries) the first time they
+        write to it, so a branch that changes a few characters only pays for
+        the parts it touches.
+        """
+        clone = copy.copy(self)
+        clone.arrays = dict(self.arrays)
+        clone.recorder = None
+        self._shared = clone._shared = frozenset(SHARED_PARTS)
+        self._private_tom_rows = set()
+        clone._private_tom_rows = set()
+        return clone
+
+    def _unshare(self, part: str):
+        """Give this store its own copy of a part it still shares with a fork"""
+        if part not in self._shared:
+            return
+        if part in DIMENSIONS:
+            self.arrays[part] = self.arrays[part].copy()
+        elif part == "rows":
+            self.rows = self.rows.copy()
+        elif part == "columns":
+            self.columns = {dimension: schema.copy() for dimension, schema in self.columns.items()}
+        elif part == "goal_types":
+            self.goal_types = {goal_type: list(columns) for goal_type, columns in self.goal_types.items()}
+        elif part == "tom_defaults":
+            self.tom_defaults = dict(self.tom_defaults)
+        elif part == "tom_entries":
+            self.tom_entries = dict(self.tom_entries)
+        self._shared = self._shared - {part}
+
+    def _record(self, event: Dict[str, Any]):
+        if self.recorder is not None:
+            self.recorder(event)
+
+    def _own_tom_row(self, row: int) -> Dict[str, Dict[int, float]]:
+        """An observer's explicit theory-of-mind entries, safe to change in place"""
+        self._unshare("tom_entries")
+        entries = self.tom_entries.get(row)
+        if self._private_tom_rows is not None and row not in self._private_tom_rows:
+            entries = {name: dict(beliefs) for name, beliefs in (entries or {}).items()}
+            self.tom_entries[row] = entries
+            self._private_tom_rows.add(row)
+        elif entries is None:
+            entries = self.tom_entries[row] = {}
+        return entries
+
+    # ----- schema and capacity -----
+
+    def add_row(self, name: str) -> int:
+        """Intern a character name and make sure its row exists"""
+        if self.rows.get(name) is None:
+            self._unshare("rows")
+        row = self.rows.intern(name)
+        self._ensure_rows(row + 1)
+        return row
+
+    def column(self, dimension: str, key: Any) -> int:
+        """Intern a key for a dimension and make sure its column exists"""
+        schema = self.columns[dimension]
+        existing = schema.get(key)
+        if existing is not None:
+            return existing
+        self._unshare("columns")
+        position = self.columns[dimension].intern(key)
+        if dimension == "goals":
+            self._unshare("goal_types")
+            self.goal_types.setdefault(key[0], []).append(position)
+        self._ensure_columns(dimension, position + 1)
+        return position
+
+    def add_goal_type(self, goal_type: str):
+        """Register a goal type, even before it has any goals"""
+        if goal_type not in self.goal_types:
+            self._unshare("goal_types")
+            self.goal_types[goal_type] = []
+            self._record({"e": "goal_type", "g": goal_type})
+
+    def _ensure_rows(self, count: int):
+        for dimension, array in self.arrays.items():
+            if count > array.shape[0]:
+                self.arrays[dimension] = self._grow(array, 0, count)
+                self._shared = self._shared - {dimension}
+
+    def _ensure_columns(self, dimension: str, count: int):
+        array = self.arrays[dimension]
+        if count > array.shape[1]:
+            self.arrays[dimension] = self._grow(array, 1, count)
+            self._shared = self._shared - {dimension}
+
+    @staticmethod
+    def _grow(array: np.ndarray, axis: int, count: int) -> np.ndarray:
+        """Return a copy of array with at least count entries along axis (capacity doubles)"""
+        shape = list(array.shape)
+        shape[axis] = max(count, shape[axis] * 2)
+        grown = np.full(shape, np.nan)
+        grown[tuple(slice(0, size) for size in array.shape)] = array
+        return grown
+
+    # ----- reads -----
+
+    def present_columns(self, dimension: str, row: int) -> np.ndarray:
+        """Indices of the keys a character has in a dimension"""
+        values = self.arrays[dimension][row, :len(self.columns[dimension])]
+        return np.flatnonzero(~np.isnan(values))
+
+    def row_dict(self, dimension: str, row: int) -> Dict[Any, float]:
+        """Copy a character's values for a dimension into a plain dictionary"""
+        keys = self.columns[dimension].keys
+        values = self.arrays[dimension][row]
+        return {keys[column]: float(values[column]) for column in self.present_columns(dimension, row)}
+
+    def goals_dict(self, row: int) -> Dict[str, Dict[str, float]]:
+        """Copy a character's goals into the nested {goal_type: {goal: priority}} form"""
+        values = self.arrays["goals"][row]
+        keys = self.columns["goals"].keys
+        goals = {}
+        for goal_type, columns in self.goal_types.items():
+            present = {keys[column][1]: float(values[column]) for column in columns if not np.isnan(values[column])}
+            if present:
+                goals[goal_type] = present
+        return goals
+
+    # ----- theory of mind -----
+
+    def set_tom_defaults(self, row: int, targets: Dict[str, None]):
+        """Give an observer default beliefs about every name in targets (its own name is skipped)"""
+        self._unshare("tom_defaults")
+        self.tom_defaults[row] = targets
+        self._record({"e": "tom_targets", "c": self.rows.keys[row], "t": list(targets)})
+
+    def tom_offset(self, observer: str, target: str, belief: str) -> float:
+        """Seeded offset in [-0.2, 0.2] between an observer's belief and its default guess for a target"""
+        digest = zlib.crc32(f"{self.tom_seed}|{observer}|{target}|{belief}".encode("utf-8"))
+        return digest / 0xFFFFFFFF * 0.4 - 0.2
+
+    def has_tom_target(self, row: int, name: str) -> bool:
+        if name in self.tom_entries.get(row, {}):
+            return True
+        return name != self.rows.keys[row] and name in self.tom_defaults.get(row, {})
+
+    def tom_targets_of(self, row: int) -> List[str]:
+        """Names an observer holds beliefs about: default targets first, then explicit ones"""
+        observer = self.rows.keys[row]
+        defaults = self.tom_defaults.get(row, {})
+        targets = [name for name in defaults if name != observer]
+        targets.extend(name for name in self.tom_entries.get(row, {}) if name not in defaults)
+        return targets
+
+    def _tom_default_row(self, row: int, name: str) -> Dict[int, float]:
+        """Default beliefs of an observer about a target, keyed by belief column"""
+        observer = self.rows.keys[row]
+        if name == observer or name not in self.tom_defaults.get(row, {}):
+            return {}
+        keys = self.columns["beliefs"].keys
+        own = self.arrays["beliefs"][row]
+        return {
+            column: min(1.0, max(0.0, float(own[column]) + self.tom_offset(observer, name, keys[column])))
+            for column in self.present_columns("beliefs", row)
+        }
+
+    def tom_row(self, row: int, name: str, materialize: bool = False) -> Dict[int, float]:
+        """
+        Beliefs an observer attributes to a target, keyed by belief column.
+
+        Args:
+            row: Observer row
+            name: Target name
+            materialize: Store the returned values explicitly so they no longer
+                follow the observer's own beliefs
+        """
+        values = self._tom_default_row(row, name)
+        explicit = self.tom_entries.get(row, {}).get(name)
+        if explicit:
+            values.update(explicit)
+        if materialize and values and values != explicit:
+            self._own_tom_row(row)[name] = dict(values)
+            keys = self.columns["beliefs"].keys
+            self._record({"e": "tom_set", "c": self.rows.keys[row], "t": name,
+                          "v": {keys[column]: _nullable(value) for column, value in values.items()}})
+        return {column: value for column, value in values.items() if not np.isnan(value)}
+
+    def tom_dict(self, row: int, targets: Optional[Iterable[str]] = None,
+                 materialize: bool = False) -> Dict[str, Dict[str, float]]:
+        """
+        Copy a character's theory of mind into {target: {belief: value}}.
+
+        Args:
+            row: Observer row
+            targets: Only include these target names (None includes every target)
+            materialize: Store every returned value explicitly
+        """
+        keys = self.columns["beliefs"].keys
+        names = self.tom_targets_of(row) if targets is None else [
+            name for name in targets if self.has_tom_target(row, name)
+        ]
+        tom = {}
+        for name in names:
+            values = self.tom_row(row, name, materialize)
+            if values:
+                tom[name] = {keys[column]: value for column, value in values.items()}
+        return tom
+
+    def tom_explicit_dict(self, row: int) -> Dict[str, Dict[str, float]]:
+        """Copy only the theory-of-mind entries that have been materialized"""
+        return self.tom_dict(row, targets=list(self.tom_entries.get(row, {})))
+
+    def remove_tom_target(self, row: int, name: str):
+        """Forget everything an observer believes about a target"""
+        if not self.has_tom_target(row, name):
+            raise KeyError(name)
+        if name in self.tom_entries.get(row, {}):
+            del self._own_tom_row(row)[name]
+        defaults = self.tom_defaults.get(row, {})
+        if name in defaults:
+            # Default target sets are shared, so give this observer its own copy
+            self._unshare("tom_defaults")
+            self.tom_defaults[row] = {target: None for target in defaults if target != name}
+        self._record({"e": "tom_remove", "c": self.rows.keys[row], "t": name})
+
+    def clear_tom(self, row: int):
+        """Drop an observer's default targets and explicit entries"""
+        self._unshare("tom_defaults")
+        self._unshare("tom_entries")
+        self.tom_defaults.pop(row, None)
+        self.tom_entries.pop(row, None)
+        self._record({"e": "tom_clear", "c": self.rows.keys[row]})
+
+    def delete_tom(self, row: int, name: str, column: int):
+        """Remove one belief an observer attributes to a target"""
+        self._own_tom_row(row)[name][column] = np.nan
+        self._record({"e": "tom_delete", "c": self.rows.keys[row], "t": name,
+                      "b": self.columns["beliefs"].keys[column]})
+
+    def tom_entry_count(self) -> int:
+        """Number of explicitly stored theory-of-mind values"""
+        return sum(len(beliefs) for targets in self.tom_entries.values() for beliefs in targets.values())
+
+    # ----- writes -----
+
+    def update_row(self, dimension: str, row: int, updates: Dict[Any, float],
+                   clamp: bool = True, clamp_existing_only: bool = False):
+        """
+        Write several keys of one character in a single vectorized assignment.
+
+        Args:
+            dimension: "emotions", "beliefs" or "goals" (goal keys are (type, goal) tuples)
+            row: Character row
+            updates: Key -> new value
+            clamp: Clamp the new values to [0, 1]
+            clamp_existing_only: Only clamp keys the character already had
+        """
+        if not updates:
+            return
+        columns = np.fromiter((self.column(dimension, key) for key in updates),
+                              dtype=np.intp, count=len(updates))
+        values = np.fromiter(updates.values(), dtype=float, count=len(updates))
+        self._unshare(dimension)
+        array = self.arrays[dimension]
+        if clamp:
+            clamped = np.clip(values, 0.0, 1.0)
+            if clamp_existing_only:
+                clamped = np.where(np.isnan(array[row, columns]), values, clamped)
+            values = clamped
+        array[row, columns] = values
+        self._record({"e": "set", "d": dimension, "c": self.rows.keys[row],
+                      "k": list(updates), "v": values.tolist()})
+
+    def update_tom(self, row: int, updates: Dict[str, Dict[str, float]], clamp: bool = True):
+        """Write a character's beliefs about other characters' beliefs as explicit entries"""
+        entries = self._own_tom_row(row)
+        recorded = {}
+        for name, beliefs in updates.items():
+            target = entries.setdefault(name, {})
+            recorded[name] = {}
+            if not beliefs:
+                continue
+            values = np.fromiter(beliefs.values(), dtype=float, count=len(beliefs))
+            if clamp:
+                values = np.clip(values, 0.0, 1.0)
+            for key, value in zip(beliefs, values.tolist()):
+                target[self.column("beliefs", key)] = value
+                recorded[name][key] = value
+        if recorded:
+            self._record({"e": "tom", "c": self.rows.keys[row], "u": recorded})
+
+    def bulk_update(self, dimension: str, rows: np.ndarray, columns: np.ndarray,
+                    values: np.ndarray, clamp: bool = True):
+        """
+        Scatter values into a dimension for many characters at once.
+
+        Args:
+            dimension: "emotions", "beliefs" or "goals"
+            rows: Character rows, one per value
+            columns: Key columns, one per value (see column())
+            values: New values
+            clamp: Clamp the new values to [0, 1]
+        """
+        values = np.asarray(values, dtype=float)
+        if clamp:
+            values = np.clip(values, 0.0, 1.0)
+        self._unshare(dimension)
+        self.arrays[dimension][rows, columns] = values
+        if self.recorder is not None:
+            keys = self.columns[dimension].keys
+            self._record({"e": "bulk", "d": dimension, "c": [self.rows.keys[row] for row in rows],
+                          "k": [keys[column] for column in columns], "v": values.tolist()})
+
+    def clamp(self, dimension: Optional[str] = None):
+        """Clamp every stored value of one dimension (or all of them) to [0, 1] in place"""
+        for name in ([dimension] if dimension else DIMENSIONS):
+            self._unshare(name)
+            np.clip(self.arrays[name], 0.0, 1.0, out=self.arrays[name])
+        if dimension in (None, "beliefs"):
+            for row in list(self.tom_entries):
+                for beliefs in self._own_tom_row(row).values():
+                    for column, value in beliefs.items():
+                        if not np.isnan(value):
+                            beliefs[column] = min(1.0, max(0.0, value))
+        self._record({"e": "clamp", "d": dimension})
+
+    def delete(self, dimension: str, row: int, key: Any):
+        column = self.columns[dimension].get(key)
+        if column is None or np.isnan(self.arrays[dimension][row, column]):
+            raise KeyError(key)
+        self._unshare(dimension)
+        self.arrays[dimension][row, column] = np.nan
+        self._record({"e": "delete", "d": dimension, "c": self.rows.keys[row], "k": key})
+
+    def clear_row(self, dimension: str, row: int):
+        self._unshare(dimension)
+        self.arrays[dimension][row, :] = np.nan
+        self._record({"e": "clear", "d": dimension, "c": self.rows.keys[row]})
+
+    def nbytes(self) -> int:
+        """Memory held by the dense arrays"""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    # ----- snapshots -----
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Copy the used part of each dimension's array"""
+        return {
+            dimension: self.arrays[dimension][:len(self.rows), :len(self.columns[dimension])].copy()
+            for dimension in DIMENSIONS
+        }
+
+
+def _nullable(value: float) -> Optional[float]:
+    """NaN (a removed entry) as None, for JSON"""
+    return None if np.isnan(value) else value
+
+
+class StateView(MutableMapping):
+    def __init__(self, store: StateStore, dimension: str, row: int):
+        """Dictionary view over one character's emotions or beliefs in a StateStore"""
+        self.store = store
+        self.dimension = dimension
+        self.row = row
+
+    def __getitem__(self, key: str) -> float:
+        column = self.store.columns[self.dimension].get(key)
+        if column is None:
+            raise KeyError(key)
+        value = self.store.arrays[self.dimension][self.row, column]
+        if np.isnan(value):
+            raise KeyError(key)
+        return float(value)
+
+    def __setitem__(self, key: str, value: float):
+        self.store.update_row(self.dimension, self.row, {key: value}, clamp=False)
+
+    def __delitem__(self, key: str):
+        self.store.delete(self.dimension, self.row, key)
+
+    def __iter__(self):
+        keys = self.store.columns[self.dimension].keys
+        return iter([keys[column] for column in self.store.present_columns(self.dimension, self.row)])
+
+    def __len__(self) -> int:
+        return len(self.store.present_columns(self.dimension, self.row))
+
+    def to_dict(self) -> Dict[str, float]:
+        return self.store.row_dict(self.dimension, self.row)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class GoalTypeView(MutableMapping):
+    def __init__(self, store: StateStore, row: int, goal_type: str):
+        """Dictionary view over one character's goals of a single type"""
+        self.store = store
+        self.row = row
+        self.goal_type = goal_type
+
+    def __getitem__(self, goal: str) -> float:
+        column = self.store.columns["goals"].get((self.goal_type, goal))
+        if column is None:
+            raise KeyError(goal)
+        value = self.store.arrays["goals"][self.row, column]
+        if np.isnan(value):
+            raise KeyError(goal)
+        return float(value)
+
+    def __setitem__(self, goal: str, value: float):
+        self.store.update_row("goals", self.row, {(self.goal_type, goal): value}, clamp=False)
+
+    def __delitem__(self, goal: str):
+        self.store.delete("goals", self.row, (self.goal_type, goal))
+
+    def __iter__(self):
+        values = self.store.arrays["goals"][self.row]
+        keys = self.store.columns["goals"].keys
+        columns = self.store.goal_types.get(self.goal_type, [])
+        return iter([keys[column][1] for column in columns if not np.isnan(values[column])])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {goal: self[goal] for goal in self}
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class GoalsView(MutableMapping):
+    def __init__(self, store: StateStore, row: int):
+        """Dictionary view over one character's goals, grouped by goal type"""
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, goal_type: str) -> GoalTypeView:
+        if goal_type not in self.store.goal_types:
+            raise KeyError(goal_type)
+        return GoalTypeView(self.store, self.row, goal_type)
+
+    def __contains__(self, goal_type: object) -> bool:
+        return goal_type in self.store.goals_dict(self.row)
+
+    def __setitem__(self, goal_type: str, goals: Dict[str, float]):
+        self.store.add_goal_type(goal_type)
+        view = GoalTypeView(self.store, self.row, goal_type)
+        for goal in list(view):
+            del view[goal]
+        self.store.update_row("goals", self.row, {(goal_type, goal): value for goal, value in goals.items()},
+                              clamp=False)
+
+    def __delitem__(self, goal_type: str):
+        view = self[goal_type]
+        for goal in list(view):
+            del view[goal]
+
+    def __iter__(self):
+        return iter(self.store.goals_dict(self.row))
+
+    def __len__(self) -> int:
+        return len(self.store.goals_dict(self.row))
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return self.store.goals_dict(self.row)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class TheoryOfMindView(MutableMapping):
+    def __init__(self, store: StateStore, row: int):
+        """Dictionary view over what one character thinks each other character believes"""
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, name: str) -> "TheoryOfMindTargetView":
+        if not self.store.has_tom_target(self.row, name):
+            raise KeyError(name)
+        return TheoryOfMindTargetView(self.store, self.row, name)
+
+    def __setitem__(self, name: str, beliefs: Dict[str, float]):
+        if self.store.has_tom_target(self.row, name):
+            self.store.remove_tom_target(self.row, name)
+        self.store.update_tom(self.row, {name: beliefs}, clamp=False)
+
+    def __delitem__(self, name: str):
+        self.store.remove_tom_target(self.row, name)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self.store.has_tom_target(self.row, name)
+
+    def __iter__(self):
+        return iter(self.store.tom_targets_of(self.row))
+
+    def __len__(self) -> int:
+        return len(self.store.tom_targets_of(self.row))
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return self.store.tom_dict(self.row, materialize=True)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class TheoryOfMindTargetView(MutableMapping):
+    def __init__(self, store: StateStore, row: int, name: str):
+        """Dictionary view over one observer's beliefs about a single target"""
+        self.store = store
+        self.row = row
+        self.name = name
+
+    def __getitem__(self, belief: str) -> float:
+        column = self.store.columns["beliefs"].get(belief)
+        values = self.store.tom_row(self.row, self.name, materialize=True)
+        if column is None or column not in values:
+            raise KeyError(belief)
+        return values[column]
+
+    def __setitem__(self, belief: str, value: float):
+        self.store.update_tom(self.row, {self.name: {belief: value}}, clamp=False)
+
+    def __delitem__(self, belief: str):
+        self[belief]
+        self.store.delete_tom(self.row, self.name, self.store.columns["beliefs"].get(belief))
+
+    def __iter__(self):
+        keys = self.store.columns["beliefs"].keys
+        return iter([keys[column] for column in self.store.tom_row(self.row, self.name)])
+
+    def __len__(self) -> int:
+        return len(self.store.tom_row(self.row, self.name))
+
+    def to_dict(self) -> Dict[str, float]:
+        keys = self.store.columns["beliefs"].keys
+        values = self.store.tom_row(self.row, self.name, materialize=True)
+        return {keys[column]: value for column, value in values.items()}
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
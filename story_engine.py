@@ -1,24 +1,81 @@
-import json
-import re
-import openai
-import os
-from dotenv import load_dotenv
-from typing import Dict, List, Tuple, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Any, Optional, Callable
 from character_world_classes import Character, World
+from llm_backends import LLMBackend, HTTPBackend, DEFAULT_MODEL
+from response_cache import ResponseCache, CachedBackend
+from request_coalescing import CoalescingBackend
+from prompt_encoding import StateEncoder
+from occ_rules import AppraisalEvent, RuleBasedAppraiser, describe_event
+from streaming import JSONStringFieldExtractor
+from instrumentation import NullTracer, SpanAggregator, TracedBackend
+from prompt_builder import RelevancePromptBuilder
+from event_log import EventLog
+from model_routing import ModelRouter
+from npc_scheduler import SalienceScheduler
+from tick_engine import TickEngine
+from response_parsing import (ResponseParser, ResponseSchema, STORY_SCHEMA, NPC_SCHEMA, APPRAISAL_SCHEMA,
+                              is_story_response, is_appraisal_response, is_batch_appraisal_response)
+from prompt_templates import (APPRAISAL_TEMPLATE, BATCH_APPRAISAL_TEMPLATE, ACTION_TEMPLATE, NPC_TEMPLATE,
+                              dynamic_state)
 
-# Load environment variables from .env file
-load_dotenv()
+APPRAISAL_MODES = ("llm", "rules", "auto")
+
+APPRAISAL_SYSTEM_PROMPT = "You are an expert at modeling character emotions and beliefs using the OCC appraisal model."
+STORY_SYSTEM_PROMPT = "You are an interactive storytelling engine creating a realistic sci-fi narrative."
+NPC_SYSTEM_PROMPT = "You are an interactive storytelling engine creating realistic character actions."
+
+
+def _followup(router: ModelRouter, backend: LLMBackend, call_type: str, messages: List[Dict[str, str]],
+              reply: str) -> Callable[[str], str]:
+    """Send a follow-up prompt after a reply in the same conversation (see ResponseParser.parse)"""
+    return lambda prompt: router.complete(backend, call_type, messages + [
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": prompt}
+    ]).text
 
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 class OCCAppraisalModel:
-    def __init__(self):
+    def __init__(self, backend: Optional[LLMBackend] = None, model: str = DEFAULT_MODEL,
+                 timeout: Optional[float] = None, encoder: Optional[StateEncoder] = None,
+                 mode: str = "llm", tracer: Optional[NullTracer] = None,
+                 prompt_builder: Optional[RelevancePromptBuilder] = None,
+                 router: Optional[ModelRouter] = None, parser: Optional[ResponseParser] = None):
         """
         Initialize the OCC Appraisal Model for emotion updates.
         This model evaluates events and updates character emotional states.
+        
+        Args:
+            backend: Chat completion backend (defaults to a pooled HTTPBackend)
+            model: Model used for appraisals
+            timeout: Per-call timeout in seconds (None uses the backend default)
+            encoder: Serializer for state embedded in prompts (defaults to full JSON)
+            mode: Default appraisal mode. "llm" asks the model and falls back to the
+                local rules if the call fails, "rules" always uses the local rules,
+                and "auto" uses the rules unless the event is ambiguous.
+            tracer: Receives prompt_build, parse and appraisal spans (defaults to
+                a NullTracer, which records nothing)
+            prompt_builder: Prunes the world state in prompts to a token budget
+                (None sends the full state)
+            router: Picks the model, token limit and timeout of the "appraisal"
+                and "batch_appraisal" calls (defaults to model and timeout for both)
+            parser: Decodes and validates responses, repairing malformed JSON
+                and asking again for missing fields (see response_parsing)
         """
-        pass
+        if mode not in APPRAISAL_MODES:
+            raise ValueError(f"Unknown appraisal mode: {mode}")
+        self.backend = backend or HTTPBackend()
+        self.model = model
+        self.timeout = timeout
+        self.encoder = encoder or StateEncoder()
+        self.mode = mode
+        self.rules = RuleBasedAppraiser()
+        self.tracer = tracer or NullTracer()
+        self.prompt_builder = prompt_builder
+        self.router = router or ModelRouter.single(model, timeout)
+        self.parser = parser or ResponseParser()
+        self.stats = {"rules": 0, "llm": 0, "fallback": 0}
+        self._stats_lock = threading.Lock()
     
     def generate_appraisal_prompt(self, character: Character, world: World, action: str) -> str:
         """
@@ -32,166 +89,307 @@ class OCCAppraisalModel:
         Returns:
             Prompt string for GPT
         """
-        world_state = world.get_state_for_prompt()
-        character_state = character.get_state_for_prompt()
+        channel = f"appraisal:{character.name}"
+        world_state = self.encoder.encode_state(self._world_state(world, action, character.name))
+        if self.encoder.deduplicate or self.prompt_builder is not None:
+            # The character's state is already part of the world state
+            character_state = f"{character.name} (state listed under World State characters)"
+        else:
+            character_state = self.encoder.dumps(character.get_state_for_prompt(world.mentioned_characters(action)))
         
-        # Create prompt for GPT to evaluate the action
-        prompt = f"""
-        # OCC Appraisal Model Evaluation
-        
-        ## World State
-        {json.dumps(world_state, indent=2)}
-        
-        ## Character Performing Appraisal
-        {json.dumps(character_state, indent=2)}
-        
-        ## Action to Appraise
-        {action}
-        
-        ## Task
-        The following describes standardized procedures for updating the character's state based on the action. This follows the OCC model for cognitive appraisal of emotion.
-
-        **Standardized State Update Procedure:**
-        After analyzing the action, update the states of the character by following these guidelines:
-
-        **a. Appraisal of the action:**
-        - **Goal Congruence:**
-            - If the event is assessed as *strongly hindering* a character’s goal, then:
-            - Decrease the goal's priority by **0.10**.
-            - Increase related negative emotions (e.g., anger, sadness) by **0.15**.
-            - If the event is assessed as *moderately hindering* a character’s goal, then:
-            - Decrease the goal's priority by **0.05**.
-            - Increase related negative emotions by **0.10**.
-            - If the event is assessed as *strongly facilitating* a goal, then:
-            - Increase the goal's priority by **0.10**.
-            - Increase related positive emotions (e.g., happiness) by **0.15**.
-            - If the event is assessed as *moderately facilitating* a goal, then:
-            - Increase the goal's priority by **0.05**.
-            - Increase related positive emotions by **0.10**.
-        - **Unexpectedness:**
-            - For highly unexpected events, add a factor of +0.20 to arousal-based emotions (e.g., fear, surprise).
-            - For moderately unexpected events, add +0.10.
-        - **Responsibility Attribution:**
-            - Note whether the event is self-caused, caused by another agent, or due to external factors, and adjust the corresponding emotions (e.g., guilt or defensiveness) by **0.10** accordingly.
-
-        **b. Updating Emotions:**
-        - For each character, update their emotional intensities (values are decimals between 0 and 1) as follows:
-            - If an event strongly hinders an important goal, increase relevant negative emotions (e.g., anger, sadness) by +0.15.
-            - If it moderately hinders a goal, increase them by +0.10.
-            - If an event strongly facilitates a goal, increase relevant positive emotions (e.g., happiness) by +0.15; if moderately, by +0.10.
-            - For a highly unexpected event, increase arousal-based emotions (e.g., fear, surprise) by +0.20.
-        - After adjustments, ensure all emotion values are clamped between 0 and 1.
-
-        **c. Updating Beliefs:**
-        - If an event confirms a belief, increase the belief’s probability by +0.10.
-        - If an event contradicts a belief, decrease it by -0.10.
-        - Clamp belief probabilities between 0 and 1.
-
-        **d. Updating Goals:**
-        - If an event facilitates a goal, increase its priority by +0.10.
-        - If an event blocks a goal, decrease its priority by -0.10.
-        - Clamp goal priorities between 0 and 1.
-
-        **e. Updating Theory of Mind:**
-        - For each belief about another character, if an observed behavior supports that belief, increase its value by +0.10; if it contradicts, decrease it by -0.10.
-        - Clamp these values between 0 and 1.
-        
-        ## Output Format
-        Return a JSON object with the following structure:
-        ```json
-        {{
-            "emotional_updates": {{
-                "emotion_name": new_value,
-                ...
-            }},
-            "belief_updates": {{
-                "belief_name": new_value,
-                ...
-            }},
-            "theory_of_mind_updates": {{
-                "character_name": {{
-                    "belief_name": new_value,
-                    ...
-                }},
-                ...
-            }},
-            "goal_updates": {{
-                "goal_type": {{
-                    "goal_name": new_value,
-                    ...
-                }},
-                ...
-            }},
-            "appraisal_explanation": "Explanation of why these changes occurred based on OCC model"
-        }}
-        ```
-        """
+        prompt = APPRAISAL_TEMPLATE.render(world, world_state=world_state, character_state=character_state,
+                                           action=action)
+        self.encoder.measure(channel, prompt)
         return prompt
     
-    def appraise_action(self, character: Character, world: World, action: str) -> Dict[str, Any]:
+    def appraise_action(self, character: Character, world: World, action: str,
+                        event: Optional[AppraisalEvent] = None, mode: Optional[str] = None) -> Dict[str, Any]:
         """
-        Use GPT to appraise an action and return state updates.
+        Appraise an action and return state updates, using GPT or the local OCC rules.
         
         Args:
             character: The character performing the appraisal
             world: The current world state
             action: The action being appraised
+            event: Structured description of the event for the local rules
+                (inferred from the action text when not given)
+            mode: "llm", "rules" or "auto" for this call (defaults to self.mode)
             
         Returns:
             Dictionary of state updates for the character
         """
-        prompt = self.generate_appraisal_prompt(character, world, action)
+        mode = mode or self.mode
+        with self.tracer.span("appraisal", character=character.name,
+                              channel=f"appraisal:{character.name}") as span:
+            if mode != "llm" and event is None:
+                event = describe_event(character, world, action)
+            if mode == "rules" or (mode == "auto" and event is not None):
+                self._count("rules")
+                span.set(path="rules")
+                return self.rules.appraise(character, event or AppraisalEvent())
         
-        try:
-            # Call OpenAI API for appraisal
-            response = openai.ChatCompletion.create(
-                model="gpt-4", 
-                messages=[
-                    {"role": "system", "content": "You are an expert at modeling character emotions and beliefs using the OCC appraisal model."},
+            self._count("llm")
+            span.set(path="llm")
+            with self.tracer.span("prompt_build"):
+                prompt = self.generate_appraisal_prompt(character, world, action)
+        
+            try:
+                # Call the model for appraisal
+                messages = [
+                    {"role": "system", "content": APPRAISAL_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
+                ]
+                response = self.router.complete(self.backend, "appraisal", messages, validate=is_appraisal_response)
             
-            # Extract the result from the API response
-            result_text = response.choices[0].message.content
+                # Parse the JSON from the response, asking again for any updates it is missing
+                with self.tracer.span("parse"):
+                    try:
+                        result_json = self.parser.parse(
+                            response.text, APPRAISAL_SCHEMA,
+                            rerequest=_followup(self.router, self.backend, "appraisal", messages, response.text)
+                        )
+                    except ValueError:
+                        self.router.discard(self.backend, "appraisal", messages)
+                        raise
             
-            # Parse the JSON from the response
-            # Look for JSON structure between ```json and ```
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', result_text)
-            if json_match:
-                result_json = json.loads(json_match.group(1))
-            else:
-                # If no JSON formatting, try to parse the whole text
-                result_json = json.loads(result_text)
+                return result_json
             
-            return result_json
+            except Exception as e:
+                print(f"Error in appraisal: {e}")
+                # Fall back to the local rules when the event can be described
+                if event is None:
+                    event = describe_event(character, world, action)
+                if event is not None:
+                    self._count("fallback")
+                    span.set(path="fallback")
+                    return self.rules.appraise(character, event)
             
-        except Exception as e:
-            print(f"Error in appraisal: {e}")
-            # Return empty updates if there's an error
-            return {
-                "emotional_updates": {},
-                "belief_updates": {},
-                "theory_of_mind_updates": {},
-                "goal_updates": {},
-                "appraisal_explanation": f"Error in appraisal: {e}"
-            }
+                # Return empty updates if there's an error
+                return {
+                    "emotional_updates": {},
+                    "belief_updates": {},
+                    "theory_of_mind_updates": {},
+                    "goal_updates": {},
+                    "appraisal_explanation": f"Error in appraisal: {e}"
+                }
+    
+    def generate_batch_appraisal_prompt(self, world: World, character_actions: Dict[str, str]) -> str:
+        """
+        Generate one prompt that appraises several characters' actions at once.
+        The world state and OCC procedure are sent once; each character only adds
+        a short section with its action.
+        
+        Args:
+            world: The current world state
+            character_actions: Mapping of character name to the action they took
+            
+        Returns:
+            Prompt string for GPT
+        """
+        channel = "appraisal:batch"
+        world_state = self.encoder.encode_state(self._world_state(world, " ".join(character_actions.values())))
+        sections = "\n".join(f"- **{name}**: {action}" for name, action in character_actions.items())
+        prompt = BATCH_APPRAISAL_TEMPLATE.render(world, world_state=world_state, sections=sections)
+        self.encoder.measure(channel, prompt)
+        return prompt
+    
+    def appraise_actions(self, world: World, character_actions: Dict[str, str],
+                         mode: Optional[str] = None, max_concurrency: int = 1) -> Dict[str, Dict[str, Any]]:
+        """
+        Appraise every character's action from one turn with a single model call.
+        
+        Characters the local rules can handle (per mode) skip the model. Characters
+        whose section of the batched response is missing or malformed are
+        appraised again with individual appraise_action calls.
+        
+        Args:
+            world: The current world state
+            character_actions: Mapping of character name to the action they took
+            mode: "llm", "rules" or "auto" for this batch (defaults to self.mode)
+            max_concurrency: Maximum number of individual fallback calls in flight
+            
+        Returns:
+            Dictionary of state updates keyed by character name, in input order
+        """
+        mode = mode or self.mode
+        results = {}
+        pending = {}
+        for name, action in character_actions.items():
+            character = world.characters[name]
+            event = describe_event(character, world, action) if mode != "llm" else None
+            if mode == "rules" or (mode == "auto" and event is not None):
+                self._count("rules")
+                with self.tracer.span("appraisal", character=name, path="rules"):
+                    results[name] = self.rules.appraise(character, event or AppraisalEvent())
+            else:
+                pending[name] = action
+        
+        if len(pending) == 1:
+            # Nothing to share; a single appraisal prompt is smaller
+            name, action = next(iter(pending.items()))
+            results[name] = self.appraise_action(world.characters[name], world, action, mode="llm")
+            pending = {}
+        elif pending:
+            self._count("llm")
+            batch = {}
+            with self.tracer.span("batch_appraisal", channel="appraisal:batch", characters=len(pending)):
+                try:
+                    with self.tracer.span("prompt_build"):
+                        prompt = self.generate_batch_appraisal_prompt(world, pending)
+                    messages = [
+                        {"role": "system", "content": APPRAISAL_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ]
+                    response = self.router.complete(self.backend, "batch_appraisal", messages,
+                                                    validate=is_batch_appraisal_response, items=len(pending))
+                
+                    # Parse the JSON from the response
+                    with self.tracer.span("parse"):
+                        try:
+                            batch = self.parser.parse(response.text)
+                        except ValueError:
+                            self.router.discard(self.backend, "batch_appraisal", messages, items=len(pending))
+                            raise
+                    if not isinstance(batch, dict):
+                        self.router.discard(self.backend, "batch_appraisal", messages, items=len(pending))
+                        batch = {}
+                except Exception as e:
+                    print(f"Error in batch appraisal: {e}")
+            
+            for name in list(pending):
+                section = batch.get(name)
+                # Sections may leave out updates but not have malformed ones
+                if isinstance(section, dict) and not any(key in section for key in APPRAISAL_SCHEMA.problems(section)):
+                    results[name] = APPRAISAL_SCHEMA.fill_defaults(section)
+                    del pending[name]
+        
+        # Individual calls for characters the batch did not cover
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as executor:
+                futures = {
+                    name: executor.submit(self.appraise_action, world.characters[name], world, action, None, "llm")
+                    for name, action in pending.items()
+                }
+                for name, future in futures.items():
+                    results[name] = future.result()
+        
+        return {name: results[name] for name in character_actions}
+    
+    def _world_state(self, world: World, action: Optional[str] = None, actor: Optional[str] = None) -> Dict[str, Any]:
+        # The setting and background are part of the template prefix
+        if self.prompt_builder is not None:
+            return dynamic_state(self.prompt_builder.build(world, action, actor))
+        return dynamic_state(world.get_state_for_prompt(action))
+
+    def _count(self, path: str):
+        with self._stats_lock:
+            self.stats[path] += 1
 
 
 class StoryEngine:
-    def __init__(self, world: World, player_character: str):
+    def __init__(self, world: World, player_character: str, max_concurrency: int = 1,
+                 backend: Optional[LLMBackend] = None, model: str = DEFAULT_MODEL,
+                 timeout: Optional[float] = None, cache: Optional[ResponseCache] = None,
+                 state_encoding: str = "full", appraisal_mode: str = "llm",
+                 batch_appraisals: bool = False, tracer: Optional[NullTracer] = None,
+                 speculative: bool = False, prompt_budget: Optional[int] = None,
+                 event_log: Optional[EventLog] = None,
+                 router: Optional[ModelRouter] = None, active_npcs: Optional[int] = None,
+                 coalesce: bool = False, parser: Optional[ResponseParser] = None,
+                 tick_engine: Optional[TickEngine] = None, ticks_per_turn: int = 0,
+                 raise_errors: bool = False):
         """
         Initialize the interactive storytelling engine.
         
         Args:
             world: The World object containing characters and setting
             player_character: Name of the character controlled by the player
+            max_concurrency: Maximum number of character appraisals sent to the
+                model at once. 1 keeps the original one-at-a-time behavior.
+            backend: Chat completion backend shared with the appraisal model
+                (defaults to a pooled HTTPBackend)
+            model: Model used for story, NPC and appraisal calls
+            timeout: Per-call timeout in seconds (None uses the backend default)
+            cache: Response cache consulted before every story, NPC and appraisal
+                call. Identical prompts are answered without calling the model.
+            state_encoding: How state is serialized into prompts: "full" (indented
+                JSON) or "compact". See prompt_encoding.StateEncoder.
+            appraisal_mode: "llm", "rules" or "auto". See OCCAppraisalModel.
+            batch_appraisals: Appraise all NPC actions of a turn in a single
+                model call (see OCCAppraisalModel.appraise_actions)
+            tracer: Receives a span per turn, prompt build, model call, parse and
+                appraisal (see instrumentation.Tracer). The default NullTracer
+                records nothing.
+            speculative: Start the NPC call of each turn without waiting for the
+                player turn's appraisals, so the NPC prompt may not yet include
+                their updates
+            prompt_budget: Estimated tokens of world state per prompt. Character
+                entries most relevant to the action are kept and the rest left
+                out (see prompt_builder.RelevancePromptBuilder). None sends the
+                full state.
+            event_log: Log that records every change to the world, with a turn
+                marker at the start of each player turn (see event_log.EventLog)
+            router: Model, token limit and timeout per call type, with escalation
+                and latency and cost accounting (see model_routing.ModelRouter).
+                Defaults to model and timeout for every call.
+            active_npcs: NPCs that act and are appraised by the model per turn,
+                the most salient first (see npc_scheduler.SalienceScheduler).
+                Other NPCs named in a turn's actions are appraised with the
+                local rules. None activates every NPC.
+            coalesce: Send identical model calls that are in flight at the same
+                time upstream once (see request_coalescing.CoalescingBackend)
+            parser: Decodes and validates every response, shared with the
+                appraisal model (defaults to a new response_parsing.ResponseParser)
+            tick_engine: Advances emotions and goals between turns without the
+                model (see tick_engine.TickEngine). Defaults to one with the
+                default rates when ticks_per_turn is set.
+            ticks_per_turn: Ticks run at the start of each player turn.
+            raise_errors: Let a failed player or NPC turn raise instead of
+                returning the error message as its narrative (for callers such
+                as servers that report failures themselves)
         """
         self.world = world
         self.player_character = player_character
-        self.appraisal_model = OCCAppraisalModel()
+        self.backend = backend or HTTPBackend(pool_size=max(10, max_concurrency))
+        self.coalescer = CoalescingBackend(self.backend) if coalesce else None
+        if self.coalescer is not None:
+            self.backend = self.coalescer
+        self.cache = cache
+        if cache is not None:
+            self.backend = CachedBackend(self.backend, cache)
+        self.tracer = tracer or NullTracer()
+        if self.tracer.enabled:
+            self.backend = TracedBackend(self.backend, self.tracer)
+        self.model = model
+        self.timeout = timeout
+        self.encoder = StateEncoder(mode=state_encoding)
+        self.prompt_builder = RelevancePromptBuilder(prompt_budget) if prompt_budget is not None else None
+        self.router = router or ModelRouter.single(model, timeout)
+        self.scheduler = SalienceScheduler(active_npcs) if active_npcs is not None else None
+        self.parser = parser or ResponseParser()
+        self.ticks_per_turn = ticks_per_turn
+        self.tick_engine = tick_engine or (TickEngine(world) if ticks_per_turn > 0 else None)
+        self.appraisal_model = OCCAppraisalModel(self.backend, model=model, timeout=timeout,
+                                                 encoder=self.encoder, mode=appraisal_mode,
+                                                 tracer=self.tracer, prompt_builder=self.prompt_builder,
+                                                 router=self.router, parser=self.parser)
+        self.max_concurrency = max(1, max_concurrency)
+        self.batch_appraisals = batch_appraisals
+        
+        # Appraisals deferred to the background while narrative is streamed
+        self._background = ThreadPoolExecutor(max_workers=1)
+        self._pending_appraisals = None
+        # Held while appraisal results are written, so prompts built during
+        # background appraisals see whole updates
+        self._state_lock = threading.RLock()
+        
+        # NPC calls overlapping the player turn's appraisals
+        self.speculative = speculative
+        self.raise_errors = raise_errors
+        
+        self.event_log = event_log
+        if event_log is not None:
+            event_log.attach(world)
     
     def generate_story_intro(self) -> str:
         """Generate and return the story introduction"""
@@ -217,204 +415,376 @@ class StoryEngine:
         Returns:
             Prompt string for GPT
         """
-        world_state = self.world.get_state_for_prompt()
-        player_character = self.world.characters[self.player_character].get_state_for_prompt()
+        world_state = self.encoder.encode_state(self._world_state(user_input, self.player_character))
+        if self.encoder.deduplicate or self.prompt_builder is not None:
+            # The player's state is already part of the world state
+            player_character = f"{self.player_character} (state listed under World State characters)"
+        else:
+            player = self.world.characters[self.player_character]
+            player_character = self.encoder.dumps(player.get_state_for_prompt(self.world.mentioned_characters(user_input)))
         
-        prompt = f"""
-        # Interactive Story Generation
-        
-        ## World State
-        {json.dumps(world_state, indent=2)}
-        
-        ## Player Character
-        {json.dumps(player_character, indent=2)}
-        
-        ## Player's Action
-        {user_input}
-        
-        ## Task
-        Generate the next part of the interactive story based on the player's action. 
-        
-        1. Determine how other characters would realistically react.
-        2. Update the world state if necessary.
-        3. Provide a narrative description of what happens.
-        
-        ## Output Format
-        Return a JSON object with the following structure:
-        ```json
-        {{
-            "narrative": "Description of what happens in the story",
-            "character_actions": {{
-                "character_name": "Description of this character's reaction",
-                ...
-            }},
-            "world_state_updates": {{
-                "state_key": new_value,
-                ...
-            }}
-        }}
-        ```
-        """
+        prompt = ACTION_TEMPLATE.render(self.world, world_state=world_state, player_character=player_character,
+                                        user_input=user_input)
+        self.encoder.measure("action", prompt)
         return prompt
     
-    def process_player_input(self, user_input: str) -> Tuple[str, Dict[str, Any]]:
+    def _world_state(self, action: Optional[str] = None, actor: Optional[str] = None,
+                     characters: Optional[List[str]] = None) -> Dict[str, Any]:
+        """World state for a prompt, pruned to the prompt budget when one is set and to characters when given"""
+        # The setting and background are part of the template prefix
+        if self.prompt_builder is not None:
+            return dynamic_state(self.prompt_builder.build(self.world, action, actor, characters))
+        state = dynamic_state(self.world.get_state_for_prompt(action))
+        if characters is not None:
+            state["characters"] = {name: character for name, character in state["characters"].items()
+                                   if name in characters}
+        return state
+    
+    def process_player_input(self, user_input: str,
+                             on_text: Optional[Callable[[str], None]] = None) -> Tuple[str, Dict[str, Any]]:
         """
         Process player input and update the story.
         
         Args:
             user_input: The player's input as their character
+            on_text: Optional callback that receives the narrative as it streams
+                in. When given, character appraisals run in the background and
+                the call returns as soon as the world state and history are updated.
             
         Returns:
             Tuple of (narrative text, state updates)
         """
-        prompt = self.generate_action_prompt(user_input)
+        with self.tracer.span("player_turn", channel="action"):
+            self.wait_for_appraisals()
+            if self.event_log is not None:
+                self.event_log.mark_turn()
+            if self.tick_engine is not None and self.ticks_per_turn > 0:
+                # Time passes between turns
+                with self.tracer.span("ticks"), self._state_lock:
+                    self.tick_engine.run(self.ticks_per_turn)
+            with self.tracer.span("prompt_build"):
+                prompt = self.generate_action_prompt(user_input)
         
-        try:
-            # Call OpenAI API for story generation
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an interactive storytelling engine creating a realistic sci-fi narrative."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
+            try:
+                # Call the model for story generation
+                result_text = self._request("narrative", STORY_SYSTEM_PROMPT, prompt, on_text)
             
-            # Extract the result
-            result_text = response.choices[0].message.content
+                # Parse the JSON from the response
+                with self.tracer.span("parse"):
+                    result_json = self._parse(result_text, STORY_SCHEMA, "narrative", STORY_SYSTEM_PROMPT, prompt)
             
-            # Parse the JSON from the response
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', result_text)
-            if json_match:
-                result_json = json.loads(json_match.group(1))
-            else:
-                # If no JSON formatting, try to parse the whole text
-                result_json = json.loads(result_text)
+                # Update world state if needed
+                if result_json["world_state_updates"]:
+                    self.world.update_world_state(result_json["world_state_updates"])
             
-            # Update world state if needed
-            if "world_state_updates" in result_json:
-                self.world.update_world_state(result_json["world_state_updates"])
+                # Add to world history
+                self.world.add_to_history(user_input)
+                self.world.add_to_history(result_json["narrative"])
             
-            # Add to world history
-            self.world.add_to_history(user_input)
-            self.world.add_to_history(result_json["narrative"])
+                # Process character actions and update states; in speculative mode
+                # the NPC call overlaps with them
+                self._appraise(result_json.get("character_actions", {}),
+                               background=on_text is not None or self.speculative)
             
-            # Process character actions and update states
-            for char_name, action in result_json.get("character_actions", {}).items():
-                if char_name in self.world.characters:
-                    # Skip player character as they're controlled by the player
-                    if char_name == self.player_character:
-                        continue
-                    
-                    # Appraise the action for this character
-                    character = self.world.characters[char_name]
-                    appraisal_result = self.appraisal_model.appraise_action(character, self.world, action)
-                    
-                    # Update character state based on appraisal
-                    character.update_state(
-                        appraisal_result.get("emotional_updates", {}),
-                        appraisal_result.get("belief_updates", {}),
-                        appraisal_result.get("theory_of_mind_updates", {}),
-                        appraisal_result.get("goal_updates", {})
-                    )
-            
-            return result_json["narrative"], result_json
+                return result_json["narrative"], result_json
             
+            except Exception as e:
+                if self.raise_errors:
+                    raise
+                print(f"Error processing input: {e}")
+                return f"Error processing your input: {e}", {}
+    
+    def _request(self, call_type: str, system_prompt: str, prompt: str,
+                 on_text: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Send a story ("narrative") or NPC ("npc") prompt along its route and
+        return the raw response text. With on_text the response is streamed
+        and the "narrative" field is passed to on_text piece by piece as it
+        arrives.
+        """
+        messages = self._messages(system_prompt, prompt)
+        if on_text is None:
+            return self.router.complete(self.backend, call_type, messages, validate=is_story_response).text
+        
+        extractor = JSONStringFieldExtractor("narrative")
+        chunks = []
+        for chunk in self.router.stream(self.backend, call_type, messages):
+            chunks.append(chunk)
+            text = extractor.feed(chunk)
+            if text:
+                on_text(text)
+        return "".join(chunks)
+    
+    def _parse(self, text: str, schema: ResponseSchema, call_type: str, system_prompt: str, prompt: str) -> Dict[str, Any]:
+        """
+        Validate a story or NPC response, asking again in the same conversation
+        for missing fields. A response that cannot be used is discarded from
+        the backend so a cache does not replay it.
+        """
+        messages = self._messages(system_prompt, prompt)
+        try:
+            return self.parser.parse(text, schema, rerequest=_followup(self.router, self.backend, call_type,
+                                                                       messages, text))
+        except ValueError:
+            self.router.discard(self.backend, call_type, messages)
+            raise
+    
+    @staticmethod
+    def _messages(system_prompt: str, prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _appraise(self, character_actions: Dict[str, str], background: bool = False):
+        """Appraise character actions now, or queue them behind any earlier background appraisals"""
+        if background:
+            self._pending_appraisals = self._background.submit(self.appraise_character_actions, character_actions)
+        else:
+            self.appraise_character_actions(character_actions)
+    
+    def wait_for_appraisals(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Block until background appraisals have been applied.
+        
+        Returns:
+            The appraisal results of the most recent background batch, if any
+        """
+        pending, self._pending_appraisals = self._pending_appraisals, None
+        if pending is None:
+            return None
+        try:
+            return pending.result()
         except Exception as e:
-            print(f"Error processing input: {e}")
-            return f"Error processing your input: {e}", {}
+            print(f"Error in background appraisal: {e}")
+            return None
+    
+    def appraise_character_actions(self, character_actions: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Appraise each NPC's action and apply the resulting state updates.
+        
+        With batch_appraisals the whole turn is appraised in one model call. With
+        max_concurrency > 1 all appraisals for the turn are sent at once (up to
+        max_concurrency in flight). In both cases every appraisal sees the same
+        pre-turn state, and the updates are applied only after all of them have
+        returned, in the order the actions were given, so the outcome does not
+        depend on which request finished first.
+        
+        Args:
+            character_actions: Mapping of character name to the action they took
+            
+        Returns:
+            Dictionary of appraisal results keyed by character name
+        """
+        npc_actions = self._npc_actions(character_actions)
+        if (self.batch_appraisals or self.max_concurrency > 1) and len(npc_actions) > 1:
+            appraisals = self.compute_appraisals(character_actions)
+            
+            # Apply updates in a deterministic order once every appraisal is in
+            for char_name, appraisal_result in appraisals.items():
+                self._apply_appraisal(self.world.characters[char_name], appraisal_result)
+            return appraisals
+        
+        appraisals = {}
+        modes = self._appraisal_modes(npc_actions)
+        for char_name, action in npc_actions:
+            # Appraise the action for this character
+            character = self.world.characters[char_name]
+            appraisal_result = self.appraisal_model.appraise_action(character, self.world, action,
+                                                                    mode=modes[char_name])
+            self._apply_appraisal(character, appraisal_result)
+            appraisals[char_name] = appraisal_result
+        
+        return appraisals
+    
+    def compute_appraisals(self, character_actions: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Appraise each NPC's action against the current state without applying
+        the results. Uses one batched call with batch_appraisals, otherwise up to
+        max_concurrency individual calls at once.
+        
+        Args:
+            character_actions: Mapping of character name to the action they took
+            
+        Returns:
+            Dictionary of appraisal results keyed by character name, in input order
+        """
+        npc_actions = self._npc_actions(character_actions)
+        modes = self._appraisal_modes(npc_actions)
+        appraisals = {}
+        batched = [(char_name, action) for char_name, action in npc_actions if modes[char_name] is None]
+        if self.batch_appraisals and len(batched) > 1:
+            appraisals.update(self.appraisal_model.appraise_actions(self.world, dict(batched),
+                                                                    max_concurrency=self.max_concurrency))
+        
+        remaining = [(char_name, action) for char_name, action in npc_actions if char_name not in appraisals]
+        if remaining:
+            workers = max(1, min(self.max_concurrency, len(remaining)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.appraisal_model.appraise_action,
+                                    self.world.characters[char_name], self.world, action, mode=modes[char_name])
+                    for char_name, action in remaining
+                ]
+                for (char_name, _), future in zip(remaining, futures):
+                    appraisals[char_name] = future.result()
+        return {char_name: appraisals[char_name] for char_name, _ in npc_actions}
     
-    def generate_npc_actions(self) -> Tuple[str, Dict[str, Any]]:
+    def _npc_actions(self, character_actions: Dict[str, str]) -> List[Tuple[str, str]]:
+        """Only NPCs known to the world are appraised"""
+        return [
+            (char_name, action) for char_name, action in character_actions.items()
+            if char_name in self.world.characters and char_name != self.player_character
+        ]
+    
+    def _appraisal_modes(self, npc_actions: List[Tuple[str, str]]) -> Dict[str, Optional[str]]:
+        """
+        Appraisal mode per NPC: None (the appraisal model's mode) for the NPCs
+        the scheduler activates, "rules" for the rest
+        """
+        if self.scheduler is None:
+            return {char_name: None for char_name, _ in npc_actions}
+        activated, _ = self.scheduler.split(self.world, [char_name for char_name, _ in npc_actions])
+        return {char_name: None if char_name in activated else "rules" for char_name, _ in npc_actions}
+    
+    def _apply_appraisal(self, character: Character, appraisal_result: Dict[str, Any]):
+        """Update character state based on an appraisal result"""
+        with self._state_lock, self.tracer.span("apply", character=character.name):
+            character.update_state(
+                appraisal_result.get("emotional_updates", {}),
+                appraisal_result.get("belief_updates", {}),
+                appraisal_result.get("theory_of_mind_updates", {}),
+                appraisal_result.get("goal_updates", {})
+            )
+    
+    def generate_npc_prompt(self) -> str:
+        """
+        Generate a prompt for GPT to create the next NPC actions.
+        
+        Returns:
+            Prompt string for GPT
+        """
+        # With a prompt budget, rank entries by what just happened
+        latest = self.world.history[-1] if self.world.history and self.prompt_builder is not None else None
+        acting = ""
+        characters = None
+        if self.scheduler is not None:
+            # Only the most salient NPCs act; the prompt describes just them and the player
+            active = self.scheduler.select(self.world, exclude=[self.player_character])
+            characters = active + [self.player_character]
+            acting = ("\n\n## Acting Characters\nOnly these characters act this turn: " + ", ".join(active)
+                      + ". Leave everyone else out of character_actions.")
+        world_state = self.encoder.encode_state(self._world_state(latest, characters=characters))
+        
+        prompt = NPC_TEMPLATE.render(self.world, world_state=world_state, acting=acting)
+        self.encoder.measure("npc", prompt)
+        return prompt
+    
+    def generate_npc_actions(self, on_text: Optional[Callable[[str], None]] = None) -> Tuple[str, Dict[str, Any]]:
         """
         Generate actions for non-player characters.
         
+        In speculative mode the NPC call starts before the player turn's
+        appraisals have finished, so the NPC prompt may not yet include their
+        updates.
+        
+        Args:
+            on_text: Optional callback that receives the narrative as it streams
+                in. When given, character appraisals run in the background.
+        
         Returns:
             Tuple of (narrative text, state updates)
         """
-        world_state = self.world.get_state_for_prompt()
+        with self.tracer.span("npc_turn", channel="npc"):
+            try:
+                if self.speculative:
+                    # Overlap the NPC call with the tail of the player turn's appraisals
+                    with self._state_lock, self.tracer.span("prompt_build"):
+                        prompt = self.generate_npc_prompt()
+                    result_json = self.request_npc_actions(prompt, on_text)
+                    self.wait_for_appraisals()
+                else:
+                    self.wait_for_appraisals()
+                    result_json = self.request_npc_actions(on_text=on_text)
+                
+                return self.apply_npc_actions(result_json, background=on_text is not None)
+            
+            except Exception as e:
+                if self.raise_errors:
+                    raise
+                print(f"Error generating NPC actions: {e}")
+                return f"Error generating NPC actions: {e}", {}
+    
+    def request_npc_actions(self, prompt: Optional[str] = None,
+                            on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Ask the model for the next NPC actions without changing the world.
         
-        prompt = f"""
-        # NPC Character Actions
+        Args:
+            prompt: NPC prompt to send (built from the current state when not given)
+            on_text: Optional callback that receives the narrative as it streams in
         
-        ## World State
-        {json.dumps(world_state, indent=2)}
+        Returns:
+            The parsed response
         
-        ## Task
-        Generate the next actions for the non-player characters in the story.
-        Consider each character's goals, beliefs, and emotional state.
-        Characters should act in ways that are consistent with their beliefs and goals.
+        Raises:
+            Exception: If the call fails or the response is not valid JSON
+        """
+        if prompt is None:
+            with self.tracer.span("prompt_build"):
+                prompt = self.generate_npc_prompt()
         
-        ## Output Format
-        Return a JSON object with the following structure:
-        ```json
-        {{
-            "narrative": "Description of what the NPCs do",
-            "character_actions": {{
-                "character_name": "Description of this character's action",
-                ...
-            }},
-            "world_state_updates": {{
-                "state_key": new_value,
-                ...
-            }}
-        }}
-        ```
+        # Call the model for NPC actions
+        result_text = self._request("npc", NPC_SYSTEM_PROMPT, prompt, on_text)
+        
+        # Parse the JSON from the response
+        with self.tracer.span("parse"):
+            return self._parse(result_text, NPC_SCHEMA, "npc", NPC_SYSTEM_PROMPT, prompt)
+    
+    def apply_npc_actions(self, result_json: Dict[str, Any],
+                          appraisals: Optional[Dict[str, Dict[str, Any]]] = None,
+                          background: bool = False) -> Tuple[str, Dict[str, Any]]:
         """
+        Apply a parsed NPC response to the world.
         
-        try:
-            # Call OpenAI API for NPC actions
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an interactive storytelling engine creating realistic character actions."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            # Extract the result
-            result_text = response.choices[0].message.content
-            
-            # Parse the JSON from the response
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', result_text)
-            if json_match:
-                result_json = json.loads(json_match.group(1))
-            else:
-                # If no JSON formatting, try to parse the whole text
-                result_json = json.loads(result_text)
-            
-            # Update world state if needed
-            if "world_state_updates" in result_json:
-                self.world.update_world_state(result_json["world_state_updates"])
-            
-            # Add to world history
-            self.world.add_to_history(result_json["narrative"])
-            
-            # Process character actions and update states
-            for char_name, action in result_json.get("character_actions", {}).items():
-                if char_name in self.world.characters and char_name != self.player_character:
-                    # Appraise the action for this character
-                    character = self.world.characters[char_name]
-                    appraisal_result = self.appraisal_model.appraise_action(character, self.world, action)
-                    
-                    # Update character state based on appraisal
-                    character.update_state(
-                        appraisal_result.get("emotional_updates", {}),
-                        appraisal_result.get("belief_updates", {}),
-                        appraisal_result.get("theory_of_mind_updates", {}),
-                        appraisal_result.get("goal_updates", {})
-                    )
-            
-            return result_json["narrative"], result_json
-            
-        except Exception as e:
-            print(f"Error generating NPC actions: {e}")
-            return f"Error generating NPC actions: {e}", {}
+        Args:
+            result_json: Response from request_npc_actions
+            appraisals: Appraisal results computed ahead of time; when not given the
+                NPC actions are appraised now
+            background: Run the appraisals in the background
+        
+        Returns:
+            Tuple of (narrative text, state updates)
+        """
+        # Update world state if needed
+        if result_json.get("world_state_updates"):
+            self.world.update_world_state(result_json["world_state_updates"])
+        
+        # Add to world history
+        self.world.add_to_history(result_json["narrative"])
+        if self.scheduler is not None:
+            self.scheduler.record(char_name for char_name, _ in self._npc_actions(result_json.get("character_actions", {})))
+        
+        # Process character actions and update states
+        if appraisals is None:
+            self._appraise(result_json.get("character_actions", {}), background=background)
+        else:
+            for char_name, appraisal_result in appraisals.items():
+                if char_name in self.world.characters:
+                    self._apply_appraisal(self.world.characters[char_name], appraisal_result)
+        
+        return result_json["narrative"], result_json
     
-    def run_interactive_story(self):
-        """Run the interactive storytelling loop"""
+    def run_interactive_story(self, stream: bool = False, profiler: Optional[SpanAggregator] = None):
+        """
+        Run the interactive storytelling loop.
+        
+        Args:
+            stream: Print narrative as it is generated and let appraisals finish
+                in the background instead of waiting for the whole turn
+            profiler: Aggregator attached to this engine's tracer. When given, a
+                breakdown of where each turn's time went is printed after the turn.
+        """
         # Print the intro
         print(self.generate_story_intro())
         
@@ -425,19 +795,63 @@ class StoryEngine:
             
             # Check for quit command
             if "quit" in user_input.lower() or "exit" in user_input.lower():
+                self.wait_for_appraisals()
                 print("Ending the story. Thanks for playing!")
                 break
             
             # Process player input and update world
-            narrative, _ = self.process_player_input(user_input)
-            print(f"\n{narrative}")
+            if stream:
+                self._print_streamed(self.process_player_input, user_input)
+            else:
+                narrative, _ = self.process_player_input(user_input)
+                print(f"\n{narrative}")
             
             # Let NPCs react
-            npc_narrative, _ = self.generate_npc_actions()
-            print(f"\n{npc_narrative}")
+            if stream:
+                self._print_streamed(self.generate_npc_actions)
+            else:
+                npc_narrative, _ = self.generate_npc_actions()
+                print(f"\n{npc_narrative}")
+            
+            if profiler is not None:
+                # Include this turn's background appraisals in the breakdown
+                self.wait_for_appraisals()
+                print(f"\n--- Turn profile ---\n{profiler.format_breakdown()}")
+                print(f"\n--- Model routes (session) ---\n{self.router.format_report()}")
+                if self.coalescer is not None:
+                    stats = self.coalescer.flights.stats
+                    print(f"Coalesced {stats['coalesced']} of {stats['calls']} calls (session)")
+                print(f"Responses: {self.parser.format_report()} (session)")
+                profiler.reset()
             
             # Optional: Print debug information about character states
             debug = input("Show character states? (y/n): ")
             if debug.lower() == "y":
+                self.wait_for_appraisals()
                 for name, character in self.world.characters.items():
-                    print(f"\n{character}")
\ No newline at end of file
+                    print(f"\n{character}")
+    
+    def _print_streamed(self, turn: Callable[..., Tuple[str, Dict[str, Any]]], *args):
+        """Run a streaming turn, printing narrative text as soon as it arrives"""
+        printed = []
+        
+        def on_text(text: str):
+            if not printed:
+                print()
+            printed.append(text)
+            print(text, end="", flush=True)
+        
+        narrative, result = turn(*args, on_text=on_text)
+        if printed:
+            print()
+        if not printed or not result:
+            # Nothing was streamed, or the turn failed after part of it was
+            # (failed turns return no result), so show the returned narrative
+            print(f"\n{narrative}")
+    
+    def close(self):
+        """Finish pending appraisals and stop the engine's worker threads"""
+        self.wait_for_appraisals()
+        self._background.shutdown(wait=False)
+        if self.event_log is not None:
+            self.event_log.close()
@@ -0,0 +1,112 @@
+import re
+from typing import Dict, List, Tuple, Any, Optional
+
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+REPLACEMENT_CHARACTER = "\ufffd"
+JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def _hex4(text: str) -> Optional[int]:
+    """Value of exactly four hex digits, or None"""
+    if len(text) != 4 or not all(c in HEX_DIGITS for c in text):
+        return None
+    return int(text, 16)
+
+
+class JSONStringFieldExtractor:
+    def __init__(self, field: str):
+        """
+        Incrementally decode the string value of one JSON field from a stream of
+        text chunks, so it can be shown before the whole response has arrived.
+        Text around the JSON (such as a ```json fence) is ignored.
+
+        Args:
+            field: Name of the field whose string value is extracted
+        """
+        self.pattern = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self.buffer = ""
+        self.position = None  # index of the next undecoded value character, once the field is found
+        self.done = False
+        self.value = []
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of the response.
+
+        Returns:
+            The newly decoded part of the field's value (may be empty)
+        """
+        if self.done:
+            return ""
+        self.buffer += chunk
+
+        if self.position is None:
+            match = self.pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        buffer = self.buffer
+        i = self.position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+
+            # Escape sequence; wait for more input if it is cut off
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape == "u":
+                char, length = self._unicode_escape(buffer, i)
+                if char is None:
+                    break
+                decoded.append(char)
+                i += length
+            else:
+                decoded.append(JSON_ESCAPES.get(escape, escape))
+                i += 2
+
+        self.position = i
+        text = "".join(decoded)
+        self.value.append(text)
+        return text
+
+    @staticmethod
+    def _unicode_escape(buffer: str, i: int) -> Tuple[Optional[str], int]:
+        """
+        Decode the \\u escape at buffer[i], joining a UTF-16 surrogate pair into
+        one character. Invalid escapes and unpaired surrogates decode to U+FFFD.
+
+        Returns:
+            (character, escape length), or (None, 0) if more input is needed
+        """
+        code = _hex4(buffer[i + 2:i + 6])
+        if code is None:
+            if len(buffer) < i + 6 and all(c in HEX_DIGITS for c in buffer[i + 2:]):
+                return None, 0
+            return REPLACEMENT_CHARACTER, 2
+        if 0xDC00 <= code <= 0xDFFF:
+            return REPLACEMENT_CHARACTER, 6
+        if not 0xD800 <= code <= 0xDBFF:
+            return chr(code), 6
+
+        # High surrogate; the low one should follow as another \\u escape
+        rest = buffer[i + 6:i + 12]
+        if len(rest) < 6 and "\\u".startswith(rest[:2]) and all(c in HEX_DIGITS for c in rest[2:]):
+            return None, 0
+        low = _hex4(rest[2:]) if rest.startswith("\\u") else None
+        if low is None or not 0xDC00 <= low <= 0xDFFF:
+            return REPLACEMENT_CHARACTER, 6
+        return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+
+    def text(self) -> str:
+        """Everything decoded so far"""
+        return "".join(self.value)
@@ -0,0 +1,27 @@
+from character_world_classes import Character, World
+
+
+def make_world(seed: int = 7) -> World:
+    characters = [
+        Character("Kara", {"fear": 0.2, "trust": 0.7}, {"station_safe": 0.8, "sabotage": 0.1},
+                  {"task": {"fix_reactor": 0.9}, "emotional": {"stay_calm": 0.5}}),
+        Character("Raymond", {"fear": 0.6}, {"station_safe": 0.4},
+                  {"task": {"keep_order": 0.8}}),
+        Character("Bao", {"anxiety": 0.3}, {"sabotage": 0.6, "rescue_coming": 0.2},
+                  {"emotional": {"protect_crew": 0.7}})
+    ]
+    return World("A station", "Oxygen is running low.", characters, seed=seed)
+
+
+def character_state(world: World) -> dict:
+    """Every character's values, read without materializing theory of mind"""
+    store = world.store
+    return {
+        name: {
+            "emotions": store.row_dict("emotions", character.row),
+            "beliefs": store.row_dict("beliefs", character.row),
+            "goals": store.goals_dict(character.row),
+            "theory_of_mind": store.tom_dict(character.row)
+        }
+        for name, character in world.characters.items()
+    }
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from backend_pool import BackendPool, PoolOverloaded
+from llm_backends import LLMBackend, LLMResponse
+
+
+class GatedBackend(LLMBackend):
+    """Records the order of calls; a call for "hold" waits until released"""
+
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def complete(self, messages, model="m", **kwargs):
+        text = messages[0]["content"]
+        with self._lock:
+            self.calls.append(text)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        if text == "hold":
+            self.release.wait(5)
+        else:
+            time.sleep(0.01)
+        with self._lock:
+            self.active -= 1
+        return LLMResponse(text=text, model=model, usage={}, latency=0.0)
+
+
+def call(pool, session_id, text):
+    thread = threading.Thread(target=pool.complete, args=(session_id, [{"role": "user", "content": text}]))
+    thread.start()
+    return thread
+
+
+def wait_for_queued(pool, count):
+    deadline = time.monotonic() + 5
+    while pool.queued() < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert pool.queued() == count
+
+
+def test_waiting_sessions_are_served_round_robin():
+    backend = GatedBackend()
+    pool = BackendPool(backend, max_in_flight=1)
+    threads = [call(pool, "x", "hold")]
+    while not backend.calls:
+        time.sleep(0.001)
+    for index, (session_id, text) in enumerate([("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]):
+        threads.append(call(pool, session_id, text))
+        wait_for_queued(pool, index + 1)
+
+    backend.release.set()
+    for thread in threads:
+        thread.join()
+    # Session b does not wait behind all of a's calls
+    assert backend.calls == ["hold", "a1", "b1", "a2", "a3"]
+    assert pool.stats["calls"] == 5
+
+
+def test_calls_in_flight_are_capped():
+    backend = GatedBackend()
+    pool = BackendPool(backend, max_in_flight=2)
+    threads = [call(pool, f"s{index}", f"call{index}") for index in range(8)]
+    for thread in threads:
+        thread.join()
+    assert backend.peak <= 2
+    assert pool.in_flight() == 0 and pool.queued() == 0
+
+
+def test_calls_beyond_max_queued_are_rejected():
+    backend = GatedBackend()
+    pool = BackendPool(backend, max_in_flight=1, max_queued=1)
+    holder = call(pool, "x", "hold")
+    while not backend.calls:
+        time.sleep(0.001)
+    waiting = call(pool, "a", "a1")
+    wait_for_queued(pool, 1)
+
+    with pytest.raises(PoolOverloaded):
+        pool.complete("b", [{"role": "user", "content": "b1"}])
+    assert pool.stats["rejected"] == 1
+
+    backend.release.set()
+    holder.join()
+    waiting.join()
+    assert backend.calls == ["hold", "a1"]
+
+
+def test_rate_limit_spaces_out_calls():
+    backend = GatedBackend()
+    pool = BackendPool(backend, max_in_flight=4, rate_limit=50.0, burst=1)
+    start = time.monotonic()
+    for index in range(5):
+        pool.complete("s", [{"role": "user", "content": f"call{index}"}])
+    # One call may start at once, the other four wait 1/50 s each for a token
+    assert time.monotonic() - start >= 4 / 50 * 0.9
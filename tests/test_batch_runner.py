@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import batch_runner
+from batch_runner import run_session, run_sessions, summarize_latencies
+from llm_backends import LLMBackend, StubBackend
+
+SESSION = {"id": "s1", "scenario": "main:setup_space_station_scenario", "inputs": ["I check the logs"],
+           "seed": "fixed"}
+
+
+class FailingBackend(LLMBackend):
+    def complete(self, messages, **kwargs):
+        raise RuntimeError("model down")
+
+
+def test_percentiles_use_nearest_rank():
+    assert summarize_latencies([1.0, 2.0])["p50"] == 1.0
+    assert summarize_latencies([1.0, 2.0, 3.0, 4.0])["p50"] == 2.0
+    assert summarize_latencies([float(value) for value in range(1, 11)])["p90"] == 9.0
+    assert summarize_latencies([5.0])["p99"] == 5.0
+    assert summarize_latencies([]) == {"count": 0}
+
+
+def test_seeded_sessions_are_reproducible():
+    first = run_session(dict(SESSION), StubBackend(), {})
+    second = run_session(dict(SESSION), StubBackend(), {})
+    assert first["error"] is None
+    assert first["final_state"] == second["final_state"]
+
+
+def test_failed_turns_are_errors_and_engines_are_closed(monkeypatch):
+    closed = []
+    close = batch_runner.StoryEngine.close
+    monkeypatch.setattr(batch_runner.StoryEngine, "close", lambda engine: closed.append(engine) or close(engine))
+
+    record = run_session(dict(SESSION), FailingBackend(), {})
+    assert record["error"] == "RuntimeError: model down"
+    assert record["turns"] == []
+    assert len(closed) == 1
+
+
+def test_every_session_is_written(tmp_path):
+    sessions = [dict(SESSION, id=f"s{index}", seed=index) for index in range(5)]
+    output = tmp_path / "records.jsonl"
+    summary = run_sessions(sessions, {"offline": True, "sessions_per_worker": 2}, str(output), workers=2)
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record["session_id"] for record in records) == [f"s{index}" for index in range(5)]
+    assert summary["sessions"] == 5 and summary["errors"] == 0
+    assert summary["turns"] == 5
@@ -0,0 +1,104 @@
+import json
+
+from event_log import EventLog, LogReader, world_to_dict
+from tick_engine import TickEngine, UrgencyPressure
+from tests.helpers import make_world
+
+
+def saved(world) -> dict:
+    """Everything replay must restore, in JSON form"""
+    return json.loads(json.dumps({"world": world_to_dict(world), "history": list(world.history)}))
+
+
+def play_turn(world, ticks: TickEngine, turn: int):
+    """Change every kind of state the log records"""
+    kara, raymond, bao = (world.characters[name] for name in ("Kara", "Raymond", "Bao"))
+    world.add_to_history(f"Turn {turn}: Kara inspects the vents.")
+    world.update_world_state({"turn": turn, "alarm": turn % 2 == 0})
+    kara.update_state({"fear": 0.1 * turn, "resolve": 1.2}, {"sabotage": 0.2 + 0.1 * turn},
+                      {"Bao": {"sabotage": 0.5}}, {"task": {"fix_reactor": 0.95}})
+    raymond.emotions["anger"] = min(1.0, 0.2 * turn)
+    # Reading through the view materializes a theory-of-mind entry
+    raymond.theory_of_mind["Bao"]["station_safe"]
+    world.bulk_update_characters("beliefs", {"Bao": {"rescue_coming": 0.05 * turn}, "Raymond": {"sabotage": 0.3}})
+    if turn == 2:
+        bao.goals[f"secret_{turn}"] = {"escape": 0.4}
+        del kara.emotions["trust"]
+        del raymond.theory_of_mind["Kara"]
+    if turn == 4:
+        bao.emotions = {"panic": 0.8}
+        kara.theory_of_mind = {"Raymond": {"station_safe": 0.3}}
+    ticks.run(5)
+
+
+def test_replay_matches_live_state_at_every_turn(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    world = make_world()
+    world.add_to_history("The station shudders.")
+    world.update_world_state({"oxygen": 24.0})
+    log = EventLog(path, snapshot_interval=3)
+    log.attach(world)
+    ticks = TickEngine(world, decay=0.05, contagion=0.02,
+                       pressures=[UrgencyPressure("oxygen", 24.0, 0.0, rate=0.05)],
+                       clocks={"oxygen": -0.5})
+
+    expected = []
+    for turn in range(8):
+        log.mark_turn()
+        expected.append(saved(world))
+        play_turn(world, ticks, turn)
+    log.close()
+
+    reader = LogReader(path)
+    try:
+        assert reader.turns == len(expected)
+        assert len(reader.snapshots) > 1
+        for turn, state in enumerate(expected):
+            assert saved(reader.world_at(turn)) == state, f"turn {turn}"
+        assert saved(reader.world_at()) == saved(world)
+    finally:
+        reader.close()
+
+
+def test_log_continues_after_reattaching(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    world = make_world()
+    ticks = TickEngine(world)
+    log = EventLog(path, snapshot_interval=2)
+    log.attach(world)
+    for turn in range(3):
+        log.mark_turn()
+        play_turn(world, ticks, turn)
+    log.close()
+
+    # A restored session keeps writing to the same file
+    resumed = EventLog(path, snapshot_interval=2)
+    world.log = None
+    resumed.attach(world)
+    assert resumed.turn == 3
+    resumed.mark_turn()
+    expected = saved(world)
+    play_turn(world, ticks, 3)
+    resumed.close()
+
+    reader = LogReader(path)
+    try:
+        assert reader.turns == 4
+        assert saved(reader.world_at(3)) == expected
+        assert saved(reader.world_at()) == saved(world)
+    finally:
+        reader.close()
+
+
+def test_reading_without_materializing_records_nothing(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    world = make_world()
+    log = EventLog(path)
+    log.attach(world)
+    events = log.stats["events"]
+
+    kara = world.characters["Kara"]
+    world.store.tom_dict(kara.row)
+    kara.get_state_for_prompt(tom_targets=["Raymond", "Bao"])
+    assert log.stats["events"] == events
+    log.close()
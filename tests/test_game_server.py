@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+
+from backend_pool import BackendPool, PoolOverloaded
+from game_server import SessionManager, GameServer
+from llm_backends import LLMBackend, StubBackend
+
+SCENARIO = {
+    "setting": "A station",
+    "background": "Oxygen is running low.",
+    "characters": [
+        {"name": "Kara", "emotions": {"fear": 0.2}, "beliefs": {"station_safe": 0.8}, "goals": {"task": {"fix": 0.9}}},
+        {"name": "Bao", "emotions": {"anxiety": 0.3}, "beliefs": {"sabotage": 0.6}, "goals": {}}
+    ],
+    "player_character": "Kara"
+}
+
+
+class FailingBackend(LLMBackend):
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def complete(self, messages, **kwargs):
+        raise self.error
+
+
+def make_server(tmp_path, backend=None, **manager_options) -> GameServer:
+    manager = SessionManager(BackendPool(backend or StubBackend()), state_dir=str(tmp_path / "sessions"),
+                             **manager_options)
+    server = GameServer(manager)
+    server._turn_slots = asyncio.Semaphore(server.max_active_turns)
+    return server
+
+
+async def request(server, method, path, payload=None):
+    return await server.dispatch(method, path, json.dumps(payload).encode("utf-8") if payload is not None else b"")
+
+
+@pytest.mark.parametrize("scenario", ["os:getcwd", "main:setup_space_station_scenario", 42])
+def test_clients_cannot_name_builders(tmp_path, scenario):
+    async def run():
+        server = make_server(tmp_path)
+        status, payload = await request(server, "POST", "/sessions", {"scenario": scenario})
+        assert status == 400
+        assert "Unknown scenario" in payload["error"]
+        assert server.manager.stats["created"] == 0
+
+    asyncio.run(run())
+
+
+def test_sessions_from_named_and_inline_scenarios(tmp_path):
+    async def run():
+        server = make_server(tmp_path)
+        status, named = await request(server, "POST", "/sessions", {"scenario": "space_station"})
+        assert status == 201
+        status, inline = await request(server, "POST", "/sessions", {"scenario": SCENARIO})
+        assert status == 201
+        status, state = await request(server, "GET", f"/sessions/{inline['session_id']}")
+        assert status == 200
+        assert state["player_character"] == "Kara"
+        assert set(state["characters"]) == {"Kara", "Bao"}
+
+    asyncio.run(run())
+
+
+def test_turns_are_counted_and_sessions_survive_eviction(tmp_path):
+    async def run():
+        server = make_server(tmp_path, max_resident=1)
+        first = (await request(server, "POST", "/sessions", {"scenario": SCENARIO}))[1]["session_id"]
+        status, turn = await request(server, "POST", f"/sessions/{first}/turn", {"input": "I check the vents"})
+        assert status == 200 and turn["turn"] == 1
+
+        await request(server, "POST", "/sessions", {"scenario": SCENARIO})
+        manager = server.manager
+        assert first not in manager.sessions and manager.evicted_count() == 1
+
+        # Concurrent requests for an evicted session share one restore
+        restored = await asyncio.gather(*(manager.get(first) for _ in range(3)))
+        assert len({id(session) for session in restored}) == 1
+        assert restored[0].turns == 1
+        assert manager.stats["restores"] == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("error, status, counter", [
+    (PoolOverloaded("full"), 503, "rejected"),
+    (RuntimeError("model down"), 502, "errors")
+])
+def test_failed_turns_are_reported_and_not_counted(tmp_path, error, status, counter):
+    async def run():
+        server = make_server(tmp_path, backend=FailingBackend(error))
+        session_id = (await request(server, "POST", "/sessions", {"scenario": SCENARIO}))[1]["session_id"]
+        result = await request(server, "POST", f"/sessions/{session_id}/turn", {"input": "I wait"})
+        assert result[0] == status
+        assert server.turn_stats[counter] == 1
+        assert server.turn_stats["completed"] == 0
+        assert (await server.manager.get(session_id)).turns == 0
+
+    asyncio.run(run())
+
+
+def test_busy_sessions_cannot_be_deleted(tmp_path):
+    async def run():
+        server = make_server(tmp_path)
+        session_id = (await request(server, "POST", "/sessions", {"scenario": SCENARIO}))[1]["session_id"]
+        session = await server.manager.get(session_id)
+        session.busy = True
+        assert (await request(server, "DELETE", f"/sessions/{session_id}"))[0] == 409
+        session.busy = False
+        assert (await request(server, "DELETE", f"/sessions/{session_id}"))[0] == 200
+        assert (await request(server, "GET", f"/sessions/{session_id}"))[0] == 404
+
+    asyncio.run(run())
@@ -0,0 +1,98 @@
+import math
+import random
+
+import pytest
+
+from history_index import HistoryStore, event_terms, K1, B, NAME_PREFIX
+
+CAST = ["Kara", "Raymond", "Bao"]
+WORDS = ["reactor", "oxygen", "vent", "airlock", "sabotage", "panel", "alarm", "coolant",
+         "hatch", "console", "breach", "log", "engine", "pressure", "signal", "crew"]
+
+
+def mentioned(text: str):
+    return [name for name in CAST if name.lower() in text.lower()]
+
+
+def make_events(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(1, 8))
+        actor = rng.choice(CAST + [""])
+        events.append(" ".join([actor] + words).strip())
+    return events
+
+
+def brute_force(events, text, k=5, characters=(), limit=None, exclude_recent=0):
+    """BM25 over every event, scored from scratch"""
+    documents = []
+    for event in events:
+        terms = event_terms(event)
+        for name in mentioned(event):
+            terms[NAME_PREFIX + name.lower()] += 1
+        documents.append(terms)
+    query = set(event_terms(text))
+    query.update(NAME_PREFIX + name.lower() for name in list(characters) + mentioned(text))
+
+    count = len(documents) if limit is None else min(limit, len(documents))
+    # Lengths are averaged over every stored event, as the index does
+    average_length = sum(sum(terms.values()) for terms in documents) / len(documents)
+    scores = {}
+    for term in query:
+        document_frequency = sum(1 for terms in documents[:count] if term in terms)
+        idf = math.log(1.0 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+        for index, terms in enumerate(documents[:count - exclude_recent]):
+            frequency = terms.get(term, 0)
+            if frequency:
+                norm = K1 * (1.0 - B + B * sum(terms.values()) / average_length)
+                scores[index] = scores.get(index, 0.0) + idf * frequency * (K1 + 1.0) / (frequency + norm)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+@pytest.fixture
+def history(tmp_path):
+    # Few hot events and many postings, so events and index blocks go to disk
+    store = HistoryStore(str(tmp_path / "history.jsonl"), hot_events=16, max_postings=100000,
+                         mentioned=mentioned)
+    events = make_events(600)
+    for event in events:
+        store.append(event)
+    yield store, events
+    store.close()
+
+
+def assert_same_results(results, expected):
+    assert [index for index, _ in results] == [index for index, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected])
+
+
+@pytest.mark.parametrize("text", ["reactor breach", "Kara vents the coolant", "oxygen", "nothing relevant"])
+def test_search_matches_brute_force(history, text):
+    store, events = history
+    assert store.stats["blocks_written"] > 0
+    assert_same_results(store.search(text, k=10), brute_force(events, text, k=10))
+
+
+def test_search_matches_brute_force_with_characters(history):
+    store, events = history
+    assert_same_results(store.search("signal", k=8, characters=["Bao"]),
+                        brute_force(events, "signal", k=8, characters=["Bao"]))
+
+
+@pytest.mark.parametrize("limit, exclude_recent", [(None, 20), (250, 0), (250, 30), (5, 5)])
+def test_search_matches_brute_force_with_limits(history, limit, exclude_recent):
+    store, events = history
+    results = store.search("airlock pressure alarm", k=10, limit=limit, exclude_recent=exclude_recent)
+    assert_same_results(results, brute_force(events, "airlock pressure alarm", k=10,
+                                             limit=limit, exclude_recent=exclude_recent))
+
+
+def test_events_read_back_from_disk(history):
+    store, events = history
+    assert store.stats["compacted"] > 0
+    assert len(store) == len(events)
+    assert store[0] == events[0]
+    assert store[-1] == events[-1]
+    assert store[100:105] == events[100:105]
+    assert list(store) == events
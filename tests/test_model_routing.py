@@ -0,0 +1,101 @@
+import pytest
+
+from llm_backends import LLMBackend, LLMResponse
+from model_routing import ModelRouter, Route
+from response_cache import ResponseCache, CachedBackend
+
+MESSAGES = [{"role": "user", "content": "Appraise the event"}]
+
+
+class ModelBackend(LLMBackend):
+    """Answers per model: a text, or an exception to raise"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+        self.discarded = []
+
+    def complete(self, messages, model="m", temperature=0.7, max_tokens=1000, timeout=None):
+        self.calls.append((model, max_tokens))
+        answer = self.answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        return LLMResponse(text=answer, model=model, usage={"prompt_tokens": 1000, "completion_tokens": 500})
+
+    def discard(self, messages, model="m", temperature=0.7, max_tokens=1000):
+        self.discarded.append((model, max_tokens))
+
+
+def test_tiered_routes_use_the_small_model_with_tighter_limits():
+    router = ModelRouter.tiered(large="big", small="small")
+    backend = ModelBackend({"big": "story", "small": "ok"})
+    router.complete(backend, "narrative", MESSAGES)
+    router.complete(backend, "appraisal", MESSAGES)
+    router.complete(backend, "batch_appraisal", MESSAGES, items=3)
+    assert backend.calls == [("big", 1000), ("small", 500), ("small", 1200)]
+
+
+def test_unknown_call_types_use_the_narrative_route():
+    router = ModelRouter({"narrative": Route("big", 700)})
+    backend = ModelBackend({"big": "ok"})
+    router.complete(backend, "npc", MESSAGES)
+    assert backend.calls == [("big", 700)]
+
+
+def test_invalid_responses_escalate_and_are_discarded():
+    router = ModelRouter.tiered(large="big", small="small")
+    backend = ModelBackend({"big": "good", "small": "bad"})
+    response = router.complete(backend, "npc", MESSAGES, validate=lambda text: text == "good")
+    assert response.text == "good"
+    assert backend.calls == [("small", 800), ("big", 1000)]
+    assert backend.discarded == [("small", 800)]
+    stats = router.summary()["npc"]
+    assert stats["calls"] == 1 and stats["escalated"] == 1 and stats["invalid"] == 1
+    assert stats["models"] == {"small": 1, "big": 1}
+
+
+def test_errors_escalate_and_last_route_errors_propagate():
+    router = ModelRouter.tiered(large="big", small="small")
+    backend = ModelBackend({"big": "good", "small": RuntimeError("timeout")})
+    assert router.complete(backend, "appraisal", MESSAGES).text == "good"
+
+    backend = ModelBackend({"big": RuntimeError("down"), "small": RuntimeError("timeout")})
+    with pytest.raises(RuntimeError, match="down"):
+        router.complete(backend, "appraisal", MESSAGES)
+    assert router.summary()["appraisal"]["errors"] == 3
+
+
+def test_last_routes_response_is_returned_when_none_validate():
+    router = ModelRouter.tiered(large="big", small="small")
+    backend = ModelBackend({"big": "still bad", "small": "bad"})
+
+    def validate(text):
+        raise ValueError(text)
+
+    assert router.complete(backend, "npc", MESSAGES, validate=validate).text == "still bad"
+    assert backend.discarded == [("small", 800), ("big", 1000)]
+
+
+def test_discard_covers_every_route():
+    router = ModelRouter.tiered(large="big", small="small")
+    backend = ModelBackend({})
+    router.discard(backend, "batch_appraisal", MESSAGES, items=3)
+    assert backend.discarded == [("small", 1200), ("big", 1800)]
+
+
+def test_cost_is_charged_per_model_and_not_for_cached_responses():
+    router = ModelRouter.single("priced")
+    router.prices = {"priced": (0.01, 0.02)}
+    backend = CachedBackend(ModelBackend({"priced": "ok"}), ResponseCache())
+    router.complete(backend, "narrative", MESSAGES)
+    router.complete(backend, "narrative", MESSAGES)
+
+    stats = router.summary()["narrative"]
+    assert stats["calls"] == 2 and stats["cached"] == 1
+    assert stats["prompt_tokens"] == 1000 and stats["completion_tokens"] == 500
+    assert stats["cost"] == pytest.approx(0.02)
+    report = router.format_report()
+    assert "narrative" in report and "priced 2" in report and "appraisal" not in report
+
+    router.reset()
+    assert router.summary() == {}
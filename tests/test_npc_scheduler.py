@@ -0,0 +1,61 @@
+import pytest
+
+from character_world_classes import Character, World
+from npc_scheduler import SalienceScheduler
+from tests.helpers import make_world
+
+
+def test_salience_sums_emotion_goal_mentions_and_idle_turns():
+    world = make_world()
+    scheduler = SalienceScheduler()
+    # Nobody has acted yet, so every character counts as fully idle (0.5)
+    assert scheduler.salience(world) == {"Kara": pytest.approx(2.1), "Raymond": pytest.approx(1.9),
+                                         "Bao": pytest.approx(1.5)}
+
+    world.add_to_history("Bao shouts at Raymond")
+    world.add_to_history("Bao opens the hatch")
+    salience = scheduler.salience(world, ["Bao", "Raymond", "Nobody"])
+    assert salience == {"Bao": pytest.approx(2.5), "Raymond": pytest.approx(2.4)}
+
+
+def test_only_recent_history_counts():
+    world = make_world()
+    world.add_to_history("Bao shouts")
+    for _ in range(3):
+        world.add_to_history("The lights flicker")
+    assert SalienceScheduler(history_window=3).salience(world, ["Bao"]) == {"Bao": pytest.approx(1.5)}
+    assert SalienceScheduler(history_window=4).salience(world, ["Bao"]) == {"Bao": pytest.approx(2.0)}
+
+
+def test_select_takes_the_top_k_and_skips_excluded():
+    world = make_world()
+    scheduler = SalienceScheduler(top_k=2)
+    assert scheduler.select(world) == ["Kara", "Raymond"]
+    assert scheduler.select(world, exclude=["Kara"]) == ["Raymond", "Bao"]
+
+
+def test_ties_keep_world_order():
+    characters = [Character(name, {"calm": 0.5}, {}, {"task": {"wait": 0.5}}) for name in "ABCD"]
+    world = World("A station", "", characters, seed=1)
+    assert SalienceScheduler(top_k=3).select(world) == ["A", "B", "C"]
+
+
+def test_characters_that_just_acted_yield_to_idle_ones():
+    characters = [Character(name, {"calm": 0.5}, {}, {"task": {"wait": 0.5}}) for name in "ABC"]
+    world = World("A station", "", characters, seed=1)
+    scheduler = SalienceScheduler(top_k=1)
+    chosen = []
+    for _ in range(3):
+        active = scheduler.select(world)
+        chosen.extend(active)
+        scheduler.record(active)
+    assert chosen == ["A", "B", "C"]
+    assert scheduler.stats["turns"] == 3
+
+
+def test_split_keeps_the_given_order():
+    world = make_world()
+    scheduler = SalienceScheduler(top_k=1)
+    assert scheduler.split(world, ["Bao", "Raymond"]) == (["Raymond"], ["Bao"])
+    assert scheduler.split(world, ["Bao", "Kara"]) == (["Kara"], ["Bao"])
+    assert scheduler.stats["activated"] == 2 and scheduler.stats["local"] == 2
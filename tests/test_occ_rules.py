@@ -0,0 +1,102 @@
+import pytest
+
+from character_world_classes import Character, World
+from occ_rules import AppraisalEvent, RuleBasedAppraiser, describe_event, TOM_CHANGE
+from tests.helpers import make_world
+
+
+def test_ambiguous_actions_go_to_the_model():
+    world = make_world()
+    kara = world.characters["Kara"]
+    assert describe_event(kara, world, "Bao looks around") is None
+    assert describe_event(kara, world, "Bao fixes the panel but damages the vent") is None
+
+
+def test_describe_event_reads_cues():
+    world = make_world()
+    kara = world.characters["Kara"]
+
+    event = describe_event(kara, world, "Suddenly the reactor systems fail")
+    assert event.goal_congruence == {"fix_reactor": "moderately_hindering"}
+    assert event.unexpectedness == "high"
+    assert event.responsibility == "external"
+
+    event = describe_event(kara, world, "I repair the reactor")
+    assert event.goal_congruence == {"fix_reactor": "strongly_facilitating"}
+    assert event.responsibility == "self"
+
+
+def test_named_characters_get_theory_of_mind_observations():
+    world = make_world()
+    kara = world.characters["Kara"]
+
+    event = describe_event(kara, world, "Bao accuses Raymond of sabotage")
+    assert event.responsibility == "other"
+    assert event.confirmed_beliefs == ["sabotage"]
+    assert event.theory_of_mind == {"Bao": {"sabotage": "supports"}, "Raymond": {"sabotage": "supports"}}
+
+    event = describe_event(kara, world, "Raymond refuses, there was no sabotage")
+    assert event.theory_of_mind == {"Raymond": {"sabotage": "contradicts"}}
+
+
+def test_rules_update_theory_of_mind_without_materializing_it():
+    world = make_world()
+    kara = world.characters["Kara"]
+    store = world.store
+    before = store.tom_dict(kara.row)
+
+    event = describe_event(kara, world, "Bao accuses Raymond of sabotage")
+    updates = RuleBasedAppraiser().appraise(kara, event)
+
+    assert updates["theory_of_mind_updates"] == {
+        name: {"sabotage": pytest.approx(min(1.0, before[name]["sabotage"] + TOM_CHANGE))}
+        for name in ("Bao", "Raymond")
+    }
+    assert store.tom_entry_count() == 0
+
+
+def test_appraisal_applies_goal_emotion_and_belief_rules():
+    world = make_world()
+    kara = world.characters["Kara"]
+    event = AppraisalEvent(goal_congruence={"fix_reactor": "strongly_hindering"}, unexpectedness="moderate",
+                           responsibility="external", confirmed_beliefs=["sabotage"],
+                           contradicted_beliefs=["station_safe"])
+    updates = RuleBasedAppraiser().appraise(kara, event)
+
+    assert updates["goal_updates"] == {"task": {"fix_reactor": pytest.approx(0.8)}}
+    # fear: +0.15 negative valence, +0.10 arousal
+    assert updates["emotional_updates"] == {"fear": pytest.approx(0.45)}
+    assert updates["belief_updates"] == {"sabotage": pytest.approx(0.2), "station_safe": pytest.approx(0.7)}
+
+
+def test_values_are_clamped():
+    character = Character("Ines", {"fear": 0.95, "joy": 0.02}, {"safe": 0.05}, {"task": {"escape": 0.98}})
+    world = World("A station", "", [character], seed=1)
+    event = AppraisalEvent(goal_congruence={"escape": "strongly_facilitating"}, unexpectedness="high",
+                           contradicted_beliefs=["safe"])
+    updates = RuleBasedAppraiser().appraise(world.characters["Ines"], event)
+    assert updates["goal_updates"] == {"task": {"escape": 1.0}}
+    assert updates["emotional_updates"] == {"joy": pytest.approx(0.17), "fear": 1.0}
+    assert updates["belief_updates"] == {"safe": 0.0}
+
+
+def test_responsibility_is_explained_only_when_applied():
+    appraiser = RuleBasedAppraiser()
+    event = AppraisalEvent(goal_congruence={"keep_order": "strongly_hindering"}, responsibility="other")
+
+    # Raymond has no other-directed emotion, so nothing is attributed
+    world = make_world()
+    updates = appraiser.appraise(world.characters["Raymond"], event)
+    assert "attributed" not in updates["appraisal_explanation"]
+
+    world.characters["Raymond"].emotions["anger"] = 0.3
+    updates = appraiser.appraise(world.characters["Raymond"], event)
+    assert updates["emotional_updates"]["anger"] == pytest.approx(0.55)
+    assert "attributed to other causes" in updates["appraisal_explanation"]
+
+
+def test_unknown_levels_are_rejected():
+    with pytest.raises(ValueError):
+        AppraisalEvent(goal_congruence={"goal": "somewhat_helpful"})
+    with pytest.raises(ValueError):
+        AppraisalEvent(responsibility="nobody")
@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llm_backends import LLMBackend, LLMResponse
+from request_coalescing import CoalescingBackend, SingleFlight
+
+MESSAGES = [{"role": "user", "content": "What does Bao do?"}]
+
+
+class SlowBackend(LLMBackend):
+    """Holds every call until released, then answers (or raises) per call"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def complete(self, messages, model="m", temperature=0.7, max_tokens=1000, timeout=None):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return LLMResponse(text=f"answer {call}", model=model, usage={"total_tokens": 5})
+
+    def stream(self, messages, model="m", temperature=0.7, max_tokens=1000, timeout=None):
+        with self._lock:
+            self.calls += 1
+        yield "streamed"
+
+
+def wait_for_waiters(flights, count):
+    deadline = time.monotonic() + 5
+    while flights.stats["calls"] < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert flights.stats["calls"] == count
+
+
+def run_concurrently(backend, calls, **kwargs):
+    with ThreadPoolExecutor(calls) as pool:
+        futures = [pool.submit(backend.complete, MESSAGES, **kwargs)]
+        backend.backend.started.wait(5)
+        futures += [pool.submit(backend.complete, MESSAGES, **kwargs) for _ in range(calls - 1)]
+        wait_for_waiters(backend.flights, calls)
+        backend.backend.release.set()
+        return [future.exception() or future.result() for future in futures]
+
+
+def test_identical_concurrent_calls_go_upstream_once():
+    backend = CoalescingBackend(SlowBackend())
+    responses = run_concurrently(backend, 4)
+    assert backend.backend.calls == 1
+    assert [response.text for response in responses] == ["answer 1"] * 4
+    assert [response.cached for response in responses] == [False, True, True, True]
+    assert backend.flights.stats == {"calls": 4, "upstream": 1, "coalesced": 3, "errors": 0}
+    assert backend.flights.in_flight() == 0
+
+    # Once the call has finished, the next one goes upstream again
+    assert backend.complete(MESSAGES).text == "answer 2"
+
+
+def test_different_parameters_are_not_coalesced():
+    backend = CoalescingBackend(SlowBackend())
+    backend.backend.release.set()
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(backend.complete, MESSAGES, temperature=0.2)
+        second = pool.submit(backend.complete, MESSAGES, temperature=0.9)
+        first.result(), second.result()
+    assert backend.backend.calls == 2
+
+
+def test_errors_reach_every_waiting_caller():
+    backend = CoalescingBackend(SlowBackend(error=RuntimeError("model down")))
+    results = run_concurrently(backend, 3)
+    assert [str(result) for result in results] == ["model down"] * 3
+    assert backend.backend.calls == 1
+    assert backend.flights.stats["errors"] == 1
+    assert backend.flights.in_flight() == 0
+
+
+def test_waiting_callers_time_out():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "late"
+
+    with ThreadPoolExecutor(1) as pool:
+        leader = pool.submit(flights.do, "key", slow)
+        wait_for_waiters(flights, 1)
+        with pytest.raises(TimeoutError):
+            flights.do("key", slow, timeout=0.05)
+        release.set()
+        assert leader.result() == ("late", False)
+
+
+def test_streams_are_not_coalesced():
+    backend = CoalescingBackend(SlowBackend())
+    assert list(backend.stream(MESSAGES)) == ["streamed"]
+    assert list(backend.stream(MESSAGES)) == ["streamed"]
+    assert backend.backend.calls == 2 and backend.flights.stats["calls"] == 0
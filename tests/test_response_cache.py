@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from llm_backends import LLMBackend, LLMResponse, StubBackend
+from response_cache import ResponseCache, CachedBackend, make_cache_key
+from story_engine import StoryEngine
+from tests.helpers import make_world
+
+MESSAGES = [{"role": "system", "content": "You narrate."}, {"role": "user", "content": "Open the hatch"}]
+
+
+class ScriptedBackend(LLMBackend):
+    """Answers with the given texts in order, then repeats the last one"""
+
+    def __init__(self, *texts):
+        self.texts = list(texts)
+        self.calls = 0
+
+    def complete(self, messages, model="m", temperature=0.7, max_tokens=1000, timeout=None):
+        text = self.texts[min(self.calls, len(self.texts) - 1)]
+        self.calls += 1
+        if isinstance(text, Exception):
+            raise text
+        return LLMResponse(text=text, model=model, usage={"total_tokens": 3})
+
+
+def test_keys_depend_on_every_input():
+    key = make_cache_key("m", {"temperature": 0.7, "max_tokens": 10}, MESSAGES)
+    assert key == make_cache_key("m", {"max_tokens": 10, "temperature": 0.7}, [dict(m) for m in MESSAGES])
+    assert key != make_cache_key("other", {"temperature": 0.7, "max_tokens": 10}, MESSAGES)
+    assert key != make_cache_key("m", {"temperature": 0.2, "max_tokens": 10}, MESSAGES)
+    assert key != make_cache_key("m", {"temperature": 0.7, "max_tokens": 10}, MESSAGES[:1])
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", {"text": "A"})
+    cache.put("b", {"text": "B"})
+    cache.get("a")
+    cache.put("c", {"text": "C"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"text": "A"} and cache.get("c") == {"text": "C"}
+    assert cache.stats["memory_evictions"] == 1
+
+
+def test_disk_tier_survives_restarts_and_stays_within_budget(tmp_path):
+    cache = ResponseCache(max_entries=1, cache_dir=str(tmp_path), max_disk_bytes=70)
+    cache.put("a", {"text": "A" * 20})
+    cache.put("b", {"text": "B" * 20})
+    assert cache.stats["disk_evictions"] == 0
+    cache.put("c", {"text": "C" * 20})
+    assert cache.stats["disk_evictions"] == 1 and cache.disk_bytes <= 70
+
+    restarted = ResponseCache(cache_dir=str(tmp_path), max_disk_bytes=70)
+    assert restarted.get("a") is None
+    assert restarted.get("b") == {"text": "B" * 20}
+    assert restarted.stats["disk_hits"] == 1
+
+
+def test_corrupt_disk_entries_are_dropped(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.put("a", {"text": "A"})
+    with open(os.path.join(str(tmp_path), "a.json"), "w") as f:
+        f.write("{not json")
+    restarted = ResponseCache(cache_dir=str(tmp_path))
+    assert restarted.get("a") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "a.json"))
+
+
+def test_cached_backend_replays_successes_only():
+    backend = ScriptedBackend(RuntimeError("timeout"), "first", "second")
+    cached = CachedBackend(backend, ResponseCache())
+
+    with pytest.raises(RuntimeError):
+        cached.complete(MESSAGES)
+    response = cached.complete(MESSAGES)
+    assert response.text == "first" and not response.cached
+    replay = cached.complete(MESSAGES)
+    assert replay.text == "first" and replay.cached
+    assert backend.calls == 2
+
+    cached.discard(MESSAGES)
+    assert cached.complete(MESSAGES).text == "second"
+
+
+def test_discard_removes_both_tiers(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cached = CachedBackend(ScriptedBackend("text"), cache)
+    cached.complete(MESSAGES)
+    cached.discard(MESSAGES)
+    assert cache.memory == {} and cache.disk_bytes == 0
+    assert ResponseCache(cache_dir=str(tmp_path)).get(make_cache_key("gpt", {}, MESSAGES)) is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_unparseable_responses_are_not_replayed(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+
+    def play(backend):
+        world = make_world(seed=1)
+        engine = StoryEngine(world, "Kara", backend=backend, cache=cache, appraisal_mode="rules")
+        narrative, result = engine.process_player_input("I open the hatch")
+        engine.close()
+        return narrative, result
+
+    narrative, result = play(ScriptedBackend("not json at all"))
+    assert result == {}
+
+    # The same prompt reaches the model again instead of replaying the broken text
+    backend = StubBackend()
+    narrative, result = play(backend)
+    assert result and "Error" not in narrative
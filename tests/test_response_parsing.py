@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from response_parsing import (ResponseParser, STORY_SCHEMA, APPRAISAL_SCHEMA, decode_json, extract_json,
+                              repair_json, is_batch_appraisal_response)
+
+STORY = {"narrative": "The hatch opens.", "character_actions": {"Bao": "waves"},
+         "world_state_updates": {"hatch": "open"}}
+
+
+def test_fenced_and_bare_json_decode_without_repair():
+    text = json.dumps(STORY)
+    assert decode_json("Here you go:\n```json\n" + text + "\n```\nEnjoy") == (STORY, False)
+    assert decode_json(text) == (STORY, False)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('Sure! {"a": 1, "b": [1, 2,],} trailing', {"a": 1, "b": [1, 2]}),
+    ('{"a": "line\nbreak"}', {"a": "line\nbreak"}),
+    ('{"a": 1, "b": {"c": "cut off', {"a": 1, "b": {"c": "cut off"}}),
+    ('{"a": 1, "b": [1, 2, 3', {"a": 1, "b": [1, 2, 3]}),
+    ('{"a": 1, "b": {"c": tr', {"a": 1}),
+    ('{"a": 1, "b": "x\\', {"a": 1}),
+])
+def test_repair_recovers_truncated_and_malformed_json(text, expected):
+    assert repair_json(text) == expected
+
+
+def test_cut_off_fenced_block_is_repaired():
+    text = "```json\n" + json.dumps(STORY)[:-20]
+    value, repaired = decode_json(text)
+    assert repaired
+    assert value["narrative"] == STORY["narrative"]
+
+
+def test_unrecoverable_text_raises():
+    with pytest.raises(ValueError):
+        extract_json("I cannot help with that.")
+    with pytest.raises(ValueError):
+        repair_json('{"a": tr')
+
+
+def test_schemas_accept_only_complete_responses():
+    assert STORY_SCHEMA.accepts(json.dumps({"narrative": "x"}))
+    assert not STORY_SCHEMA.accepts(json.dumps({"character_actions": {}}))
+    assert not STORY_SCHEMA.accepts(json.dumps({"narrative": "x", "character_actions": "waves"}))
+    assert not APPRAISAL_SCHEMA.accepts("[1, 2]")
+    assert is_batch_appraisal_response(json.dumps({"Kara": {}, "Bao": {}}))
+    assert not is_batch_appraisal_response(json.dumps({"Kara": "calm"}))
+
+
+def test_missing_optional_fields_get_fresh_defaults():
+    parser = ResponseParser()
+    first = parser.parse(json.dumps({"narrative": "x"}), STORY_SCHEMA)
+    first["character_actions"]["Bao"] = "waves"
+    second = parser.parse(json.dumps({"narrative": "y", "world_state_updates": []}), STORY_SCHEMA)
+    assert second == {"narrative": "y", "character_actions": {}, "world_state_updates": {}}
+    assert parser.stats["rerequested"] == 0
+
+
+def test_truncated_response_rerequests_only_missing_fields():
+    parser = ResponseParser()
+    prompts = []
+
+    def rerequest(prompt):
+        prompts.append(prompt)
+        return json.dumps({"world_state_updates": {"hatch": "open"}, "narrative": "ignored"})
+
+    text = '{"narrative": "The hatch opens.", "character_actions": {"Bao": "waves"}, "world_state_up'
+    value = parser.parse(text, STORY_SCHEMA, rerequest=rerequest)
+    assert value == STORY
+    assert len(prompts) == 1 and '"world_state_updates"' in prompts[0] and '"narrative"' not in prompts[0]
+    summary = parser.summary()
+    assert summary["repaired"] == 1 and summary["rerequested"] == 1 and summary["completed"] == 1
+    assert summary["failure_rate"] == 0
+
+
+def test_missing_required_field_fails_after_rerequest():
+    parser = ResponseParser()
+
+    def rerequest(prompt):
+        raise RuntimeError("timed out")
+
+    with pytest.raises(ValueError, match="narrative"):
+        parser.parse(json.dumps({"character_actions": {}}), STORY_SCHEMA, rerequest=rerequest)
+    with pytest.raises(ValueError):
+        parser.parse("no json", STORY_SCHEMA)
+    with pytest.raises(ValueError):
+        parser.parse("[1]", STORY_SCHEMA)
+    summary = parser.summary()
+    assert summary["responses"] == 3 and summary["failed"] == 3 and summary["completed"] == 0
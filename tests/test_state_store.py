@@ -0,0 +1,88 @@
+import pytest
+
+from character_world_classes import Character, World
+from state_store import StateStore
+from tests.helpers import make_world, character_state
+
+
+def test_views_round_trip_through_store():
+    world = make_world()
+    kara = world.characters["Kara"]
+
+    assert kara.emotions.to_dict() == {"fear": 0.2, "trust": 0.7}
+    assert kara.goals.to_dict() == {"task": {"fix_reactor": 0.9}, "emotional": {"stay_calm": 0.5}}
+
+    kara.emotions["anger"] = 0.4
+    kara.beliefs["sabotage"] = 0.3
+    kara.goals["task"]["seal_breach"] = 0.6
+    del kara.emotions["trust"]
+    kara.goals["social"] = {"win_over_bao": 0.2}
+
+    store = world.store
+    assert store.row_dict("emotions", kara.row) == {"fear": 0.2, "anger": 0.4}
+    assert store.row_dict("beliefs", kara.row) == {"station_safe": 0.8, "sabotage": 0.3}
+    assert store.goals_dict(kara.row) == {
+        "task": {"fix_reactor": 0.9, "seal_breach": 0.6},
+        "emotional": {"stay_calm": 0.5},
+        "social": {"win_over_bao": 0.2}
+    }
+    assert "trust" not in kara.emotions
+    assert len(kara.emotions) == 2
+    # Other characters do not gain the new keys
+    assert world.characters["Raymond"].emotions.to_dict() == {"fear": 0.6}
+
+
+def test_update_state_clamps_like_plain_dictionaries():
+    world = make_world()
+    raymond = world.characters["Raymond"]
+    raymond.update_state({"fear": 1.4, "hope": 1.5}, {"station_safe": -0.2}, {}, {"task": {"keep_order": 2.0}})
+
+    # Existing emotions are clamped, new ones are stored as given
+    assert raymond.emotions.to_dict() == {"fear": 1.0, "hope": 1.5}
+    assert raymond.beliefs.to_dict() == {"station_safe": 0.0}
+    assert raymond.goals.to_dict() == {"task": {"keep_order": 1.0}}
+
+
+def test_character_keeps_state_when_joining_a_world():
+    alone = Character("Ines", {"calm": 0.9}, {"door_locked": 0.3}, {"task": {"find_key": 0.4}})
+    alone.theory_of_mind = {"Kara": {"door_locked": 0.6}}
+    world = World("A station", "", [alone], seed=1)
+
+    assert alone.store is world.store
+    assert alone.emotions.to_dict() == {"calm": 0.9}
+    assert alone.goals.to_dict() == {"task": {"find_key": 0.4}}
+    assert world.store.tom_dict(alone.row, targets=["Kara"]) == {"Kara": {"door_locked": 0.6}}
+
+
+def test_bulk_update_matches_single_updates():
+    world = make_world()
+    other = make_world()
+    updates = {"Kara": {"fear": 0.5, "anger": 1.3}, "Bao": {"anxiety": 0.9}}
+
+    world.bulk_update_characters("emotions", updates)
+    for name, values in updates.items():
+        other.characters[name].store.update_row("emotions", other.characters[name].row, values)
+
+    assert character_state(world) == character_state(other)
+    assert world.characters["Kara"].emotions["anger"] == 1.0
+
+
+def test_store_grows_past_its_capacity():
+    store = StateStore(row_capacity=1, column_capacity=1)
+    for index in range(20):
+        row = store.add_row(f"c{index}")
+        store.update_row("beliefs", row, {f"b{column}": column / 20 for column in range(index + 1)})
+
+    assert len(store.rows) == 20
+    assert store.row_dict("beliefs", 19) == {f"b{column}": column / 20 for column in range(20)}
+    assert store.row_dict("beliefs", 0) == {"b0": 0.0}
+
+
+def test_removed_view_key_raises_key_error():
+    world = make_world()
+    bao = world.characters["Bao"]
+    del bao.beliefs["rescue_coming"]
+    with pytest.raises(KeyError):
+        bao.beliefs["rescue_coming"]
+    with pytest.raises(KeyError):
+        bao.goals["task"]["fix_reactor"]
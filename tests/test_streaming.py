@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from llm_backends import StubBackend
+from story_engine import StoryEngine
+from streaming import JSONStringFieldExtractor, REPLACEMENT_CHARACTER
+from tests.helpers import make_world
+
+NARRATIVE = 'Kara said "run!"\n\tThe hatch\\door slams é ☃ \U0001F680 shut/open.'
+
+
+def stream(text: str, size: int) -> str:
+    extractor = JSONStringFieldExtractor("narrative")
+    decoded = "".join(extractor.feed(text[i:i + size]) for i in range(0, len(text), size))
+    assert decoded == extractor.text()
+    return decoded
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64])
+def test_decodes_like_json_at_any_chunk_size(size):
+    response = "```json\n" + json.dumps({"world_state_updates": {}, "narrative": NARRATIVE}) + "\n```"
+    assert stream(response, size) == NARRATIVE
+
+
+@pytest.mark.parametrize("size", [1, 4, 64])
+def test_decodes_raw_non_ascii(size):
+    response = json.dumps({"narrative": NARRATIVE}, ensure_ascii=False)
+    assert stream(response, size) == NARRATIVE
+
+
+def test_stops_at_end_of_field():
+    extractor = JSONStringFieldExtractor("narrative")
+    assert extractor.feed('{"narrative": "done", "character_actions": {"Bao": "x"}}') == "done"
+    assert extractor.done
+    assert extractor.feed('more "text"') == ""
+
+
+def test_waits_for_cut_off_escapes():
+    extractor = JSONStringFieldExtractor("narrative")
+    assert extractor.feed('{"narrative": "a\\') == "a"
+    assert extractor.feed("u00") == ""
+    assert extractor.feed("e9") == "é"
+    # The high surrogate waits for its low half
+    assert extractor.feed("\\ud83d") == ""
+    assert extractor.feed("\\ude80") == "\U0001F680"
+
+
+@pytest.mark.parametrize("escaped, expected", [
+    ("\\u12G4x", REPLACEMENT_CHARACTER + "12G4x"),
+    ("\\ude80x", REPLACEMENT_CHARACTER + "x"),
+    ("\\ud83dx", REPLACEMENT_CHARACTER + "x"),
+    ("\\ud83d\\u0041", REPLACEMENT_CHARACTER + "A")
+])
+def test_invalid_escapes_become_replacement_characters(escaped, expected):
+    for size in (1, 3, 100):
+        assert stream('{"narrative": "' + escaped + '"}', size) == expected
+
+
+def test_truncated_stream_does_not_raise():
+    extractor = JSONStringFieldExtractor("narrative")
+    assert extractor.feed('{"narrative": "cut \\u00') == "cut "
+    assert not extractor.done
+
+
+def test_failed_streamed_turn_prints_its_error(capsys):
+    engine = StoryEngine(make_world(), "Kara", backend=StubBackend())
+
+    def failing_turn(on_text):
+        on_text("The hatch opens and")
+        return "Error processing your input: timed out", {}
+
+    def successful_turn(on_text):
+        on_text("The hatch opens.")
+        return "The hatch opens.", {"narrative": "The hatch opens."}
+
+    engine._print_streamed(failing_turn)
+    output = capsys.readouterr().out
+    assert "The hatch opens and" in output
+    assert "Error processing your input: timed out" in output
+
+    engine._print_streamed(successful_turn)
+    assert capsys.readouterr().out.count("The hatch opens.") == 1
+    engine.close()
@@ -0,0 +1,31 @@
+from tests.helpers import make_world, character_state
+
+
+def test_theory_of_mind_defaults_follow_own_beliefs_until_read():
+    world = make_world()
+    store = world.store
+    kara = world.characters["Kara"]
+
+    defaults = store.tom_dict(kara.row)
+    assert set(defaults) == {"Raymond", "Bao"}
+    for beliefs in defaults.values():
+        for belief, value in beliefs.items():
+            assert abs(value - kara.beliefs[belief]) <= 0.2 + 1e-9
+            assert 0.0 <= value <= 1.0
+    # Reading through the store stores nothing
+    assert store.tom_entry_count() == 0
+
+    kara.beliefs["station_safe"] = 0.1
+    assert store.tom_dict(kara.row)["Raymond"]["station_safe"] != defaults["Raymond"]["station_safe"]
+
+    # Reading through the view materializes the entry, which then stops following
+    value = kara.theory_of_mind["Raymond"]["station_safe"]
+    assert store.tom_entry_count() > 0
+    kara.beliefs["station_safe"] = 0.9
+    assert kara.theory_of_mind["Raymond"]["station_safe"] == value
+
+
+def test_theory_of_mind_offsets_depend_only_on_seed():
+    first, second, other = make_world(seed=3), make_world(seed=3), make_world(seed=4)
+    assert character_state(first) == character_state(second)
+    assert character_state(first) != character_state(other)
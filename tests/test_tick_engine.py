@@ -0,0 +1,106 @@
+import pytest
+
+from tick_engine import TickEngine, UrgencyPressure
+from tests.helpers import make_world, character_state
+
+
+def test_emotions_decay_toward_the_level_first_seen():
+    world = make_world()
+    ticks = TickEngine(world, decay=0.1, contagion=0.0, decay_rates={"trust": 0.5})
+    kara = world.characters["Kara"]
+    kara.emotions["fear"] = 0.6
+    kara.emotions["trust"] = 0.1
+
+    ticks.run()
+    assert kara.emotions["fear"] == pytest.approx(0.56)
+    assert kara.emotions["trust"] == pytest.approx(0.4)
+    # Values already at rest are not rewritten
+    assert ticks.stats["updated"] == 2
+
+
+def test_rest_levels_override_the_first_values_seen():
+    world = make_world()
+    ticks = TickEngine(world, decay=0.5, contagion=0.0, rest_levels={"fear": 0.0})
+    ticks.run()
+    assert world.characters["Kara"].emotions["fear"] == pytest.approx(0.1)
+    assert world.characters["Raymond"].emotions["fear"] == pytest.approx(0.3)
+
+
+def test_emotions_spread_between_characters_that_have_them():
+    world = make_world()
+    TickEngine(world, decay=0.0, contagion=0.1).run()
+    state = character_state(world)
+    assert state["Kara"]["emotions"]["fear"] == pytest.approx(0.24)
+    assert state["Raymond"]["emotions"]["fear"] == pytest.approx(0.56)
+    # Nobody else is anxious, and nobody gains emotions they do not have
+    assert state["Bao"]["emotions"] == {"anxiety": pytest.approx(0.3)}
+
+
+def test_clocks_stop_at_zero_and_press_on_goals():
+    world = make_world()
+    world.update_world_state({"oxygen": 1.0})
+    ticks = TickEngine(world, decay=0.0, contagion=0.0, clocks={"oxygen": -0.3},
+                       pressures=[UrgencyPressure("oxygen", calm=10.0, critical=0.0, rate=0.1)])
+    ticks.run(5)
+    assert world.state["oxygen"] == 0.0
+
+    ticks.clocks = {}
+    ticks.run()
+    # Only task goals grow under the pressure
+    state = character_state(world)
+    before = character_state(make_world())
+    for name in ("Kara", "Raymond"):
+        for goal, value in state[name]["goals"].get("task", {}).items():
+            assert value > before[name]["goals"]["task"][goal]
+    assert state["Kara"]["goals"]["emotional"] == {"stay_calm": pytest.approx(0.5)}
+    assert state["Bao"]["goals"] == before["Bao"]["goals"]
+
+
+def test_pressure_is_linear_between_calm_and_critical():
+    world = make_world()
+    world.update_world_state({"oxygen": 5.0})
+    TickEngine(world, pressures=[UrgencyPressure("oxygen", calm=10.0, critical=0.0, rate=0.1,
+                                                 goals=[("task", "keep_order")])]).run()
+    goals = character_state(world)
+    # Pressure 0.5 at rate 0.1: keep_order moves 5% of the way to 1
+    assert goals["Raymond"]["goals"]["task"]["keep_order"] == pytest.approx(0.81)
+    assert goals["Kara"]["goals"]["task"]["fix_reactor"] == pytest.approx(0.9)
+
+
+def test_one_long_run_matches_single_ticks():
+    def engine():
+        world = make_world()
+        world.update_world_state({"oxygen": 2.0})
+        world.characters["Kara"].emotions["fear"] = 0.9
+        return world, TickEngine(world, decay=0.05, contagion=0.03, clocks={"oxygen": -0.25},
+                                 pressures=[UrgencyPressure("oxygen", calm=2.0, critical=0.0, rate=0.2)])
+
+    world, ticks = engine()
+    stepped, single = engine()
+    ticks.run(12)
+    for _ in range(12):
+        single.run()
+
+    assert world.state["oxygen"] == stepped.state["oxygen"] == 0.0
+    expected = character_state(stepped)
+    for name, dimensions in character_state(world).items():
+        for dimension in ("emotions", "beliefs"):
+            assert dimensions[dimension] == pytest.approx(expected[name][dimension])
+        for goal_type, goals in dimensions["goals"].items():
+            assert goals == pytest.approx(expected[name]["goals"][goal_type])
+
+
+def test_a_run_writes_one_bulk_update_per_dimension():
+    world = make_world()
+    world.update_world_state({"oxygen": 0.0})
+    events = []
+    world.store.recorder = events.append
+    ticks = TickEngine(world, decay=0.1, pressures=[UrgencyPressure("oxygen", calm=10.0, critical=0.0)])
+    world.characters["Kara"].emotions["fear"] = 0.6
+    events.clear()
+
+    ticks.run(50)
+    bulk = [event for event in events if event["e"] == "bulk"]
+    assert sorted(event["d"] for event in bulk) == ["emotions", "goals"]
+    assert ticks.stats == {"runs": 1, "ticks": 50, "updated": sum(len(event["v"]) for event in bulk)}
+    assert ticks.run(0) == 0 and ticks.stats["runs"] == 1
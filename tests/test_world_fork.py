@@ -0,0 +1,58 @@
+import numpy as np
+
+from tests.helpers import make_world, character_state
+
+
+def test_fork_is_isolated_in_both_directions():
+    world = make_world()
+    world.add_to_history("Kara checks the reactor.")
+    world.update_world_state({"oxygen": 24.0})
+    before = character_state(world)
+
+    fork = world.fork()
+    assert character_state(fork) == before
+
+    fork.characters["Kara"].emotions["fear"] = 0.9
+    fork.characters["Bao"].goals["task"] = {"hide": 0.4}
+    fork.characters["Raymond"].theory_of_mind["Kara"] = {"station_safe": 0.05}
+    fork.update_world_state({"oxygen": 12.0})
+    fork.add_to_history("Bao hides in the vents.")
+
+    assert character_state(world) == before
+    assert world.state == {"oxygen": 24.0}
+    assert list(world.history) == ["Kara checks the reactor."]
+
+    world.characters["Raymond"].beliefs["sabotage"] = 0.95
+    world.characters["Kara"].theory_of_mind["Bao"]["sabotage"] = 0.0
+    world.add_to_history("Raymond accuses Bao.")
+
+    fork_state = character_state(fork)
+    assert "sabotage" not in fork_state["Raymond"]["beliefs"]
+    assert fork_state["Kara"]["emotions"]["fear"] == 0.9
+    assert fork_state["Raymond"]["theory_of_mind"]["Kara"]["station_safe"] == 0.05
+    assert list(fork.history) == ["Kara checks the reactor.", "Bao hides in the vents."]
+    assert fork.state == {"oxygen": 12.0}
+
+
+def test_fork_of_a_fork_is_isolated():
+    world = make_world()
+    first = world.fork()
+    first.characters["Kara"].emotions["fear"] = 0.5
+    second = first.fork()
+    second.characters["Kara"].emotions["fear"] = 0.1
+
+    assert world.characters["Kara"].emotions["fear"] == 0.2
+    assert first.characters["Kara"].emotions["fear"] == 0.5
+    assert second.characters["Kara"].emotions["fear"] == 0.1
+
+
+def test_fork_shares_arrays_until_written():
+    world = make_world()
+    fork = world.fork()
+    assert all(fork.store.arrays[dimension] is world.store.arrays[dimension] for dimension in world.store.arrays)
+
+    fork.characters["Kara"].emotions["fear"] = 0.3
+    assert fork.store.arrays["emotions"] is not world.store.arrays["emotions"]
+    assert fork.store.arrays["beliefs"] is world.store.arrays["beliefs"]
+    assert np.isclose(world.store.arrays["emotions"][world.characters["Kara"].row,
+                                                     world.store.columns["emotions"].get("fear")], 0.2)
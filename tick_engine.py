@@ -0,0 +1,199 @@
+import threading
+from typing import Dict, Tuple, Any, Optional, Iterable
+
+import numpy as np
+
+from character_world_classes import World
+
+# Fraction of the distance to its resting level an emotion moves back per tick
+DEFAULT_DECAY = 0.01
+# Fraction of the distance to the cast's mean an emotion moves per tick
+DEFAULT_CONTAGION = 0.005
+
+
+class UrgencyPressure:
+    def __init__(self, state_key: str, calm: float, critical: float,
+                 goals: Iterable[Any] = ("task",), rate: float = 0.01):
+        """
+        A world state value that makes goals more urgent as it nears a
+        critical level, e.g. life_support_hours_remaining falling to 0.
+
+        Args:
+            state_key: World state key read each tick
+            calm: Value at which the pressure is 0
+            critical: Value at which the pressure is 1 (the pressure moves
+                linearly in between and stays at 0 or 1 beyond)
+            goals: Goal types, or (goal_type, goal) keys, that grow more urgent
+            rate: Fraction of the distance to 1 a goal grows per tick at full pressure
+        """
+        self.state_key = state_key
+        self.calm = calm
+        self.critical = critical
+        self.goals = frozenset(goals)
+        self.rate = rate
+
+    def levels(self, values: np.ndarray) -> np.ndarray:
+        """Pressure in [0, 1] for each value of the state key"""
+        if self.critical == self.calm:
+            return (values == self.critical).astype(float)
+        return np.clip((values - self.calm) / (self.critical - self.calm), 0.0, 1.0)
+
+    def applies_to(self, goal_key: Tuple[str, str]) -> bool:
+        return goal_key[0] in self.goals or goal_key in self.goals
+
+
+class TickEngine:
+    def __init__(self, world: World, decay: float = DEFAULT_DECAY, contagion: float = DEFAULT_CONTAGION,
+                 decay_rates: Optional[Dict[str, float]] = None,
+                 contagion_rates: Optional[Dict[str, float]] = None,
+                 rest_levels: Optional[Dict[str, float]] = None,
+                 pressures: Iterable[UrgencyPressure] = (),
+                 clocks: Optional[Dict[str, float]] = None):
+        """
+        Advance character state between model calls in fixed time steps, so
+        emotions settle and goals grow urgent without calling the model.
+
+        Each tick, for every character at once:
+        - emotions decay toward their resting level (the value the engine
+          first saw them at, unless given in rest_levels)
+        - emotions spread: each moves toward the mean of that emotion over the
+          other characters who have it
+        - goals named by a pressure grow toward 1 in proportion to it
+        - clock world state values change by their rate (never below 0)
+
+        The ticks of a run work on dense copies of the emotion and goal arrays
+        and the changed values are written back with one bulk update per
+        dimension, so a run is recorded as a few events however many ticks
+        it has.
+
+        Args:
+            world: The world whose characters are advanced
+            decay: Default decay rate per tick
+            contagion: Default contagion rate per tick
+            decay_rates: Decay rate per emotion, overriding decay
+            contagion_rates: Contagion rate per emotion, overriding contagion
+            rest_levels: Resting level per emotion for every character
+            pressures: World state values that make goals urgent
+            clocks: World state key -> change per tick, e.g.
+                {"life_support_hours_remaining": -0.01}
+        """
+        self.world = world
+        self.decay = decay
+        self.contagion = contagion
+        self.decay_rates = dict(decay_rates or {})
+        self.contagion_rates = dict(contagion_rates or {})
+        self.rest_levels = dict(rest_levels or {})
+        self.pressures = list(pressures)
+        self.clocks = dict(clocks or {})
+        self.stats = {"runs": 0, "ticks": 0, "updated": 0}
+        self._lock = threading.Lock()
+        self._rest = np.empty((0, 0))
+        self._resting_levels(*self._present("emotions"))
+
+    def run(self, ticks: int = 1) -> int:
+        """
+        Advance the world by a number of ticks.
+
+        Returns:
+            Number of character values changed
+        """
+        if ticks <= 0:
+            return 0
+        updated = 0
+        emotions, present = self._present("emotions")
+        if emotions.size:
+            updated += self._write("emotions", emotions, present, self._advance_emotions(emotions, present, ticks))
+        goals, goals_present = self._present("goals")
+        clock_values = self._clock_values(ticks)
+        if goals.size and self.pressures:
+            updated += self._write("goals", goals, goals_present,
+                                   self._advance_goals(goals, goals_present, clock_values, ticks))
+        if clock_values:
+            self.world.update_world_state({key: float(values[-1]) for key, values in clock_values.items()})
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["ticks"] += ticks
+            self.stats["updated"] += updated
+        return updated
+
+    def _present(self, dimension: str) -> Tuple[np.ndarray, np.ndarray]:
+        """A copy of the used part of a dimension's array and which values exist"""
+        store = self.world.store
+        values = store.arrays[dimension][:len(store.rows), :len(store.columns[dimension])].copy()
+        return values, ~np.isnan(values)
+
+    def _rates(self, default: float, overrides: Dict[str, float], count: int) -> np.ndarray:
+        """Per-emotion rate vector over the emotion columns"""
+        rates = np.full(count, default)
+        schema = self.world.store.columns["emotions"]
+        for emotion, rate in overrides.items():
+            column = schema.get(emotion)
+            if column is not None and column < count:
+                rates[column] = rate
+        return rates
+
+    def _resting_levels(self, emotions: np.ndarray, present: np.ndarray) -> np.ndarray:
+        """Resting level of every present emotion (0 where absent)"""
+        rest = self._rest
+        if rest.shape != emotions.shape:
+            grown = np.full(emotions.shape, np.nan)
+            grown[:rest.shape[0], :rest.shape[1]] = rest
+            rest = self._rest = grown
+        unseen = present & np.isnan(rest)
+        rest[unseen] = emotions[unseen]
+        schema = self.world.store.columns["emotions"]
+        for emotion, level in self.rest_levels.items():
+            column = schema.get(emotion)
+            if column is not None and column < rest.shape[1]:
+                rest[:, column] = level
+        return np.where(present, rest, 0.0)
+
+    def _advance_emotions(self, emotions: np.ndarray, present: np.ndarray, ticks: int) -> np.ndarray:
+        rest = self._resting_levels(emotions, present)
+        mask = present.astype(float)
+        others = present.sum(axis=0) - 1
+        decay = self._rates(self.decay, self.decay_rates, emotions.shape[1]) * mask
+        contagion = self._rates(self.contagion, self.contagion_rates, emotions.shape[1]) * mask * (others > 0)
+        divisor = np.maximum(others, 1)
+
+        values = np.where(present, emotions, 0.0)
+        for _ in range(ticks):
+            others_mean = (values.sum(axis=0) - values) / divisor
+            values += decay * (rest - values) + contagion * (others_mean - values)
+            np.clip(values, 0.0, 1.0, out=values)
+        return values
+
+    def _clock_values(self, ticks: int) -> Dict[str, np.ndarray]:
+        """Each clock's value after every tick of this run"""
+        steps = np.arange(1, ticks + 1, dtype=float)
+        values = {}
+        for key, rate in self.clocks.items():
+            start = self.world.state.get(key)
+            if isinstance(start, (int, float)) and not isinstance(start, bool):
+                values[key] = np.maximum(start + rate * steps, 0.0)
+        return values
+
+    def _advance_goals(self, goals: np.ndarray, present: np.ndarray,
+                       clock_values: Dict[str, np.ndarray], ticks: int) -> np.ndarray:
+        # growth[t, column]: fraction of the distance to 1 a goal grows at tick t
+        keys = self.world.store.columns["goals"].keys[:goals.shape[1]]
+        growth = np.zeros((ticks, goals.shape[1]))
+        for pressure in self.pressures:
+            if pressure.state_key in clock_values:
+                levels = pressure.levels(clock_values[pressure.state_key])
+            else:
+                value = self.world.state.get(pressure.state_key)
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                levels = np.full(ticks, pressure.levels(np.array([float(value)]))[0])
+            columns = np.array([pressure.applies_to(key) for key in keys], dtype=bool)
+            growth[:, columns] += pressure.rate * levels[:, None]
+        remaining = np.prod(1.0 - np.clip(growth, 0.0, 1.0), axis=0)
+        return np.where(present, 1.0 - (1.0 - goals) * remaining, 0.0)
+
+    def _write(self, dimension: str, old: np.ndarray, present: np.ndarray, new: np.ndarray) -> int:
+        """Write the present values that changed back to the store"""
+        rows, columns = np.nonzero(present & (new != old))
+        if len(rows):
+            self.world.store.bulk_update(dimension, rows, columns, new[rows, columns])
+        return len(rows)